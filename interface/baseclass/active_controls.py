@@ -58,9 +58,42 @@ class ActiveBar(ThemableBehavior, MDBoxLayout):
         u.get_root_screen(self).screen_manager.get_screen("ACTIVE").list_item.update_values(controller.values)
         self.refresh()
 
+    def show_program_controls(self, show: bool = True) -> None:
+        """Show the Pause and Abort buttons while a wave-program is running."""
+        for button in (self.ids.program_button, self.ids.abort_button):
+            button.disabled = not show
+            button.opacity = 1 if show else 0
+        self.ids.program_button.text = "Pause"
+        self.ids.program_button.icon = "pause"
+
+    def toggle_program(self) -> None:
+        """The Pause (or Resume) Button in the ActiveBar was pressed."""
+        runner = u.get_root_screen(self).screen_manager.get_screen("ACTIVE").program_runner
+        if not runner:
+            return
+        if runner.paused:
+            logger.debug('[UI] Resume Program Clicked...')
+            runner.resume()
+            self.ids.program_button.text = "Pause"
+            self.ids.program_button.icon = "pause"
+        else:
+            logger.debug('[UI] Pause Program Clicked...')
+            runner.pause()
+            self.ids.program_button.text = "Resume"
+            self.ids.program_button.icon = "play"
+
+    def abort_program(self) -> None:
+        """The Abort Button in the ActiveBar was pressed."""
+        logger.debug('[UI] Abort Program Clicked...')
+        runner = u.get_root_screen(self).screen_manager.get_screen("ACTIVE").program_runner
+        if runner:
+            runner.abort()
+        self.show_program_controls(False)
+
     def retract(self):
         """The Retract Button in the ActiveBar was pressed."""
         logger.debug('[UI] Retract Clicked, Retracting Tabs...')
+        self.abort_program()
         self.profile_name = "wait..."
         self.ids.invert_button.disabled = True
         self.ids.save_button.disabled = True
@@ -71,6 +104,8 @@ class ActiveBar(ThemableBehavior, MDBoxLayout):
 
         # by setting this `deactivating` it will trigger behavior on the `on_enter` of the active screen
         u.get_root_screen(self).screen_manager.get_screen("ACTIVE").deactivating = True
+        # and by setting `deactivate_required` the profile is deactivated on the `on_enter` of the profiles screen
+        controller.deactivate_required = True
 
         u.get_root_screen(self).navigation_bar.set_current(0)  # shift nav-bar to PROFILES tab
         u.get_root_screen(self).screen_manager.current = "PROFILES"  # shift to the active profiles screen
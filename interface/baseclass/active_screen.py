@@ -1,3 +1,6 @@
+import time
+import threading
+
 from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 from kivy.properties import (
@@ -16,16 +19,27 @@ from utils import (
 )
 
 from utils.controller import controller, Surface
+from utils import programs
+from utils.eta import CostModel
+from utils.duty import DutyCycleExceeded
+
+# predicted move times to and between the profiles, shared by the PROFILES and ACTIVE screens
+costs = CostModel(controller)
 
 
 class SurfActiveScreen(MDScreen):
     username = StringProperty()
     deactivating = BooleanProperty()
     activating = BooleanProperty()
+    # the username of the profile being switched away from, when switching directly between profiles
+    switching_from = StringProperty(allownone=True)
 
     def __init__(self, *args, **kwargs):
         logger.debug('[UI] Initializing: ActiveScreen')
         MDScreen.__init__(self, *args, **kwargs)
+        self.program_runner = None
+        # time.monotonic() at which the profile being activated is predicted to be ready
+        self.ready_at = None
         Clock.schedule_once(self.post_init)
 
     def post_init(self, *args, **kwargs):
@@ -40,16 +54,108 @@ class SurfActiveScreen(MDScreen):
         # update the Control Panel
         self.ids.control_panel.enable_controls(username)
 
+    def run_program(self, program: dict) -> None:
+        """Run a wave-program, following each of its steps on this screen."""
+        if self.program_runner and self.program_runner.running:
+            logger.info(f'[UI] "{self.program_runner.name}" is already running.')
+            return
+
+        self.program_runner = programs.ProgramRunner(
+            controller,
+            program,
+            # the runner calls these from its own thread, the UI is only updated from the kivy thread
+            on_step=lambda step: Clock.schedule_once(lambda dt: self.program_step(step)),
+            on_finish=lambda runner: Clock.schedule_once(lambda dt: self.program_finished()),
+        )
+        root = u.get_root_screen(self)
+        root.active_bar.show()
+        root.active_bar.show_program_controls()
+        root.navigation_bar.set_current(1)
+        root.screen_manager.current = "ACTIVE"
+        self.program_runner.start()
+
+    def program_step(self, step) -> None:
+        """Show the positions reached by a step of the running wave-program."""
+        if controller.active_profile:
+            for surface_name, surface_value in controller.values.items():
+                self.ids.control_panel.tab_control_ids[surface_name].value = surface_value
+            u.get_root_screen(self).active_bar.refresh()
+        else:
+            self.ids.control_panel.disable_controls()
+
+    def program_finished(self) -> None:
+        root = u.get_root_screen(self)
+        root.active_bar.show_program_controls(False)
+        if not controller.active_profile:
+            root.active_bar.hide()
+            self.ids.control_panel.disable_controls()
+
     def on_pre_enter(self):
         logger.info('SurfActiveScreen.on_pre_enter.begin')
         if self.activating and controller.active_profile:
             logger.info('SurfActiveScreen.activating = True')
-            controller.activate_profile(controller.active_profile)
-            u.get_root_screen(self).active_bar.refresh()
+            costs.refresh()
+            self.start_countdown(costs.eta(controller.active_profile))
+            # the move runs off the kivy thread, so that the countdown is drawn while the surfaces move
+            threading.Thread(
+                target=self.activate_profile,
+                args=(self.switching_from, controller.active_profile),
+                name='SurfActivate',
+                daemon=True,
+            ).start()
 
             self.activating = False
+            self.switching_from = None
         logger.info('SurfActiveScreen.on_pre_enter.end')
 
+    def activate_profile(self, from_profile, to_profile) -> None:
+        message, refused = "", False
+        try:
+            if from_profile:
+                controller.transition_profile(from_profile, to_profile)
+            else:
+                controller.activate_profile(to_profile)
+        except DutyCycleExceeded as e:
+            # the list item made `to_profile` the active profile before the move, the surfaces are still
+            # where `from_profile` (or nothing) put them, so Save must not write them into `to_profile`
+            controller.active_profile = from_profile
+            message, refused = f"not moved, cooling for {round(e.delay)}s", True
+        finally:
+            Clock.schedule_once(lambda dt: self.profile_ready(message, refused))
+
+    def profile_ready(self, message: str = "", refused: bool = False) -> None:
+        self.ready_at = None
+        self.ids.countdown.text = message
+        if refused:
+            self.profile_refused()
+        if controller.active_profile:
+            u.get_root_screen(self).active_bar.refresh()
+
+    def profile_refused(self) -> None:
+        """Put the list items, ActiveBar and controls back as they were before a refused activation."""
+        profiles_screen = u.get_screen(self, "PROFILES")
+        if controller.active_profile:
+            profiles_screen.set_all_list_item_buttons('SWITCH')
+            self.list_item = profiles_screen.get_list_item(controller.active_profile)
+            self.list_item.ids.activate_button.text = 'STOP'
+            for surface_name, surface_value in controller.values.items():
+                self.ids.control_panel.tab_control_ids[surface_name].value = surface_value
+        else:
+            profiles_screen.set_all_list_item_buttons('START')
+            u.get_root_screen(self).active_bar.hide()
+            self.ids.control_panel.disable_controls()
+
+    def start_countdown(self, seconds: float) -> None:
+        """Count down to when the profile being activated is predicted to be ready."""
+        self.ready_at = time.monotonic() + seconds
+        self.count_down()
+        Clock.schedule_interval(self.count_down, 0.1)
+
+    def count_down(self, *args):
+        if self.ready_at is None:
+            return False
+        self.ids.countdown.text = f"ready in {max(self.ready_at - time.monotonic(), 0):.1f}s"
+
     def on_pre_leave(self):
         """Disable Controls, Set values to 'Off'."""
         logger.info('SurfActiveScreen.on_pre_leave.begin')
@@ -103,7 +209,13 @@ class ControlPanel(BoxLayout):
     def invert(self) -> None:
         """Mirror the Controls, either `Goofy` or `Regular` was pressed."""
         logger.info("----- Invert Pressed -----")
-        for surface_name, surface_value in controller.invert().items():
+        try:
+            values = controller.invert()
+        except DutyCycleExceeded as e:
+            logger.warning(f"[UI] not inverted, {e}")
+            u.get_screen(self, "ACTIVE").ids.countdown.text = f"not moved, cooling for {round(e.delay)}s"
+            return
+        for surface_name, surface_value in values.items():
             self.tab_control_ids[surface_name].value = surface_value
 
     def update_profile(self) -> None:
@@ -129,7 +241,10 @@ class TabControl(MDBoxLayout):
 
     def increment(self, *args) -> None:
         logger.info("----- Increment Pressed -----")
-        self.value = controller.surfaces[self.id].increment()
+        try:
+            self.value = controller.surfaces[self.id].increment()
+        except DutyCycleExceeded as e:
+            logger.warning(f"[UI] {self.id} not incremented, {e}")
         u.get_root_screen(self).active_bar.refresh()
 
     def decrement(self, *args) -> None:
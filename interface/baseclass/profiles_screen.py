@@ -15,6 +15,7 @@ from utils import (
 from utils.controller import controller
 
 from interface.baseclass.profiles_screen_list_item import SurfListItem
+from interface.baseclass.active_screen import costs
 
 
 class SurfProfilesScreen(MDScreen):
@@ -30,11 +31,21 @@ class SurfProfilesScreen(MDScreen):
 
     def on_enter(self):
         logger.info("SurfProfilesScreen.on_pre_enter.begin")
-        if controller.active_profile:
-            controller.deactivate_profile()
-            u.get_root_screen(self).active_bar.hide()
+        # the active profile stays active when this screen is entered from the navigation bar,
+        # so that another profile can be switched to directly, it is only deactivated by Retract
+        if controller.active_profile and controller.deactivate_required:
+            self.deactivate_active_profile()
+        self.refresh_etas()
         logger.info("SurfProfilesScreen.on_pre_enter.end")
 
+    def deactivate_active_profile(self) -> None:
+        """Retract the active profile and reset the ActiveBar, ACTIVE screen and list item buttons."""
+        controller.deactivate_required = False
+        controller.deactivate_profile()
+        u.get_root_screen(self).active_bar.hide()
+        u.get_screen(self, "ACTIVE").ids.control_panel.disable_controls()
+        self.set_all_list_item_buttons('START')
+
     def refresh_visible_profiles(self, *args, **kwargs):
         logger.info('[UI] Refreshing Visible Profiles')
         configured_usernames = {profile['username'] for profile in u.Profile.read_configs()}
@@ -57,7 +68,24 @@ class SurfProfilesScreen(MDScreen):
             logger.debug(f'[UI] Removing Visible Profile: {remove_username}')
             self.ids._list.remove_widget([c for c in self.ids._list.children if c.id == remove_username][0])
 
+        self.refresh_etas()
+
+    def refresh_etas(self, *args) -> None:
+        """Show how long each profile would take to be ready, from the current positions."""
+        costs.refresh()
+        etas = costs.etas()
+        for profile_list_item in self.ids._list.children:
+            seconds = etas.get(profile_list_item.id)
+            if seconds is None:
+                profile_list_item.eta = ""
+            elif seconds:
+                profile_list_item.eta = f"ready in {seconds:.1f}s"
+            else:
+                profile_list_item.eta = "ready"
+
+    def get_list_item(self, username: str) -> SurfListItem:
+        return [c for c in self.ids._list.children if c.id == username][0]
 
     def set_all_list_item_buttons(self, button_text: str) -> None:
-        for profile_list_item in self.ids._list.ids:
+        for profile_list_item in self.ids._list.children:
             profile_list_item.ids.activate_button.text = button_text
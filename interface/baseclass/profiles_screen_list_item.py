@@ -14,6 +14,7 @@ from kivymd.uix.dialog import MDDialog
 
 from utils import (
     logger,
+    history,
     utilities as u
 )
 from utils.controller import controller
@@ -30,6 +31,8 @@ class SurfListItem(ThemableBehavior, ButtonBehavior, MDBoxLayout):
     center_value = NumericProperty()
     starboard_value = NumericProperty()
     bar_color = ColorProperty((1, 0, 0, 1))
+    # predicted time from the current positions to this profile's, see `SurfProfilesScreen.refresh_etas()`
+    eta = StringProperty()
     activate_clicked = BooleanProperty(False)
 
     def __init__(self, **kwargs):
@@ -53,7 +56,12 @@ class SurfListItem(ThemableBehavior, ButtonBehavior, MDBoxLayout):
             self.activate()
         elif self.activate_clicked and self.ids.activate_button.text == 'STOP':
             self.activate_clicked = False
+            # withdraw the active profile first, only then is this item's next START a fresh activation
+            self.screen.deactivate_active_profile()
             self.deactivate()
+        elif self.activate_clicked and self.ids.activate_button.text == 'SWITCH':
+            self.activate_clicked = False
+            self.switch_to()
         else:
             self.show_dialogue()
         logger.info('SurfListItem.event_handler.end')
@@ -64,18 +72,33 @@ class SurfListItem(ThemableBehavior, ButtonBehavior, MDBoxLayout):
 
     def activate(self) -> None:
         logger.info('SurfListItem.activate.begin')
-        if controller.active_profile:
-            logger.info("NOPE! There is already an active profile!")
+        if controller.active_profile == self.username:
+            logger.info(f'SurfListItem.activate - stopping "{self.username}"')
+            self.screen.deactivate_active_profile()
+        elif controller.active_profile:
+            self.switch_to()
         else:
             controller.active_profile = self.username
             u.get_root_screen(self).active_bar.show()
             u.get_root_screen(self).navigation_bar.set_current(1)
             u.get_root_screen(self).screen_manager.current = "ACTIVE"
             u.get_screen(self, "ACTIVE").activate(self.username, self)
-            u.get_screen(self, "PROFILES").set_all_list_item_buttons('START')
+            u.get_screen(self, "PROFILES").set_all_list_item_buttons('SWITCH')
             self.ids.activate_button.text = 'STOP'
         logger.info('SurfListItem.activate.end')
 
+    def switch_to(self) -> None:
+        """Switch straight from the active profile to this one, without retracting in between."""
+        logger.info(f'SurfListItem.switch_to - "{controller.active_profile}" -> "{self.username}"')
+        u.get_screen(self, "ACTIVE").switching_from = controller.active_profile
+        controller.active_profile = self.username
+        u.get_root_screen(self).active_bar.show()
+        u.get_root_screen(self).navigation_bar.set_current(1)
+        u.get_root_screen(self).screen_manager.current = "ACTIVE"
+        u.get_screen(self, "ACTIVE").activate(self.username, self)
+        u.get_screen(self, "PROFILES").set_all_list_item_buttons('SWITCH')
+        self.ids.activate_button.text = 'STOP'
+
     def deactivate(self) -> None:
         self.ids.activate_button.text = 'START'
 
@@ -102,6 +125,10 @@ class SurfListItem(ThemableBehavior, ButtonBehavior, MDBoxLayout):
                         text="DELETE",
                         on_release=self.delete_profile
                     ),
+                    MDFlatButton(
+                        text="UNDO",
+                        on_release=self.undo_profile
+                    ),
                     MDFlatButton(
                         text="SAVE CHANGES",
                         on_release=self.save_profile
@@ -126,6 +153,18 @@ class SurfListItem(ThemableBehavior, ButtonBehavior, MDBoxLayout):
         self.dialogue.dismiss(force=True)
         self.screen.refresh_visible_profiles()
 
+    def undo_profile(self, *args):
+        """Restore the values from before the last change to this profile, leaving the dialog open."""
+        logger.debug(f'[UI] "{self.name}" Edit-Dialogue: Undo-Clicked')
+        restored = history.ProfileHistory(self.username).undo()
+        if restored is None:
+            logger.info(f'[UI] "{self.name}" has no changes to undo')
+            return
+        for surface_name, value in restored.items():
+            self.dialogue.content_cls.slider_ids[surface_name].ids.slider.value = value
+        self.update_values(u.Profile.read_config(username=self.username)['control_surfaces'])
+        self.screen.refresh_etas()
+
     def save_profile(self, *args):
         logger.debug(f'[UI] "{self.name}" Edit-Dialogue: Save-Profile-Clicked')
         surfaces = self.dialogue.content_cls.slider_values
@@ -134,6 +173,7 @@ class SurfListItem(ThemableBehavior, ButtonBehavior, MDBoxLayout):
         self.center_value = surfaces['CENTER']
         self.starboard_value = surfaces['STARBOARD']
         self.close_dialogue()
+        self.screen.refresh_etas()
 
 
 
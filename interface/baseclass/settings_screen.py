@@ -1,11 +1,15 @@
 from kivy.properties import BooleanProperty
 
 from kivymd.app import MDApp
+from kivymd.uix.button import MDFlatButton
+from kivymd.uix.dialog import MDDialog
 from kivymd.uix.list import OneLineListItem
 from kivymd.uix.screen import MDScreen
 
 from utils import logger
+from utils import utilities as u
 from utils.controller import controller
+from utils.programs import Program
 
 
 class SurfSettingsScreen(MDScreen):
@@ -18,6 +22,10 @@ class SurfSettingsScreen(MDScreen):
     def on_pre_enter(self):
         if not self.list_created:
             items = [
+                (f"Run Program: {program['name']}", lambda *args, username=program['username']: self.run_program(username))
+                for program in Program.read_configs()
+            ] + [
+                ("Actuator Duty", self.show_duty),
                 ("Power Off", self.shut_down)
             ]
             for display_text, callback in items:
@@ -31,6 +39,20 @@ class SurfSettingsScreen(MDScreen):
 
             self.list_created = True
 
+    def run_program(self, username: str) -> None:
+        logger.info(f'UI: Running Program: {username}')
+        u.get_screen(self, "ACTIVE").run_program(Program.read_config(username))
+
+    def show_duty(self, *args) -> None:
+        logger.info('UI: Showing Actuator Duty')
+        lines = controller.duty.describe() if controller.duty else ["Duty-cycle accounting is disabled in settings.yml"]
+        dialog = MDDialog(
+            title="Actuator Duty",
+            text="\n".join(lines) or "No pin has been HIGH yet.",
+            buttons=[MDFlatButton(text="CLOSE", on_release=lambda *args: dialog.dismiss())],
+        )
+        dialog.open()
+
     def shut_down(self, *args):
         logger.info('UI: Shutting Down')
         controller.deactivate_profile()
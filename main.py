@@ -17,6 +17,7 @@ SurfRootScreen:
 import utils
 from utils import utilities
 from utils import controller
+from utils import services
 
 
 class MDSurf(MDApp):
@@ -44,6 +45,10 @@ def run() -> None:
     utils.utilities.first_time_setup_check()
     utils.log_startup_details()
     controller.start()
+    settings = utilities.read_settings()
+    services.start(controller.controller, settings)
+    if settings['resources']['interval']:
+        services.ResourceMonitor('ui', settings['resources']['interval']).start()
     if os.environ.get('FULLSCREEN', "true") == "true":
         Config.set('graphics', 'window_state', 'maximized')
         Config.set('graphics', 'fullscreen', 'auto')
@@ -55,4 +60,7 @@ def run() -> None:
         Config.set('graphics', 'fullscreen', 'false')
         Window.show_cursor = True
         Config.write()
+    if settings['instrumentation']['enabled']:
+        from utils import instrumentation
+        instrumentation.install(settings['instrumentation'])
     MDSurf().run()
@@ -27,15 +27,310 @@ def main():
          "`--fullscreen` is the default and will hide the mouse. "
          "Use `--windowed` when developing on a machine where you want to interact with the UI using a mouse."
 )
-def run(pins: bool, fullscreen: bool) -> None:
+@click.option(
+    "--headless",
+    is_flag=True,
+    default=False,
+    help="Run the controller and the control inputs enabled in settings.yml (the API, GPS, homing and reload) "
+         "without the UI, kivy is never imported. Press Ctrl-C to stop."
+)
+def run(pins: bool, fullscreen: bool, headless: bool) -> None:
 
     os.environ['USE_PINS'] = "true" if pins else "false"
     os.environ['FULLSCREEN'] = "true" if fullscreen else "false"
 
+    if headless:
+        import utils
+        from utils import services
+        utilities.first_time_setup_check()
+        utils.log_startup_details()
+        services.run_headless()
+        return
+
     import main
     main.run()
 
 
+@main.command(
+    help="Serve the HTTP/WebSocket control API without the UI."
+)
+@click.option(
+    "--pins/--no_pins",
+    required=True,
+    default=True,
+    help="Whether or not the RPi.GPIO module will be imported and calls to this module will be made. "
+         "Use --no_pins when developing on any machine which is not a raspberry pi."
+)
+@click.option(
+    "--host", default=None, help="The address to listen on, defaults to `api.host` in settings.yml."
+)
+@click.option(
+    "--port", default=None, type=int, help="The port to listen on, defaults to `api.port` in settings.yml."
+)
+def serve(pins: bool, host: str, port: int) -> None:
+    os.environ['USE_PINS'] = "true" if pins else "false"
+
+    import utils
+    from utils import api, controller
+    utilities.first_time_setup_check()
+    utils.log_startup_details()
+    settings = utilities.read_settings()['api']
+    controller.start()
+    api.serve(controller.controller, host or settings['host'], port or settings['port'])
+
+
+@main.command(
+    help="Replay a recorded NMEA file through the GPS speed-gate, as if it were the receiver."
+)
+@click.option(
+    "--file", "path", required=True, type=click.Path(exists=True, dir_okay=False), help="The recorded NMEA file."
+)
+@click.option(
+    "--speed", default=0.0, type=float, help="1 replays in real time, 0 (the default) replays as fast as possible."
+)
+@click.option(
+    "--pins/--no_pins",
+    required=True,
+    default=False,
+    help="Whether or not the pins should be driven during the replay, `--no_pins` is the default."
+)
+def replay_gps(path: str, speed: float, pins: bool) -> None:
+    os.environ['USE_PINS'] = "true" if pins else "false"
+
+    import utils
+    from utils import controller, gps
+    utilities.first_time_setup_check()
+    utils.log_startup_details()
+    try:
+        source = gps.ReplaySource(path, speed=speed)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    controller.start()
+    gps.GPSMonitor.from_settings(controller.controller, utilities.read_settings()['gps'], source=source).run()
+
+
+@main.command(
+    help="Run a wave-program from `~/.surf/programs/` without the UI. Press Ctrl-C to abort it."
+)
+@click.option(
+    '--name', required=True, help="The username of the wave-program, its file name without `.yml`."
+)
+@click.option(
+    "--pins/--no_pins",
+    required=True,
+    default=True,
+    help="Whether or not the RPi.GPIO module will be imported and calls to this module will be made."
+)
+def run_program(name: str, pins: bool) -> None:
+    os.environ['USE_PINS'] = "true" if pins else "false"
+
+    import utils
+    from utils import controller, programs
+    utilities.first_time_setup_check()
+    utils.log_startup_details()
+    if not os.path.isfile(programs.Program.get_path(name)):
+        raise click.ClickException(f"{programs.Program.get_path(name)} does not exist.")
+    program = programs.Program.read_config(name)
+    errors = programs.Program.validate(program)
+    if errors:
+        raise click.ClickException("\n".join(errors))
+
+    controller.start()
+    runner = programs.ProgramRunner(controller.controller, program)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        runner.abort()
+        controller.controller.deactivate_profile()
+    for record in runner.report:
+        click.echo(
+            f"\t{record['scheduled']:>7}s  {record['step'].action:<8} {record['step'].profile or '':<12} "
+            f"drift {round(record['drift'] * 1000, 2)}ms, took {round(record['duration'], 3)}s"
+        )
+
+
+@main.command(
+    help="Show the live state of the running application, read from its shared-memory status block."
+)
+@click.option(
+    '--watch/--once', default=False, help="Keep showing the state each time it changes, until interrupted."
+)
+@click.option(
+    '--interval', default=0.05, type=float, help="With `--watch`, seconds between reads of the status block."
+)
+def status(watch: bool, interval: float) -> None:
+    import time
+    from utils import status as surf_status
+
+    name = utilities.read_settings()['status']['name']
+    try:
+        block = surf_status.StatusBlock.attach(name)
+    except FileNotFoundError:
+        raise click.ClickException(f"no status block '{name}', is the application running with `status: enabled`?")
+
+    def describe(snapshot: dict) -> str:
+        positions = '  '.join(f"{name} {round(position * 100):>3}%" for name, position in snapshot['positions'].items())
+        hot = ', '.join(pin for pin, state in snapshot['pins'].items() if state) or '-'
+        moving = f"moving {round(snapshot['move_progress'] * 100):>3}%" if snapshot['moving'] else 'idle'
+        return (
+            f"#{snapshot['sequence']:<6} {positions}  |  profile: {snapshot['active_profile'] or '-'}  "
+            f"|  {moving}  |  HIGH: {hot}"
+        )
+
+    try:
+        last = None
+        while True:
+            try:
+                snapshot = block.read()
+            except (TimeoutError, ValueError) as e:
+                raise click.ClickException(str(e))
+            if snapshot is None:
+                if not watch:
+                    raise click.ClickException("the application has not published its state yet.")
+            elif (snapshot['sequence'], snapshot['move_progress']) != last:
+                click.echo(describe(snapshot))
+                last = (snapshot['sequence'], snapshot['move_progress'])
+            if not watch:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        block.close()
+
+
+@main.command(
+    help="Query the session logs through an incremental index of them. "
+         "Without a query, summarize each indexed log file."
+)
+@click.option('--since', default=None, help="Only after this time, like '2021-06-01 18:30', or this age, like '7d'.")
+@click.option('--until', default=None, help="Only before this time, or this age.")
+@click.option('--activations', 'kinds', flag_value='activation', multiple=True, help="Show profile activations.")
+@click.option('--moves', 'kinds', flag_value='move', multiple=True, help="Show moves and how long they took.")
+@click.option('--withdraws', 'kinds', flag_value='withdraw', multiple=True, help="Show withdraws and how long they took.")
+@click.option('--errors', 'kinds', flag_value='error', multiple=True, help="Show WARNING, ERROR and CRITICAL lines.")
+@click.option('--profile', default=None, help="With `--activations`, only activations of this profile.")
+@click.option('--grep', default=None, help="Show every line containing this text.")
+@click.option(
+    '--level', default=None, type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']),
+    help="Show every line at or above this level (combines with `--grep`)."
+)
+@click.option('--last', default=None, type=int, help="Only show the last this many results.")
+@click.option('--rebuild', is_flag=True, help="Discard the index and index every log from the start.")
+def logs(since, until, kinds, profile, grep, level, last, rebuild) -> None:
+    import utils
+    from collections import deque
+    from utils import logs as surf_logs
+    utilities.first_time_setup_check()
+
+    try:
+        since = surf_logs.parse_time(since) if since else None
+        until = surf_logs.parse_time(until) if until else None
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    index = surf_logs.LogIndex()
+    if rebuild:
+        index.files = {}
+    index.update()
+
+    if grep or level:
+        for line in deque(index.search(grep, level, since, until), maxlen=last):
+            click.echo(line)
+        return
+
+    if not kinds:
+        for entry in index.entries(since, until):
+            levels = ', '.join(f"{count} {name}" for name, count in entry['levels'].items())
+            click.echo(f"{os.path.basename(entry['path']):<26} {entry['first']} -> {entry['last']}  {levels}")
+        return
+
+    kinds = list(kinds) + (['warning', 'critical'] if 'error' in kinds else [])
+    events = deque(index.events(kinds, since, until, detail=profile), maxlen=last)
+    for event in events:
+        detail = f"{event['detail']} seconds" if event['kind'] in ('move', 'withdraw') else event['detail']
+        click.echo(f"{event['time']}  {event['kind']:<10} {detail}")
+    for kind in ('move', 'withdraw'):
+        durations = [event['detail'] for event in events if event['kind'] == kind]
+        if durations:
+            click.echo(
+                f"\n{len(durations)} {kind}(s): mean {round(sum(durations) / len(durations), 3)} seconds, "
+                f"longest {max(durations)} seconds"
+            )
+
+
+@main.command(
+    help="Show each pin's cumulative on-time, cycles and recent duty-cycle, and each actuator's heat, "
+         "for maintenance planning."
+)
+def duty() -> None:
+    from utils import duty as surf_duty
+    utilities.first_time_setup_check()
+    counters = surf_duty.DutyCycle.from_settings(utilities.read_settings()['duty'])
+    lines = counters.describe()
+    if not lines:
+        raise click.ClickException(f"no duty-cycle counters have been saved to '{counters.path}' yet.")
+    click.echo(f"\nActuator duty, over the last {counters.window} seconds, limit {round(counters.max_duty * 100)}%\n")
+    for line in lines:
+        click.echo(f"\t{line}")
+    click.echo("")
+
+
+@main.command(
+    help="Measure how late the pin edges of moves happen, in this process and in the isolated motion process."
+)
+@click.option(
+    '--moves', default=20, type=int, help="How many short moves of random surfaces are timed in each process."
+)
+@click.option(
+    '--stress/--no-stress', default=True,
+    help="Load this process with threads which hold the GIL and churn the garbage collector, as the UI does."
+)
+@click.option(
+    "--pins/--no_pins",
+    required=True,
+    default=True,
+    help="Whether or not the RPi.GPIO module will be imported and calls to this module will be made."
+)
+def benchmark_motion(moves: int, stress: bool, pins: bool) -> None:
+    os.environ['USE_PINS'] = "true" if pins else "false"
+
+    import random
+    import threading
+    import utils
+    from utils import controller, motion
+    utilities.first_time_setup_check()
+    utils.log_startup_details()
+    settings = utilities.read_settings()
+
+    results = {}
+    for engine in ('in-process', 'isolated'):
+        backend = motion.EngineBackend.from_settings(settings, use_pins=pins) if engine == 'isolated' else None
+        surfaces = controller.Controller(backend=backend)
+        stop = threading.Event()
+        if stress:
+            for _ in range(2):
+                threading.Thread(target=motion.stress, args=(stop,), daemon=True).start()
+        try:
+            for _ in range(moves):
+                surfaces.move_to({
+                    surface_name: round(random.uniform(0, 0.1), 2)
+                    for surface_name in random.sample(surfaces.surface_names, random.randint(1, len(surfaces.surfaces)))
+                })
+            surfaces.retract()
+        finally:
+            stop.set()
+            surfaces.backend.stop()
+        results[engine] = motion.summarize(surfaces.edge_latencies)
+
+    click.echo(f"\nEdge latency over {moves} moves{' under stress' if stress else ''}, in milliseconds\n")
+    for engine, summary in results.items():
+        click.echo(
+            f"\t{engine:<11} {summary['edges']:>4} edges: "
+            f"worst {summary['worst']}, p99 {summary['p99']}, mean {summary['mean']}"
+        )
+    click.echo("")
+
+
 @main.command(
     help="Write (or overwrite) configs from templates. "
          "Argument flags should be provided without values."
@@ -52,6 +347,10 @@ def run(pins: bool, fullscreen: bool) -> None:
     '--operating-modes', 'which_config', flag_value='operating_modes.yml',
     help="write `~/.surf/config/operating_modes.yml` from template."
 )
+@click.option(
+    '--settings', 'which_config', flag_value='settings.yml',
+    help="write `~/.surf/config/settings.yml` from template."
+)
 def reset_config(which_config: str) -> None:
     utilities.update_config_from_template(which_config)
 
@@ -79,6 +378,74 @@ def update_operating_mode(mode: str, concurrency: int, context: str, value: str)
     if error_message:
         raise click.ClickException(error_message)
 
+@main.command(
+    help="Calibrate the travel durations of an operating mode by timing full travels of the control surfaces."
+)
+@click.option(
+    '--mode', default='wet', help="Which operating mode to calibrate, these are the top level keys in the config file."
+)
+@click.option(
+    '--trials', default=3, type=int, help="How many times each group of surfaces is fully extended and retracted."
+)
+@click.option(
+    '--limit-switches/--stopwatch', default=False,
+    help="Time each travel with the limit switches configured in control_surfaces.yml, "
+         "or (the default) by entering each surface's name as it reaches the end of its travel."
+)
+@click.option(
+    '--incremental/--no-incremental', default=False,
+    help="Also recalculate the `incremental` timings of each surface from the calibration."
+)
+@click.option(
+    "--pins/--no_pins",
+    required=True,
+    default=True,
+    help="Whether or not the RPi.GPIO module will be imported and calls to this module will be made."
+)
+def calibrate(mode: str, trials: int, limit_switches: bool, incremental: bool, pins: bool) -> None:
+    os.environ['USE_PINS'] = "true" if pins else "false"
+    os.environ['MODE'] = mode
+    if limit_switches and not pins:
+        raise click.ClickException("`--limit-switches` needs the pins, use `--stopwatch` with `--no_pins`.")
+
+    import yaml
+    import utils
+    from utils import controller, calibration
+    utilities.first_time_setup_check()
+    utils.log_startup_details()
+    controller.start()
+
+    try:
+        timer = (
+            calibration.LimitSwitchTimer(controller.controller)
+            if limit_switches else
+            calibration.StopwatchTimer(
+                prompt=lambda text: click.prompt(text, default='', show_default=False), echo=click.echo
+            )
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    calibrator = calibration.Calibration(controller.controller, timer, trials=trials)
+    table = calibrator.table(
+        calibrator.run(),
+        yaml.safe_load(open(controller.Controller.modes, 'r'))[mode],
+        incremental=incremental
+    )
+
+    click.echo(f"\nCalibrated '{mode}' timings\n")
+    for concurrency in range(1, len(controller.controller.surface_names) + 1):
+        click.echo(
+            f"\t{concurrency} pin(s): deploy {table[concurrency]['deploy']}, withdraw {table[concurrency]['withdraw']}"
+        )
+    for surface_name, fits in table['calibration']['surfaces'].items():
+        for concurrency, directions in fits.items():
+            for direction, fit in directions.items():
+                click.echo(f"\t{surface_name} x{concurrency} {direction}: {fit['mean']} s, 95% CI {fit['ci95']}")
+    click.echo("")
+    if click.confirm('Do you want to write these timings to operating_modes.yml?', abort=True):
+        calibrator.write(table)
+
+
 @main.command(
     help="Update value of existing wave-profile."
 )
@@ -127,6 +494,87 @@ def delete_wave_profile(name):
         raise click.ClickException(error_message)
 
 
+@main.command(
+    help="Undo the last change to a wave-profile, repeat to undo earlier changes."
+)
+@click.option(
+    '--name', required=True, help="The name of the profile."
+)
+def undo_wave_profile(name: str) -> None:
+    from utils import history
+    utilities.first_time_setup_check()
+    username = utilities.Profile.get_username(name)
+    if not utilities.Profile.config_exists(username=username):
+        raise click.ClickException(f"'{name}' is not a wave-profile.")
+    restored = history.ProfileHistory(username).undo()
+    if restored is None:
+        raise click.ClickException(f"'{name}' has no changes to undo.")
+    click.echo(f"restored {', '.join(f'{surface}: {value}' for surface, value in restored.items())}")
+
+
+@main.command(
+    help="Show the changes to a wave-profile which can be undone, newest first."
+)
+@click.option(
+    '--name', required=True, help="The name of the profile."
+)
+@click.option('--last', default=10, type=int, help="How many changes to show.")
+def wave_profile_history(name: str, last: int) -> None:
+    from utils import history
+    utilities.first_time_setup_check()
+    entries = history.ProfileHistory(utilities.Profile.get_username(name)).entries(limit=last)
+    if not entries:
+        click.echo(f"'{name}' has no recorded changes.")
+    for entry in entries:
+        changes = ', '.join(f"{surface}: {old} -> {new}" for surface, (old, new) in entry['changes'].items())
+        click.echo(f"{entry['at']}  {entry['source']:<7} {changes}")
+
+
+@main.command(
+    help="Create many wave-profiles from a CSV, JSON or YAML file (or '-' for stdin). "
+         "Every valid record is written at once, each invalid one is reported."
+)
+@click.argument('path', type=click.File('r'))
+@click.option(
+    '--format', 'file_format', type=click.Choice(['csv', 'json', 'yaml']), default=None,
+    help="The format of the file, by default from its extension."
+)
+@click.option('--replace', is_flag=True, help="Overwrite existing profiles of the same name.")
+@click.option('--dry-run', is_flag=True, help="Only validate the records, write nothing.")
+def import_profiles(path, file_format: str, replace: bool, dry_run: bool) -> None:
+    from utils import profile_io
+    utilities.first_time_setup_check()
+    try:
+        file_format = file_format or profile_io.guess_format(path.name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    imported, errors = profile_io.import_profiles(path, file_format, replace=replace, dry_run=dry_run)
+    for number, error in errors:
+        click.echo(f"record {number}: {error}", err=True)
+    click.echo(f"{'would import' if dry_run else 'imported'} {len(imported)} profile(s)")
+    if errors:
+        raise click.ClickException(f"{len(errors)} record(s) were not imported.")
+
+
+@main.command(
+    help="Write every wave-profile to a CSV, JSON or YAML file, or to stdout."
+)
+@click.argument('path', type=click.File('w'), default='-')
+@click.option(
+    '--format', 'file_format', type=click.Choice(['csv', 'json', 'yaml']), default=None,
+    help="The format to write, by default from the file's extension, or YAML to stdout."
+)
+def export_profiles(path, file_format: str) -> None:
+    from utils import profile_io
+    utilities.first_time_setup_check()
+    try:
+        file_format = file_format or ('yaml' if path.name == '<stdout>' else profile_io.guess_format(path.name))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    count = profile_io.export_profiles(path, file_format)
+    click.echo(f"exported {count} profile(s)", err=True)
+
+
 
 @main.command(
     help="Run first time setup. This is done automatically when you run the application "
@@ -51,6 +51,8 @@ def log_startup_details() -> None:
     logger.debug(f'CONFIG_DIR:\t{CONFIG_DIR}')
     logger.debug(f'LOGS_DIR:\t{LOGS_DIR}')
     logger.debug(f'PROFILES_DIR:\t{PROFILES_DIR}')
+    logger.debug(f'PROGRAMS_DIR:\t{PROGRAMS_DIR}')
+    logger.debug(f'HISTORY_DIR:\t{HISTORY_DIR}')
     logger.debug(f'UI_DIR:\t\t{UI_DIR}')
     logger.debug(f'UI_KV_DIR:\t{UI_KV_DIR}')
     logger.debug(f'UI_PY_DIR:\t{UI_PY_DIR}')
@@ -68,6 +70,8 @@ HOME_DIR = os.path.join(Path.home(), '.surf')
 CONFIG_DIR = os.path.join(HOME_DIR, 'config')
 LOGS_DIR = os.path.join(HOME_DIR, 'logs')
 PROFILES_DIR = os.path.join(HOME_DIR, 'profiles')
+PROGRAMS_DIR = os.path.join(HOME_DIR, 'programs')
+HISTORY_DIR = os.path.join(HOME_DIR, 'history')
 
 # paths within the project
 ROOT_DIR = Path(os.path.realpath(__file__)).parent.parent
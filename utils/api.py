@@ -0,0 +1,288 @@
+"""
+A small HTTP/WebSocket control API on top of the `Controller`.
+
+Only the standard library is used, so the API can run on the pi without any extra packages.
+
+HTTP routes, every response is JSON:
+    GET  /state                          -> positions, values, pin-states and the active profile
+    GET  /profiles                       -> every configured wave-profile
+    POST /profiles/<username>/activate   -> activate a wave-profile
+    POST /deactivate                     -> deactivate the active profile and fully withdraw the surfaces
+    POST /retract                        -> move every surface to 0
+    POST /invert                         -> mirror the surfaces (goofy / regular)
+    POST /surfaces/<name>/increment      -> nudge one surface out
+    POST /surfaces/<name>/decrement      -> nudge one surface in
+    GET  /ws                             -> WebSocket, see below
+
+WebSocket:
+    - on connect the server sends {"type": "snapshot", ...} with the same body as GET /state
+    - after that every change is pushed as a delta, for example:
+        {"type": "position", "name": "PORT", "value": 0.25}
+        {"type": "pin", "name": "PORT.extend", "value": 1}
+        {"type": "profile", "name": "active_profile", "value": "steep"}
+    - clients may send commands as JSON, {"action": "activate", "profile": "steep"} or
+      {"action": "increment", "surface": "PORT"}, the actions match the HTTP routes above.
+"""
+import json
+import base64
+import struct
+import asyncio
+import hashlib
+import logging
+import threading
+
+from utils import utilities as u
+from utils.async_controller import AsyncController
+from utils.duty import DutyCycleExceeded
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+HTTP_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+
+class NotFound(Exception):
+    """A route, wave-profile or control-surface named by a request does not exist."""
+
+
+class ControlServer:
+    """Serves the control API for one `AsyncController`."""
+
+    def __init__(self, surfaces: AsyncController, host: str = '127.0.0.1', port: int = 8080) -> None:
+        self.surfaces = surfaces
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger('Surf.API')
+        self.server = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info(f"Control API listening on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    @property
+    def state(self) -> dict:
+        controller = self.surfaces.controller
+        return {
+            'active_profile': controller.active_profile,
+            'positions': controller.positions,
+            'values': controller.values,
+            'pins': {
+                f"{surface.name}.{pin.name}": pin.state
+                for surface in controller.surfaces.values()
+                for pin in surface.pins
+            },
+        }
+
+    async def dispatch(self, action: str, profile: str = None, surface: str = None) -> dict:
+        """Perform one API action and return the resulting state."""
+        if action == 'state':
+            pass
+        elif action == 'profiles':
+            return {'profiles': sorted(u.Profile.read_configs(), key=lambda profile: profile['username'])}
+        elif action == 'activate':
+            if not profile or not u.Profile.config_exists(username=profile):
+                raise NotFound(f"no such wave-profile: '{profile}'")
+            await self.surfaces.activate_profile(profile)
+        elif action == 'deactivate':
+            await self.surfaces.deactivate_profile()
+        elif action == 'retract':
+            await self.surfaces.retract()
+        elif action == 'invert':
+            await self.surfaces.invert()
+        elif action in ('increment', 'decrement'):
+            if surface not in self.surfaces.controller.surfaces:
+                raise NotFound(f"no such control-surface: '{surface}'")
+            await getattr(self.surfaces, action)(surface)
+        else:
+            raise ValueError(f"unknown action: '{action}'")
+        return self.state
+
+    def route(self, method: str, path: str) -> tuple:
+        """Translate an HTTP method and path into the `(action, keyword arguments)` for `dispatch()`."""
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        routes = {
+            ('GET', 'state'): 'state',
+            ('GET', 'profiles'): 'profiles',
+            ('POST', 'deactivate'): 'deactivate',
+            ('POST', 'retract'): 'retract',
+            ('POST', 'invert'): 'invert',
+        }
+        if len(parts) == 1 and (method, parts[0]) in routes:
+            return routes[(method, parts[0])], {}
+        if method == 'POST' and len(parts) == 3 and parts[0] == 'profiles' and parts[2] == 'activate':
+            return 'activate', {'profile': parts[1]}
+        if method == 'POST' and len(parts) == 3 and parts[0] == 'surfaces' and parts[2] in ('increment', 'decrement'):
+            return parts[2], {'surface': parts[1]}
+        raise NotFound(f"no route for {method} {path}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            if int(headers.get('content-length', 0)):
+                await reader.readexactly(int(headers['content-length']))
+
+            self.logger.info(f"[API] {method} {path}")
+            if path.split('?')[0].rstrip('/') == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self.handle_websocket(reader, writer, headers)
+                return
+
+            try:
+                action, kwargs = self.route(method, path)
+                status, body = 200, await self.dispatch(action, **kwargs)
+            except NotFound as e:
+                status, body = 404, {'error': str(e)}
+            except (ValueError, AssertionError) as e:
+                status, body = 400, {'error': str(e)}
+            except DutyCycleExceeded as e:
+                status, body = 503, {'error': str(e), 'retry_after': round(e.delay, 1)}
+            except Exception as e:
+                self.logger.exception(f"[API] {method} {path} failed")
+                status, body = 500, {'error': f"{e.__class__.__name__}: {e}"}
+            await self.send_http(writer, status, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def send_http(writer: asyncio.StreamWriter, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+
+    async def handle_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict) -> None:
+        accept = base64.b64encode(
+            hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()
+        ).decode()
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+        )
+        send_lock = asyncio.Lock()
+
+        async def send(message: dict) -> None:
+            async with send_lock:
+                writer.write(encode_frame(json.dumps(message).encode()))
+                await writer.drain()
+
+        async def push_deltas() -> None:
+            async for kind, name, value in self.surfaces.events():
+                await send({'type': kind, 'name': name, 'value': value})
+
+        await send({'type': 'snapshot', **self.state})
+        pusher = asyncio.ensure_future(push_deltas())
+        pusher.add_done_callback(self.log_failure)
+        commands = set()
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == 0x8:  # close
+                    writer.write(encode_frame(payload[:2], opcode=0x8))
+                    break
+                elif opcode == 0x9:  # ping
+                    async with send_lock:
+                        writer.write(encode_frame(payload, opcode=0xA))
+                elif opcode == 0x1:  # text
+                    command = asyncio.ensure_future(self.run_command(send, payload))
+                    commands.add(command)
+                    command.add_done_callback(commands.discard)
+                    command.add_done_callback(self.log_failure)
+        finally:
+            pusher.cancel()
+            for command in commands:
+                command.cancel()
+
+    async def run_command(self, send, payload: bytes) -> None:
+        """Run one command sent by a WebSocket client, reply with the resulting state once it is done."""
+        try:
+            command = json.loads(payload)
+            state = await self.dispatch(command.get('action'), profile=command.get('profile'), surface=command.get('surface'))
+            await send({'type': 'done', 'action': command.get('action'), **state})
+        except (NotFound, ValueError, AssertionError) as e:
+            await send({'type': 'error', 'error': str(e)})
+        except DutyCycleExceeded as e:
+            await send({'type': 'error', 'error': str(e), 'retry_after': round(e.delay, 1)})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            self.logger.exception(f"[API] WebSocket command {payload[:200]!r} failed")
+            await send({'type': 'error', 'error': f"{e.__class__.__name__}: {e}"})
+
+    def log_failure(self, task: asyncio.Future) -> None:
+        """Log the exception of a WebSocket task, which nothing awaits, once it is done."""
+        if task.cancelled() or task.exception() is None:
+            return
+        if isinstance(task.exception(), ConnectionError):
+            self.logger.debug(f"[API] WebSocket client went away, {task.exception()}")
+        else:
+            self.logger.error("[API] WebSocket task failed", exc_info=task.exception())
+
+
+def encode_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """Encode a single, unmasked (server to client) WebSocket frame."""
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 2**16:
+        header += bytes([126]) + struct.pack('!H', len(payload))
+    else:
+        header += bytes([127]) + struct.pack('!Q', len(payload))
+    return header + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    """Read a single WebSocket frame, returning its opcode and unmasked payload."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+def serve(controller, host: str, port: int) -> None:
+    """Serve the control API for a `Controller` until interrupted (blocks)."""
+    async def run():
+        await ControlServer(AsyncController(controller), host, port).serve_forever()
+    asyncio.run(run())
+
+
+def start_in_thread(controller, host: str, port: int) -> threading.Thread:
+    """Serve the control API for a `Controller` from a daemon thread, used when running alongside the UI."""
+    thread = threading.Thread(target=serve, args=(controller, host, port), name='SurfAPI', daemon=True)
+    thread.start()
+    return thread
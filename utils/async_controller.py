@@ -0,0 +1,284 @@
+import time
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, List
+
+from utils import controller as c
+from utils import utilities as u
+
+# how many events a subscriber may fall behind before its oldest are dropped
+QUEUE_SIZE = 100
+
+
+class AsyncController:
+    """
+    An asyncio facade over a `Controller`.
+
+    - Moves are planned by the wrapped `Controller` (see `Controller.plan_move()`) and the resulting
+      pin edges are scheduled with `loop.call_at()`, so awaiting a move never ties up a thread.
+    - Moves are serialized with an `asyncio.Lock`, any number of coroutines may await them concurrently,
+      and each is planned and performed holding the `Controller.motion_lock`, so that they also wait for
+      moves made from other threads (the UI, GPS, homing, programs) and for config swaps.
+    - Moves the `Controller` cannot time on the loop, those closed-loop by `utils.feedback` and those
+      of a timed backend (see `utils.motion`), are made by the `Controller` itself in a worker thread.
+    - Changes made by the wrapped `Controller`, including those made from other threads by the UI,
+      are streamed to every subscriber of `events()` and `position_updates()`. A subscriber which falls
+      `QUEUE_SIZE` events behind loses its oldest events, rather than holding every event in memory.
+    """
+
+    def __init__(self, controller: c.Controller = None) -> None:
+        self.controller = controller or c.controller
+        self.logger = logging.getLogger('Surf.AsyncController')
+        self.lock = asyncio.Lock()
+        # `motion_lock` is re-entrant, so it must be acquired and released by the same thread, always this one
+        self.locker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='SurfAPIMotion')
+        self.subscribers = set()
+        self.controller.add_listener(self.publish)
+
+    def close(self) -> None:
+        """Stop listening to the wrapped `Controller`."""
+        self.controller.remove_listener(self.publish)
+        self.locker.shutdown(wait=False)
+
+    @property
+    def positions(self) -> dict:
+        return self.controller.positions
+
+    @property
+    def values(self) -> dict:
+        return self.controller.values
+
+    async def move_to(self, new_positions: dict, action_mode: str = 'deploy', optimize: str = None) -> dict:
+        """Await the move of the given surfaces to new positions (see `Controller.move_to()`)."""
+        if self.controller.feedback and self.controller.feedback.covers(new_positions):
+            async with self.lock:
+                await self.in_thread(self.controller.move_to, new_positions, action_mode=action_mode)
+            return self.controller.values
+
+        def plan():
+            if optimize == 'time':
+                from utils import optimizer
+                return optimizer.plan_fastest(self.controller, new_positions, action_mode=action_mode)
+            return self.controller.plan_move(new_positions, action_mode=action_mode)
+
+        await self.move(plan)
+        return self.controller.values
+
+    async def activate_profile(self, profile_name: str, optimize: str = None) -> dict:
+        if not profile_name:
+            return self.controller.values
+
+        # the same line as `Controller.activate_profile()`, which `utils.logs` indexes as an activation
+        self.logger.info(f"Activating profile: '{profile_name}'")
+        previous, self.controller.active_profile = self.controller.active_profile, profile_name
+        try:
+            return await self.move_to(
+                {
+                    surface_name: value/100
+                    for surface_name, value in u.Profile.read_config(username=profile_name)['control_surfaces'].items()
+                },
+                optimize=optimize
+            )
+        except Exception:
+            self.controller.active_profile = previous
+            raise
+
+    async def transition_profile(self, from_profile: str, to_profile: str, optimize: str = None) -> dict:
+        """Move straight from one profile to another (see `Controller.transition_profile()`)."""
+        self.logger.info(f"Transitioning profile: '{from_profile}' -> '{to_profile}'")
+        return await self.activate_profile(to_profile, optimize=optimize)
+
+    async def deactivate_profile(self) -> dict:
+        self.controller.active_profile = None
+        await self.move(self.controller.plan_withdraw)
+        return self.controller.values
+
+    async def invert(self) -> dict:
+        return await self.move_to(
+            {
+                regular: self.controller.surfaces[goofy].position
+                for regular, goofy in self.controller.goofy_map.items()
+            }
+        )
+
+    async def retract(self, blindly: bool = False) -> dict:
+        if not blindly:
+            return await self.move_to({surface_name: 0 for surface_name in self.controller.surfaces})
+
+        await self.move(self.controller.plan_blind_retract)
+        return self.controller.values
+
+    async def increment(self, surface_name: str) -> dict:
+        """Extend one surface by `Surface.increment_by` (see `Surface.increment()`)."""
+        surface = self.controller.surfaces[surface_name]
+        if self.controller.feedback and self.controller.feedback.covers([surface_name]):
+            async with self.lock:
+                await self.in_thread(surface.increment)
+            return self.controller.values
+
+        def plan():
+            new_position = round(surface.position + surface.increment_by, 2)
+            if new_position > 1:
+                return []
+            return [
+                c.Edge(0, surface_name, 'extend', 1, None),
+                c.Edge(surface.increment_extend_duration, surface_name, 'extend', 0, new_position),
+            ]
+
+        await self.move(plan)
+        return self.controller.values
+
+    async def decrement(self, surface_name: str) -> dict:
+        """Retract one surface by `Surface.increment_by` (see `Surface.decrement()`)."""
+        surface = self.controller.surfaces[surface_name]
+        if self.controller.feedback and self.controller.feedback.covers([surface_name]):
+            async with self.lock:
+                await self.in_thread(surface.decrement)
+            return self.controller.values
+
+        def plan():
+            new_position = round(surface.position - surface.increment_by, 2)
+            if new_position < 0:
+                return []
+            return [
+                c.Edge(0, surface_name, 'retract', 1, None),
+                c.Edge(surface.increment_retract_duration, surface_name, 'retract', 0, new_position),
+            ]
+
+        await self.move(plan)
+        return self.controller.values
+
+    async def in_thread(self, function: Callable, *args, **kwargs):
+        """Await a blocking call of the `Controller`, which takes the `motion_lock` itself, in a worker thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    async def acquire_motion_lock(self) -> None:
+        """Wait for the `Controller.motion_lock` without blocking the loop, held by the `locker` thread."""
+        acquired = asyncio.get_running_loop().run_in_executor(self.locker, self.controller.motion_lock.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # the acquire cannot be called off, so the lock is released again as soon as it is held
+            acquired.add_done_callback(lambda future: self.locker.submit(self.controller.motion_lock.release))
+            raise
+
+    def release_motion_lock(self) -> None:
+        # the `locker` thread runs one call at a time, so any later acquire is queued behind this release
+        self.locker.submit(self.controller.motion_lock.release)
+
+    async def move(self, plan: Callable[[], List[c.Edge]]) -> None:
+        """Plan and perform a move holding the `motion_lock`, so that it is planned from the current positions."""
+        async with self.lock:
+            await self.acquire_motion_lock()
+            try:
+                await self.execute(plan())
+            finally:
+                self.release_motion_lock()
+
+    async def execute(self, edges: List[c.Edge]) -> None:
+        """
+        Schedule each group of edges on a loop timer and wait for the last of them.
+
+        If the awaiting task is cancelled part way through a move, every pin of the move is set LOW
+        before the cancellation is propagated, the positions of unfinished surfaces are left unchanged.
+        Each pin set HIGH is armed with its deadline in the `Controller.watchdog`, if there is one.
+
+        Called by `move()`, with the `motion_lock` held by the `locker` thread.
+        """
+        if not edges:
+            return
+        if self.controller.backend.timed:
+            # the backend times the edges in its own process, waited for on the thread holding the `motion_lock`
+            await asyncio.get_running_loop().run_in_executor(self.locker, self.controller.execute, edges)
+            return
+
+        self.controller.throttle(
+            self.controller.on_times(edges), retracting=all(edge.action == 'retract' for edge in edges)
+        )
+
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        groups = list(self.controller.edge_groups(edges))
+        watchdog = self.controller.watchdog
+        low_times = self.controller.low_times(groups) if watchdog else None
+        start, monotonic_start = loop.time(), time.monotonic()
+
+        def apply(i, group):
+            try:
+                self.controller.apply_edges(group)
+                if watchdog:
+                    watchdog.watch(
+                        self.controller.edge_states(group),
+                        {number: monotonic_start + at for number, at in low_times[i].items()}
+                    )
+            except Exception as e:
+                # raised to the awaiting task, rather than logged by the loop while the move waits forever
+                for handle in handles[i + 1:]:
+                    handle.cancel()
+                if not finished.done():
+                    finished.set_exception(e)
+                return
+            if i == len(groups) - 1 and not finished.done():
+                finished.set_result(None)
+
+        self.controller.notify('move', 'started', groups[-1][0])
+        handles = [
+            loop.call_at(start + at, apply, i, group)
+            for i, (at, group) in enumerate(groups)
+        ]
+        try:
+            await finished
+        except (asyncio.CancelledError, Exception) as e:
+            self.logger.warning(
+                f"move {'cancelled' if isinstance(e, asyncio.CancelledError) else 'failed'}, "
+                f"setting all pins of the move LOW."
+            )
+            for handle in handles:
+                handle.cancel()
+            for edge in edges:
+                getattr(self.controller.surfaces[edge.surface], f"{edge.action}_pin").low()
+            raise
+        finally:
+            self.controller.notify('move', 'finished', None)
+        withdraw = all(edge.action == 'retract' and edge.position in (None, 0) for edge in edges)
+        self.logger.info(
+            f"{'Withdraw' if withdraw else 'Move'} finished in {round(loop.time() - start, 3)} seconds "
+            f"(planned {round(groups[-1][0], 3)})"
+        )
+
+    def publish(self, kind: str, name: str, value) -> None:
+        """Forward a change from the wrapped `Controller` to every subscriber, from any thread."""
+        for loop, queue in list(self.subscribers):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self.offer, queue, (kind, name, value))
+
+    def offer(self, queue: asyncio.Queue, event: tuple) -> None:
+        """Queue an event for a subscriber, dropping its oldest event if it has fallen too far behind."""
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    async def events(self) -> AsyncIterator[tuple]:
+        """Yield every `(kind, name, value)` change of the wrapped `Controller` (see `Controller.add_listener()`)."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            self.subscribers.discard(subscriber)
+
+    async def position_updates(self) -> AsyncIterator[dict]:
+        """Yield the current positions, then the positions again each time one of them changes."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        self.subscribers.add(subscriber)
+        try:
+            yield self.controller.positions
+            while True:
+                kind, name, value = await subscriber[1].get()
+                if kind == 'position':
+                    yield self.controller.positions
+        finally:
+            self.subscribers.discard(subscriber)
@@ -0,0 +1,344 @@
+"""
+Pin backends, which set the physical pins of a `Controller` HIGH or LOW.
+
+Every `Controller` owns a backend, so controllers with different backends (or several simulated
+controllers) can run side by side in one process. The backend is chosen by the `pins` section of
+settings.yml:
+
+- `RPiGPIOBackend` drives the pi's header pins, by BCM number.
+- `MCP23017Backend` drives the 16 pins of an MCP23017 I2C expander, numbered 0-7 (GPA0-7) and 8-15 (GPB0-7).
+- `GPIOChipBackend` drives the lines of a linux `/dev/gpiochip*` character device, by line offset.
+- `NullBackend` drives nothing, for `--no_pins` and for simulation.
+"""
+import os
+import ctypes
+import logging
+import threading
+from typing import Dict, Iterator, List
+
+
+class PinBackend:
+    """The interface every pin backend implements."""
+
+    # True for backends which time whole moves themselves, see `run()`
+    timed = False
+
+    def setup(self, number: int) -> None:
+        """Prepare a pin as an output, called once for each pin when the `Controller` is created."""
+        raise NotImplementedError
+
+    def start(self) -> None:
+        """Called once every pin of the `Controller` has been set up, before any pin is written."""
+        pass
+
+    def stop(self) -> None:
+        """Release the pins, after which the backend is not used again."""
+        pass
+
+    def output(self, number: int, state: bool) -> None:
+        """Set a single pin HIGH (True) or LOW (False)."""
+        raise NotImplementedError
+
+    def output_many(self, states: Dict[int, bool]) -> None:
+        """
+        Set several pins at once, {pin number: state}.
+
+        Backends which can write several pins in a single transaction override this,
+        so that every pin of a group of edges switches at the same instant.
+        """
+        for number, state in states.items():
+            self.output(number, state)
+
+    def run(self, groups: List[tuple]) -> Iterator[tuple]:
+        """
+        For `timed` backends, perform a whole move and yield `(group index, latency)` as each group happens.
+
+        :param groups: a list of `(seconds after the start of the move, {pin number: state})`, in time order
+        """
+        raise NotImplementedError
+
+
+class NullBackend(PinBackend):
+    """A backend which drives no pins, used with `--no_pins` and for simulation."""
+
+    def setup(self, number: int) -> None:
+        pass
+
+    def output(self, number: int, state: bool) -> None:
+        pass
+
+
+class RPiGPIOBackend(PinBackend):
+    """The raspberry pi's header pins, by BCM number, through the `RPi.GPIO` module."""
+
+    def __init__(self) -> None:
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        # ensure that the rasberry pi pins are ready to go
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+
+    def setup(self, number: int) -> None:
+        self.GPIO.setup([number], self.GPIO.OUT)
+
+    def output(self, number: int, state: bool) -> None:
+        self.GPIO.output(number, state)
+
+
+class MockSMBus:
+    """
+    An in-memory stand-in for `smbus2.SMBus`, for developing and testing the I2C backends without hardware.
+
+    Every register write is kept in `registers`, {(address, register): value}, and every bus
+    transaction is appended to `transactions` as `(method, address, register, values)`.
+    """
+
+    def __init__(self) -> None:
+        self.registers = {}
+        self.transactions = []
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        self.transactions.append(('write_byte_data', address, register, [value]))
+        self.registers[(address, register)] = value
+
+    def write_i2c_block_data(self, address: int, register: int, values: List[int]) -> None:
+        # the MCP23017's address pointer increments after each byte (IOCON.SEQOP=0, the power-on default)
+        self.transactions.append(('write_i2c_block_data', address, register, list(values)))
+        for offset, value in enumerate(values):
+            self.registers[(address, register + offset)] = value
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        self.transactions.append(('read_byte_data', address, register, []))
+        return self.registers.get((address, register), 0)
+
+
+class MCP23017Backend(PinBackend):
+    """
+    The 16 pins of an MCP23017 I2C GPIO expander (requires the `smbus2` package unless a `bus` is given).
+
+    The output latches of both ports are kept in a shadow register, so a change never needs a read
+    from the bus, and each call writes only the changed port(s) in a single bus transaction.
+    """
+
+    # register addresses with IOCON.BANK=0, the power-on default
+    IODIRA = 0x00
+    IODIRB = 0x01
+    OLATA = 0x14
+    OLATB = 0x15
+
+    def __init__(self, bus=1, address: int = 0x20) -> None:
+        """
+        :param bus: an I2C bus number like 1 for /dev/i2c-1, or an SMBus-like object such as `MockSMBus`
+        :param address: the expander's 7 bit address, 0x20 to 0x27 depending on its A0-A2 pins
+        """
+        if isinstance(bus, int):
+            from smbus2 import SMBus
+            bus = SMBus(bus)
+        self.bus = bus
+        self.address = address
+        self.lock = threading.Lock()
+        # every pin starts as a LOW input, pins become outputs as they are set up
+        self.iodir = [0xFF, 0xFF]
+        self.olat = [0x00, 0x00]
+        self.bus.write_i2c_block_data(self.address, self.OLATA, self.olat)
+        self.bus.write_i2c_block_data(self.address, self.IODIRA, self.iodir)
+
+    @staticmethod
+    def locate(number: int) -> tuple:
+        """The (port, bit) of a pin number, port 0 is GPA and port 1 is GPB."""
+        if not 0 <= number <= 15:
+            raise ValueError(f"MCP23017 pins are numbered 0 to 15, not {number}.")
+        return divmod(number, 8)
+
+    def setup(self, number: int) -> None:
+        port, bit = self.locate(number)
+        with self.lock:
+            self.iodir[port] &= ~(1 << bit) & 0xFF
+            self.bus.write_byte_data(self.address, self.IODIRA + port, self.iodir[port])
+
+    def output(self, number: int, state: bool) -> None:
+        self.output_many({number: state})
+
+    def output_many(self, states: Dict[int, bool]) -> None:
+        with self.lock:
+            olat = list(self.olat)
+            for number, state in states.items():
+                port, bit = self.locate(number)
+                if state:
+                    olat[port] |= 1 << bit
+                else:
+                    olat[port] &= ~(1 << bit) & 0xFF
+            changed = [port for port in (0, 1) if olat[port] != self.olat[port]]
+            self.olat = olat
+            if len(changed) == 2:
+                # OLATA and OLATB are adjacent, so both ports are written in one sequential transaction
+                self.bus.write_i2c_block_data(self.address, self.OLATA, olat)
+            elif changed:
+                self.bus.write_byte_data(self.address, self.OLATA + changed[0], olat[changed[0]])
+
+
+class gpiohandle_request(ctypes.Structure):
+    """`struct gpiohandle_request` of linux/gpio.h (the v1 line-handle ABI)."""
+    _fields_ = [
+        ('lineoffsets', ctypes.c_uint32 * 64),
+        ('flags', ctypes.c_uint32),
+        ('default_values', ctypes.c_uint8 * 64),
+        ('consumer_label', ctypes.c_char * 32),
+        ('lines', ctypes.c_uint32),
+        ('fd', ctypes.c_int),
+    ]
+
+
+class gpiohandle_data(ctypes.Structure):
+    """`struct gpiohandle_data` of linux/gpio.h."""
+    _fields_ = [('values', ctypes.c_uint8 * 64)]
+
+
+def _iowr(number: int, size: int) -> int:
+    """The linux `_IOWR(0xB4, number, size)` ioctl request code of a GPIO ioctl."""
+    return (3 << 30) | (size << 16) | (0xB4 << 8) | number
+
+
+GPIO_GET_LINEHANDLE_IOCTL = _iowr(0x03, ctypes.sizeof(gpiohandle_request))
+GPIOHANDLE_SET_LINE_VALUES_IOCTL = _iowr(0x09, ctypes.sizeof(gpiohandle_data))
+GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+
+
+class GPIOChip:
+    """A linux GPIO character device, like /dev/gpiochip0."""
+
+    def __init__(self, path: str = '/dev/gpiochip0') -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+        self.handle_fd = None
+
+    def request_outputs(self, offsets: List[int], label: str) -> None:
+        """Request every line as a LOW output in a single line handle."""
+        import fcntl
+        request = gpiohandle_request()
+        for i, offset in enumerate(offsets):
+            request.lineoffsets[i] = offset
+        request.flags = GPIOHANDLE_REQUEST_OUTPUT
+        request.consumer_label = label.encode()[:31]
+        request.lines = len(offsets)
+        fcntl.ioctl(self.fd, GPIO_GET_LINEHANDLE_IOCTL, request)
+        self.handle_fd = request.fd
+
+    def set_values(self, values: List[int]) -> None:
+        """Set every requested line at once, `values` are in the order the lines were requested."""
+        import fcntl
+        data = gpiohandle_data()
+        for i, value in enumerate(values):
+            data.values[i] = value
+        fcntl.ioctl(self.handle_fd, GPIOHANDLE_SET_LINE_VALUES_IOCTL, data)
+
+    def close(self) -> None:
+        for fd in (self.handle_fd, self.fd):
+            if fd is not None:
+                os.close(fd)
+        self.handle_fd = self.fd = None
+
+
+class FakeGPIOChip:
+    """
+    An in-memory stand-in for `GPIOChip`, for developing and testing without a gpiochip device.
+
+    `lines` holds the current value of each requested line offset, and every `set_values()`
+    (each of which would be a single ioctl on a real chip) is appended to `writes` as {offset: value}.
+    """
+
+    def __init__(self, line_count: int = 54) -> None:
+        self.line_count = line_count
+        self.offsets = None
+        self.lines = {}
+        self.writes = []
+
+    def request_outputs(self, offsets: List[int], label: str) -> None:
+        if self.offsets is not None:
+            raise OSError("lines already requested")
+        invalid = [offset for offset in offsets if not 0 <= offset < self.line_count]
+        if invalid or len(offsets) > 64:
+            raise OSError(f"cannot request lines {offsets} of a chip with {self.line_count} lines")
+        self.offsets = list(offsets)
+        self.lines = {offset: 0 for offset in offsets}
+
+    def set_values(self, values: List[int]) -> None:
+        self.lines = dict(zip(self.offsets, values))
+        self.writes.append(dict(self.lines))
+
+    def close(self) -> None:
+        self.offsets = None
+
+
+class GPIOChipBackend(PinBackend):
+    """
+    The lines of a linux GPIO character device, by line offset (on a pi, the offsets of gpiochip0 are the BCM numbers).
+
+    Every pin is requested in one line handle once the `Controller` is set up, and each call sets
+    all of the handle's lines in a single ioctl, so any subset of pins switches at the same instant.
+    """
+
+    def __init__(self, chip='/dev/gpiochip0', label: str = 'trim-tabs') -> None:
+        """
+        :param chip: the path of a gpiochip device, or a chip-like object such as `FakeGPIOChip`
+        :param label: the consumer label the lines are requested with, shown by `gpioinfo`
+        """
+        self.chip = GPIOChip(chip) if isinstance(chip, str) else chip
+        self.label = label
+        self.lock = threading.Lock()
+        self.offsets = []
+        self.values = []
+
+    def setup(self, number: int) -> None:
+        if self.values:
+            raise RuntimeError("every line must be set up before the lines are requested.")
+        if number not in self.offsets:
+            self.offsets.append(number)
+
+    def start(self) -> None:
+        self.chip.request_outputs(self.offsets, self.label)
+        self.values = [0] * len(self.offsets)
+
+    def output(self, number: int, state: bool) -> None:
+        self.output_many({number: state})
+
+    def output_many(self, states: Dict[int, bool]) -> None:
+        with self.lock:
+            for number, state in states.items():
+                self.values[self.offsets.index(number)] = int(state)
+            self.chip.set_values(self.values)
+
+    def stop(self) -> None:
+        self.chip.close()
+
+
+def from_settings(settings: dict) -> PinBackend:
+    """
+    Create the backend configured by the `pins` section of settings.yml.
+
+    :param settings: the `pins` section of settings.yml
+    """
+    logger = logging.getLogger('Surf.Backends')
+    logger.info(f"Pin backend: {settings['backend']}")
+    if settings['backend'] == 'rpi':
+        return RPiGPIOBackend()
+    if settings['backend'] == 'mcp23017':
+        bus = MockSMBus() if settings['i2c_bus'] == 'mock' else settings['i2c_bus']
+        return MCP23017Backend(bus=bus, address=settings['i2c_address'])
+    if settings['backend'] == 'gpiochip':
+        chip = FakeGPIOChip() if settings['chip'] == 'fake' else settings['chip']
+        return GPIOChipBackend(chip=chip)
+    if settings['backend'] == 'none':
+        return NullBackend()
+    raise ValueError(f"unknown pin backend: '{settings['backend']}'")
+
+
+def default_backend() -> PinBackend:
+    """
+    The backend configured in settings.yml, or a `NullBackend` when the `USE_PINS`
+    environment variable (set by `surf.py --pins/--no_pins`) is not 'true'.
+    """
+    if os.environ.get('USE_PINS', 'true') != 'true':
+        return NullBackend()
+    from utils import utilities as u
+    return from_settings(u.read_settings()['pins'])
@@ -0,0 +1,275 @@
+"""
+Automatic travel-time calibration of `operating_modes.yml`.
+
+A calibration runs a schedule of full travels:
+    - for every concurrency from 1 up to the number of surfaces,
+    - for every group of that many surfaces,
+    - `trials` times, fully extending then fully retracting the group together.
+
+Each surface's full travel is timed by its limit switches or, without switches, by the operator
+marking the moment each surface reaches the end of its travel. A rate model, the seconds per
+full travel, is fit per surface, concurrency and direction with a 95% confidence interval,
+and the whole table of the operating mode is written back in one atomic replace.
+"""
+import os
+import math
+import time
+import yaml
+import logging
+import threading
+import statistics
+from datetime import datetime
+from itertools import combinations
+from typing import Callable, Dict, List
+
+import utils
+from utils import utilities as u
+
+# two-sided 95% critical values of Student's t distribution, by degrees of freedom
+T_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042,
+}
+
+
+def t_95(degrees_of_freedom: int) -> float:
+    """The 95% critical value of t, rounding the degrees of freedom down to the nearest tabulated value."""
+    tabulated = [d for d in T_95 if d <= degrees_of_freedom]
+    return T_95[max(tabulated)] if degrees_of_freedom <= 30 else 1.96
+
+
+class StopwatchTimer:
+    """
+    Time travels by operator marks.
+
+    While the pins are HIGH the operator enters the name (or number) of each surface as it reaches
+    the end of its travel, the time at which each line is entered is that surface's travel time.
+    The pins are set LOW at the timeout whether or not every surface has been marked (see
+    `Calibration.travel()`), a mark entered after that raises TimeoutError.
+    """
+
+    def __init__(self, prompt: Callable[[str], str] = input, echo: Callable[[str], None] = print) -> None:
+        self.prompt = prompt
+        self.echo = echo
+
+    def wait(self, surface_names: List[str], action: str, start: float, timeout: float) -> Dict[str, float]:
+        self.echo(
+            f"{action}ing {', '.join(surface_names)}: enter each surface's name or number "
+            f"({', '.join(f'{i + 1}={name}' for i, name in enumerate(surface_names))}) as it reaches the end."
+        )
+        durations = {}
+        while len(durations) < len(surface_names):
+            mark = self.prompt('> ').strip()
+            marked_at = time.monotonic() - start
+            if marked_at > timeout:
+                missing = set(surface_names) - set(durations)
+                raise TimeoutError(f"{missing} were not marked within {round(timeout, 3)} seconds, their pins were set LOW.")
+            if mark.isdigit() and 0 < int(mark) <= len(surface_names):
+                mark = surface_names[int(mark) - 1]
+            mark = mark.upper()
+            if len(surface_names) == 1 and not mark:
+                mark = surface_names[0]
+            if mark in surface_names and mark not in durations:
+                durations[mark] = marked_at
+                self.echo(f"  {mark}: {round(marked_at, 3)} seconds")
+            else:
+                self.echo(f"  '{mark}' is not one of the remaining surfaces.")
+        return durations
+
+
+class LimitSwitchTimer:
+    """
+    Time travels with the limit switches configured in control_surfaces.yml, for example:
+        - name: PORT
+          ...
+          limits:
+            extended: 5
+            retracted: 6
+
+    Switches are wired normally-open to ground, so a switch reads LOW once its end of travel is reached.
+    They are read with `RPi.GPIO`, so only the `rpi` pin backend is supported, the switches of the other
+    backends (an MCP23017, or the gpiochip lines) are not on the pi's header pins by these numbers.
+    """
+
+    poll_interval = 0.002
+
+    def __init__(self, controller) -> None:
+        backend = u.read_settings()['pins']['backend'] if os.environ.get('USE_PINS', 'true') == 'true' else 'none'
+        if backend != 'rpi':
+            raise ValueError(
+                f"limit switches are read with RPi.GPIO, which needs `pins: backend: rpi` in settings.yml, "
+                f"not '{backend}'."
+            )
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        # with `motion: isolated: true` the pins are driven by the motion process, which set the mode there
+        GPIO.setmode(GPIO.BCM)
+        self.limits = {
+            configured_surface['name']: configured_surface['limits']
+            for configured_surface in controller.config
+        }
+        for limits in self.limits.values():
+            for pin_number in limits.values():
+                GPIO.setup(pin_number, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+    def wait(self, surface_names: List[str], action: str, start: float, timeout: float) -> Dict[str, float]:
+        end = 'extended' if action == 'extend' else 'retracted'
+        durations = {}
+        while len(durations) < len(surface_names):
+            elapsed = time.monotonic() - start
+            if elapsed > timeout:
+                missing = set(surface_names) - set(durations)
+                raise TimeoutError(f"{missing} did not reach their {end} limit switch within {timeout} seconds.")
+            for surface_name in surface_names:
+                if surface_name not in durations and not self.GPIO.input(self.limits[surface_name][end]):
+                    durations[surface_name] = elapsed
+            time.sleep(self.poll_interval)
+        return durations
+
+
+class Calibration:
+
+    def __init__(self, controller, timer, trials: int = 3, withdraw_margin: float = 0.1) -> None:
+        self.controller = controller
+        self.timer = timer
+        self.trials = trials
+        self.withdraw_margin = withdraw_margin
+        self.logger = logging.getLogger('Surf.Calibration')
+        # (surface name, concurrency, 'extend' or 'retract') -> [seconds of full travel, ...]
+        self.samples = {}
+
+    @property
+    def schedule(self) -> List[tuple]:
+        """Every group of surfaces at every concurrency, each of which is fully extended then fully retracted."""
+        surface_names = self.controller.surface_names
+        return [
+            group
+            for concurrency in range(1, len(surface_names) + 1)
+            for group in combinations(surface_names, concurrency)
+        ]
+
+    def travel(self, group: tuple, action: str) -> None:
+        """
+        Fully travel a group of surfaces together, recording how long each one took.
+
+        The pins are set LOW by a timer at the timeout, even while the timer waits on the operator.
+        """
+        timeout = 3 * self.controller.duration(1, 'withdraw', pin_count=len(group))
+        pins = [getattr(self.controller.surfaces[surface_name], f"{action}_pin") for surface_name in group]
+        self.cool(group, action)
+        with self.controller.motion_lock:
+            for pin in pins:
+                pin.high()
+            start = time.monotonic()
+            cutoff = threading.Timer(timeout, self.cut_off, args=(pins, timeout))
+            cutoff.daemon = True
+            cutoff.start()
+            try:
+                durations = self.timer.wait(list(group), action, start, timeout)
+            finally:
+                cutoff.cancel()
+                for pin in pins:
+                    if pin.state:
+                        pin.low()
+        for surface_name, duration in durations.items():
+            self.logger.info(f"{surface_name} {action}: {round(duration, 3)} seconds with {len(group)} pin(s) hot")
+            self.samples.setdefault((surface_name, len(group), action), []).append(duration)
+            self.controller.surfaces[surface_name].position = 1 if action == 'extend' else 0
+
+    def cut_off(self, pins: list, timeout: float) -> None:
+        self.logger.warning(f"the travel did not finish within {round(timeout, 3)} seconds, setting its pins LOW.")
+        for pin in pins:
+            pin.low()
+
+    def cool(self, group: tuple, action: str) -> None:
+        """Wait, rather than fail the calibration, until the actuators of a group may be powered for a full travel."""
+        from utils.duty import DutyCycleExceeded
+
+        full_travel = self.controller.duration(1, 'withdraw', pin_count=len(group))
+        while True:
+            try:
+                self.controller.throttle(
+                    {surface_name: full_travel for surface_name in group}, retracting=action == 'retract'
+                )
+                return
+            except DutyCycleExceeded as e:
+                self.logger.info(f"{'+'.join(group)}: cooling for {round(e.delay)} seconds before the next travel")
+                time.sleep(e.delay)
+
+    def run(self) -> dict:
+        """Run the whole schedule, starting (and ending) with every surface fully retracted."""
+        self.logger.info(f"Calibrating '{self.controller.mode}': {len(self.schedule)} groups x {self.trials} trial(s)")
+        self.controller.retract(blindly=True)
+        for group in self.schedule:
+            for trial in range(self.trials):
+                self.logger.info(f"{'+'.join(group)}: trial {trial + 1} of {self.trials}")
+                self.travel(group, 'extend')
+                self.travel(group, 'retract')
+        return self.fit()
+
+    def fit(self) -> dict:
+        """
+        Fit the seconds of full travel of each surface, concurrency and direction.
+
+        :return: {surface name: {concurrency: {direction: {'mean': x, 'ci95': [low, high], 'samples': n}}}}
+        """
+        fits = {}
+        for (surface_name, concurrency, action), durations in sorted(self.samples.items()):
+            mean = statistics.mean(durations)
+            if len(durations) > 1:
+                half_width = t_95(len(durations) - 1) * statistics.stdev(durations) / math.sqrt(len(durations))
+            else:
+                half_width = 0
+            fits.setdefault(surface_name, {}).setdefault(concurrency, {})[action] = {
+                'mean': round(mean, 3),
+                'ci95': [round(mean - half_width, 3), round(mean + half_width, 3)],
+                'samples': len(durations),
+            }
+        return fits
+
+    def table(self, fits: dict, operating_mode: dict, incremental: bool = False) -> dict:
+        """
+        Build the new operating mode table from the fits.
+
+        - `deploy` is the mean full-travel time, in either direction, across the surfaces at each concurrency.
+          (`deploy` timings are used by every tracked move, whichever way the surfaces are moving)
+        - `withdraw` is the slowest upper confidence bound of a full retract at each concurrency,
+          plus `withdraw_margin`, so a blind withdraw always reaches the end of travel.
+        - with `incremental`, each surface's increment timing is `Surface.increment_by` of its
+          single-pin full-travel time in that direction.
+        """
+        table = dict(operating_mode)
+        for concurrency in range(1, len(self.controller.surface_names) + 1):
+            travels = [fits[name][concurrency] for name in fits if concurrency in fits[name]]
+            table[concurrency] = {
+                'deploy': round(statistics.mean(
+                    [travel[action]['mean'] for travel in travels for action in ('extend', 'retract')]
+                ), 2),
+                'withdraw': round(
+                    max(travel['retract']['ci95'][1] for travel in travels) * (1 + self.withdraw_margin), 2
+                ),
+            }
+        if incremental:
+            increment_by = next(iter(self.controller.surfaces.values())).increment_by
+            table['incremental'] = {
+                surface_name: {
+                    action: round(increment_by * fits[surface_name][1][action]['mean'], 3)
+                    for action in ('extend', 'retract')
+                }
+                for surface_name in self.controller.surface_names
+            }
+        table['calibration'] = {
+            'date': datetime.now().strftime('%d-%m-%Y %H:%M:%S'),
+            'trials': self.trials,
+            'surfaces': fits,
+        }
+        return table
+
+    def write(self, table: dict) -> str:
+        """Atomically replace this mode's table in operating_modes.yml, leaving the other modes untouched."""
+        path = os.path.join(utils.CONFIG_DIR, 'operating_modes.yml')
+        operating_modes = yaml.safe_load(open(path, 'r'))
+        operating_modes[self.controller.mode] = table
+        u.atomic_write(path, yaml.dump(operating_modes, default_flow_style=False, sort_keys=False))
+        self.logger.info(f"wrote calibrated '{self.controller.mode}' timings to '{path}'")
+        return path
@@ -2,42 +2,86 @@ import os
 import yaml
 import time
 import logging
-from typing import List, Set
-
-if os.environ.get('USE_PINS', 'true') == 'true':
-    import RPi.GPIO as GPIO
+import threading
+from array import array
+from collections import deque, namedtuple
+from itertools import groupby
+from typing import Callable, Dict, Iterator, List, Set
 
 from utils import CONFIG_DIR, PROFILES_DIR
 from utils import utilities as u
+from utils import backends
+from utils import history
+from utils.model import ACTION, PIN_ACTION, RuntimeModel
 
 # module level variable populated when `start()` is called
 # this same instance of the variable can be imported from this
 # module anywhere that this module can be imported
 controller = None
 
+# a single timed change of one pin, produced by `Controller.plan_move()` and consumed by `Controller.execute()`
+#   - at:       seconds after the start of the move at which the edge should happen
+#   - surface:  the name of the surface whose pin changes
+#   - action:   'extend' or 'retract', which of the surface's pins changes
+#   - state:    1 for HIGH, 0 for LOW
+#   - position: for LOW edges, the position the surface will be at once the pin is LOW, otherwise None
+Edge = namedtuple('Edge', ['at', 'surface', 'action', 'state', 'position'])
+
 
 class Controller:
     path = os.path.join(CONFIG_DIR, 'control_surfaces.yml')
     modes = os.path.join(CONFIG_DIR, 'operating_modes.yml')
 
-    def __init__(self):
+    def __init__(self, path: str = None, modes: str = None, mode: str = None, backend=None, name: str = None):
+        """
+        :param path: a control_surfaces.yml, by default the one in CONFIG_DIR
+        :param modes: an operating_modes.yml, by default the one in CONFIG_DIR
+        :param mode: the operating mode, by default the `MODE` environment variable
+        :param backend: a `utils.backends.PinBackend`, by default chosen by the `USE_PINS` environment variable
+        :param name: names this controller when several are run together (see `utils.fleet.Fleet`)
+        """
+        self.path = path or self.path
+        self.modes = modes or self.modes
+        self.name = name
+        self.listeners = []
+        # held for the whole of any move, so that moves requested from other threads
+        # (the GPS monitor, the control API, ...) wait for each other rather than overlapping
+        self.motion_lock = threading.RLock()
+        # optionally a `utils.feedback.FeedbackLoop`, when set moves are closed-loop rather than dead-reckoned
+        self.feedback = None
+        # optionally a `utils.status.StatusPublisher`, which publishes the state to shared memory
+        self.status = None
+        # optionally a `utils.duty.DutyCycle`, which accounts the pins' on-time and refuses moves which would overheat
+        self.duty = None
+        # optionally a `utils.watchdog.PinWatchdog`, which forces pins LOW once they are HIGH past their deadline
+        self.watchdog = None
         self.active_profile = None
+        # set by the UI when the active profile should be deactivated once the PROFILES screen is entered
         self.deactivate_required = False
+        # seconds each group of edges happened after its scheduled time, most recent last
+        self.edge_latencies = deque(maxlen=10000)
 
-        self.logger = logging.getLogger('Surf.Controller')
-        self.mode = os.environ.get('MODE', 'wet')
+        self.logger = logging.getLogger(f'Surf.Controller.{name}' if name else 'Surf.Controller')
+        self.mode = mode or os.environ.get('MODE', 'wet')
         self.logger.info(f"Mode: {self.mode}")
-        self.use_pins = os.environ.get('USE_PINS', 'true') == 'true'
+        self.backend = backend or backends.default_backend()
+        self.use_pins = not isinstance(self.backend, backends.NullBackend)
 
         self.travel_durations = yaml.safe_load(open(self.modes, 'r'))[self.mode]
-        if self.use_pins:
-            # ensure that the rasberry pi pins are ready to go
-            GPIO.setwarnings(False)
-            GPIO.setmode(GPIO.BCM)
+
+        # see the `retract` section of settings.yml, `retracts_since_homing` is None until the first full withdraw
+        retract_settings = u.read_settings()['retract']
+        self.retract_mode = retract_settings['mode']
+        self.retract_margin = retract_settings['margin']
+        self.full_withdraw_every = retract_settings['full_withdraw_every']
+        self.retracts_since_homing = None
 
         # create the pin attributes
         self.config = yaml.safe_load(open(self.path, 'r'))
-        self.surface_names = [configured_surface['name'] for configured_surface in self.config]
+        # the validated config the hot paths use, positions are indexed like its surfaces (see `utils.model`)
+        self.model = RuntimeModel.compile(self.travel_durations, self.config, self.mode)
+        self.surface_names = list(self.model.names)
+        self.position_vector = array('d', [0.0] * len(self.surface_names))
         for configured_surface in self.config:
             setattr(
                 self,
@@ -54,6 +98,9 @@ class Controller:
             configured_surface['name']: getattr(self, configured_surface['name'])
             for configured_surface in self.config
         }
+        # every pin, each surface's extend pin then its retract pin, in the order of the model's surfaces
+        self.pins = tuple(pin for surface in self.surfaces.values() for pin in surface.pins)
+        self.backend.start()
 
         self.logger.info("")
         self.logger.info(f"Operating Mode: '{self.mode}'")
@@ -64,28 +111,90 @@ class Controller:
                 )
         self.logger.info("")
 
+    @property
+    def active_profile(self) -> str:
+        return self._active_profile
+
+    @active_profile.setter
+    def active_profile(self, profile_name: str) -> None:
+        self._active_profile = profile_name
+        self.notify('profile', 'active_profile', profile_name)
+
+    def add_listener(self, callback: Callable[[str, str, object], None]) -> None:
+        """
+        Register a callback to be called whenever a position, a pin-state or the active profile changes.
+
+        The callback is called with `(kind, name, value)`, for example:
+            - ('position', 'PORT', 0.25)
+            - ('pin', 'PORT.extend', 1)
+            - ('profile', 'active_profile', 'steep')
+            - ('move', 'started', 1.84), with the seconds the move is planned to take, then ('move', 'finished', None)
+
+        Callbacks are called on whichever thread made the change, so they should be quick.
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, str, object], None]) -> None:
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def notify(self, kind: str, name: str, value) -> None:
+        """Call each of the registered listeners with a change."""
+        for listener in list(self.listeners):
+            try:
+                listener(kind, name, value)
+            except Exception:
+                self.logger.exception(f"listener {listener} failed handling ({kind}, {name}, {value})")
+
     def get_profile_surface_values(self, profile_name):
         return u.Profile.read_config(username=profile_name)['control_surfaces']
 
-    def activate_profile(self, profile_name: str):
+    def activate_profile(self, profile_name: str, optimize: str = None):
         if not profile_name:
             return self.values
 
-        self.active_profile = profile_name
-        self.move_to(
-            new_positions={
-                surface_name: value/100
-                for surface_name, value in u.Profile.read_config(username=profile_name)['control_surfaces'].items()
-            }
-        )
+        self.logger.info(f"Activating profile: '{profile_name}'")
+        previous, self.active_profile = self.active_profile, profile_name
+        try:
+            self.move_to(
+                new_positions={
+                    surface_name: value/100
+                    for surface_name, value in u.Profile.read_config(username=profile_name)['control_surfaces'].items()
+                },
+                optimize=optimize
+            )
+        except Exception:
+            # a refused move (see `throttle()`) leaves the surfaces where the previous profile put them
+            self.active_profile = previous
+            raise
         return self.values
 
+    def transition_profile(self, from_profile: str, to_profile: str, optimize: str = None) -> dict:
+        """
+        Move straight from one profile's positions to another's in a single move, without retracting in between.
+
+        :param from_profile: the username of the profile which is active now
+        :param to_profile: the username of the profile to switch to
+        """
+        if self.active_profile not in (from_profile, to_profile):
+            self.logger.warning(
+                f"transitioning from '{from_profile}' but '{self.active_profile}' is the active profile"
+            )
+        self.logger.info(f"Transitioning profile: '{from_profile}' -> '{to_profile}'")
+        return self.activate_profile(to_profile, optimize=optimize)
+
     def update_profile(self):
         if not self.active_profile:
             return
 
         config_path = os.path.join(PROFILES_DIR, f"{self.active_profile}.yml")
         current_config = yaml.safe_load(open(config_path, 'r'))
+        history.record(
+            self.active_profile,
+            current_config['control_surfaces'],
+            {surface_name: int(value) for surface_name, value in self.values.items()},
+            'save',
+        )
         open(config_path, 'w').write(
             yaml.dump(
                 {
@@ -100,9 +209,27 @@ class Controller:
 
     def deactivate_profile(self) -> dict:
         self.active_profile = None
-        self.retract(blindly=True)
+        with self.motion_lock:
+            self.execute(self.plan_withdraw())
         return self.values
 
+    def swap_config(self, travel_durations: dict = None, config: list = None) -> None:
+        """
+        Replace the operating mode's durations, or the control surfaces config, between moves.
+
+        Both are compiled into a new `RuntimeModel`, raising ValueError if they are invalid. Only
+        settings which need no new pins are swapped (see `utils.reload`), the surfaces and their
+        pins stay those the controller was created with.
+
+        :param travel_durations: the current mode's section of operating_modes.yml
+        :param config: the contents of control_surfaces.yml
+        """
+        travel_durations = self.travel_durations if travel_durations is None else travel_durations
+        config = self.config if config is None else config
+        compiled = RuntimeModel.compile(travel_durations, config, self.mode)
+        with self.motion_lock:
+            self.travel_durations, self.config, self.model = travel_durations, config, compiled
+
     @property
     def surface_display_order(self) -> list:
         return [surface['name'] for surface in self.config][::-1]
@@ -118,11 +245,7 @@ class Controller:
 
     def retract(self, blindly: bool = False) -> None:
         if blindly:
-            self.high(
-                self.retract_pins,
-                travel=1.0,
-                action_mode='withdraw'
-            )
+            self.execute(self.plan_blind_retract())
         else:
             self.move_to(
                 {
@@ -132,17 +255,51 @@ class Controller:
                 action_mode='deploy'
             )
 
-    def move_to(self, new_positions: dict, action_mode: str = 'deploy') -> None:
+    def move_to(self, new_positions: dict, action_mode: str = 'deploy', optimize: str = None) -> None:
         """
         Given a dict of surface names and positions, move the surfaces to those positions.
 
         :param new_positions: a dictionary with surface names as keys and new positions as values.
                               positions must be float values >= 0 and <= 1
-        :param full_travel_duration: how many seconds of travel it would take to go from position 0 to position 1
+        :param action_mode: 'deploy' or 'withdraw', which of the operating-mode durations to use
+        :param optimize: None moves every surface at once, 'time' staggers or overlaps the surfaces
+                         in whichever order has the lowest total wall time (see `utils.optimizer`)
+        """
+        assert optimize in (None, 'time'), f"unknown optimize mode: '{optimize}'"
+        if self.feedback and self.feedback.covers(new_positions):
+            if optimize:
+                self.logger.info(f"optimize='{optimize}' is ignored, the feedback loop moves every surface at once.")
+            self.feedback.move_to(new_positions, action_mode=action_mode)
+            return
+
+        with self.motion_lock:
+            if optimize == 'time':
+                from utils import optimizer
+                self.execute(optimizer.plan_fastest(self, new_positions, action_mode=action_mode))
+            else:
+                self.execute(self.plan_move(new_positions, action_mode=action_mode))
+
+    def plan_move(self, new_positions: dict, action_mode: str = 'deploy') -> List[Edge]:
+        """
+        Translate a dict of surface names and positions into the timed pin edges which perform that move.
+
+        All of the required pins go HIGH at 0 seconds, then each pin goes LOW once its surface has
+        travelled far enough, at the speed given by the number of pins which are still hot.
+
+        Example (wet mode):
+            - context: all surfaces are at 0
+            - given: {"PORT": 0.1, "CENTER": 0.2}
+              return: [Edge(0, 'PORT', 'extend', 1, None), Edge(0, 'CENTER', 'extend', 1, None),
+                       Edge(0.42, 'PORT', 'extend', 0, 0.1), Edge(0.78, 'CENTER', 'extend', 0, 0.2)]
+
+        :param new_positions: a dictionary with surface names as keys and new positions as values.
+        :param action_mode: 'deploy' or 'withdraw'
+        :return: a list of `Edge` ordered by the time at which they should happen.
         """
         assert all([0 <= new_position <= 1 for new_position in new_positions.values()])
 
         # prevent moving to the current position
+        new_positions = dict(new_positions)
         for surface_name, new_position in new_positions.copy().items():
             if self.surfaces[surface_name].position == new_position:
                 self.logger.info(f"{surface_name} already at {new_position}")
@@ -151,7 +308,7 @@ class Controller:
         # if all the given positions are the same as the current positions, don't do anything.
         if not new_positions:
             self.logger.info("no change required, all positions already satisfied.")
-            return
+            return []
 
         # transform inputs into easy to follow durations/steps
         change_manifest = self.create_manifest(new_positions)
@@ -163,15 +320,21 @@ class Controller:
                 f"{self.surfaces[surface_name].position} to {new_positions[surface_name]}"
             )
 
+        return self.plan_manifest(change_manifest, new_positions, action_mode=action_mode)
+
+    def plan_manifest(self, change_manifest: dict, new_positions: dict, action_mode: str = 'deploy') -> List[Edge]:
+        """
+        Translate a change_manifest (see `create_manifest()`) into timed pin edges.
+
+        :param change_manifest: the percentage of total travel and pin for each surface
+        :param new_positions: the position each surface will be at once its pin goes LOW
+        :param action_mode: 'deploy' or 'withdraw'
+        """
         # set all of the target pins high to start
-        hot_pin_count = 0
-        for surface_name, manifest in change_manifest.items():
-            if manifest["action"] == 'retract':
-                hot_pin_count += 1
-                self.surfaces[surface_name].retract_pin.high()
-            elif manifest["action"] == 'extend':
-                hot_pin_count += 1
-                self.surfaces[surface_name].extend_pin.high()
+        edges = [
+            Edge(0, surface_name, manifest['action'], 1, None)
+            for surface_name, manifest in change_manifest.items()
+        ]
 
         # then after each interval gap, turn off the satisfied pins
         deactive_surfaces_after_percentage_travel = self.deactive_surfaces_after_percentage_travel(
@@ -180,30 +343,209 @@ class Controller:
                 for surface_name, manifest in change_manifest.items()
             }
         )
+        elapsed = 0
+        hot_pin_count = len(change_manifest)
         for partial_travel, surface_names in deactive_surfaces_after_percentage_travel:
-            partial_duration = self.duration(partial_travel, action_mode=action_mode)
+            partial_duration = self.duration(partial_travel, action_mode=action_mode, pin_count=hot_pin_count)
 
-            self.logger.info(f" > {self.hot_pin_count} pin(s)")
+            self.logger.info(f" > {hot_pin_count} pin(s)")
             self.logger.info(f" > traveling {round(partial_travel, 6)*100}% full-travel")
             self.logger.info(f" > takes {round(partial_duration, 6)} seconds.")
 
-            self.logger.info(f'sleeping for {round(partial_duration, 6)} seconds...')
-            time.sleep(partial_duration)
-            for surface_name in surface_names:
+            elapsed += partial_duration
+            for surface_name in sorted(surface_names, key=self.model.index.__getitem__):
                 hot_pin_count -= 1
-                manifest = change_manifest[surface_name]
-                getattr(self.surfaces[surface_name], f"{manifest['action']}_pin").low()
-                self.surfaces[surface_name].position = new_positions[surface_name]
+                edges.append(
+                    Edge(elapsed, surface_name, change_manifest[surface_name]['action'], 0, new_positions[surface_name])
+                )
+        return edges
+
+    def plan_blind_retract(self) -> List[Edge]:
+        """The edges which hold every retract pin HIGH for the full `withdraw` duration, homing all surfaces to 0."""
+        duration = self.model.durations[len(self.surfaces)][ACTION['withdraw']]
+        self.retracts_since_homing = 0
+        return (
+            [Edge(0, surface_name, 'retract', 1, None) for surface_name in self.surfaces]
+            + [Edge(duration, surface_name, 'retract', 0, 0) for surface_name in self.surfaces]
+        )
+
+    def plan_positional_retract(self) -> List[Edge]:
+        """
+        The edges which retract each extended surface for its known position plus `retract_margin` of full travel.
+
+        The travel is timed at the `withdraw` rate, and is not capped at full travel, so that a surface at 1
+        is still retracted for the margin beyond its end stop.
+
+        Example:
+            - context: PORT is at 0.1, CENTER is at 0.2, STARBOARD is at 0, `retract_margin` is 0.1
+              return the edges which retract PORT for 0.2 and CENTER for 0.3 of full travel
+        """
+        change_manifest = {
+            surface_name: {"travel": surface.position + self.retract_margin, "action": "retract"}
+            for surface_name, surface in self.surfaces.items()
+            if surface.position > 0
+        }
+        if not change_manifest:
+            self.logger.info("no change required, all surfaces already retracted.")
+            return []
+        for surface_name, manifest in change_manifest.items():
+            self.logger.info(
+                f"retracting {surface_name} from {self.surfaces[surface_name].position} "
+                f"for {round(manifest['travel'], 6)*100}% full-travel"
+            )
+        self.retracts_since_homing += 1
+        return self.plan_manifest(
+            change_manifest, {surface_name: 0 for surface_name in change_manifest}, action_mode='withdraw'
+        )
+
+    @property
+    def full_withdraw_due(self) -> bool:
+        """Whether the next withdraw must be a full blind withdraw, which re-homes every surface."""
+        return (
+            self.retract_mode == 'blind'
+            or self.retracts_since_homing is None
+            or self.retracts_since_homing + 1 >= self.full_withdraw_every
+        )
+
+    def plan_withdraw(self) -> List[Edge]:
+        """
+        The edges which retract every surface when a profile is deactivated, following the `retract` policy.
+
+        Usually each surface is retracted for its known position (plus a margin), but the first withdraw
+        after starting, and every `full_withdraw_every` withdraw after that, is a full blind withdraw
+        so that the dead-reckoned positions are periodically re-homed.
+        """
+        if self.full_withdraw_due:
+            self.logger.info("full blind withdraw, re-homing all surfaces.")
+            return self.plan_blind_retract()
+        return self.plan_positional_retract()
+
+    @staticmethod
+    def edge_groups(edges: List[Edge]) -> Iterator[tuple]:
+        """Group a list of edges by the time at which they happen, yielding `(at, [edges])` in time order."""
+        for at, group in groupby(sorted(edges, key=lambda edge: edge.at), key=lambda edge: edge.at):
+            yield at, list(group)
+
+    def apply_edges(self, edges: List[Edge], write: bool = True) -> None:
+        """
+        Set the pins of the given edges HIGH or LOW now, and record the new positions of LOW edges.
+
+        Every pin of the group is written in one `PinBackend.output_many()`, so backends which can set
+        several pins in a single transaction switch the whole group at the same instant.
+
+        :param write: False when the backend has already written the pins, and only the new states are recorded
+        """
+        for edge in edges:
+            pin = self.pin(edge.surface, edge.action)
+            pin.mark(edge.state)
+            pin.logger.info(f"Pin {pin.number} {'HIGH' if edge.state else 'LOW'}")
+        if write:
+            self.backend.output_many(self.edge_states(edges))
+        for edge in edges:
+            if not edge.state and edge.position is not None:
+                self.surfaces[edge.surface].position = edge.position
+
+    def pin(self, surface_name: str, action: str) -> 'Pin':
+        """A surface's 'extend' or 'retract' `Pin`."""
+        return self.pins[2 * self.model.index[surface_name] + PIN_ACTION[action]]
+
+    def edge_states(self, edges: List[Edge]) -> Dict[int, bool]:
+        """The {pin number: state} a group of edges sets."""
+        pin_numbers = self.model.pins
+        return {
+            pin_numbers[self.model.index[edge.surface]][PIN_ACTION[edge.action]]: bool(edge.state)
+            for edge in edges
+        }
+
+    def execute(self, edges: List[Edge]) -> None:
+        """Perform a list of edges, sleeping between them, and return once the last edge has happened."""
+        with self.motion_lock:
+            groups = list(self.edge_groups(edges))
+            if not groups:
+                return
+            self.throttle(self.on_times(edges), retracting=all(edge.action == 'retract' for edge in edges))
+            self.notify('move', 'started', groups[-1][0])
+            start = time.monotonic()
+            try:
+                self.perform(groups)
+            finally:
+                self.notify('move', 'finished', None)
+            # `utils.logs` indexes these lines, a move which only retracts surfaces to 0 is a withdraw
+            withdraw = all(edge.action == 'retract' and edge.position in (None, 0) for edge in edges)
+            self.logger.info(
+                f"{'Withdraw' if withdraw else 'Move'} finished in {round(time.monotonic() - start, 3)} seconds "
+                f"(planned {round(groups[-1][0], 3)})"
+            )
+
+    def on_times(self, edges: List[Edge]) -> Dict[str, float]:
+        """The seconds each surface's pins are HIGH during a list of edges."""
+        on_times, since = {}, {}
+        for edge in sorted(edges, key=lambda edge: edge.at):
+            if edge.state:
+                since[(edge.surface, edge.action)] = edge.at
+            elif (edge.surface, edge.action) in since:
+                on_times[edge.surface] = (
+                    on_times.get(edge.surface, 0) + edge.at - since.pop((edge.surface, edge.action))
+                )
+        return on_times
+
+    def throttle(self, on_times: Dict[str, float], retracting: bool = False) -> None:
+        """
+        Refuse a move, raising `utils.duty.DutyCycleExceeded`, if surfaces cannot yet be powered for the given seconds.
+
+        The move is refused rather than waited for, which would hold the `motion_lock` (and, from the UI,
+        the kivy thread) for as long as the actuators take to cool. A move which only retracts is never
+        refused, so that the surfaces can always be withdrawn.
+
+        :param retracting: whether the move only retracts surfaces
+        """
+        delay = self.duty.delay(on_times) if self.duty and not retracting else 0
+        if delay:
+            from utils.duty import DutyCycleExceeded
+            self.logger.warning(f"refusing the move, the actuators must cool for {round(delay, 2)} seconds first")
+            raise DutyCycleExceeded(delay)
+
+    def perform(self, groups: List[tuple]) -> None:
+        """Perform grouped edges (see `edge_groups()`), in this thread or by a timed backend."""
+        if self.backend.timed:
+            # the backend times the edges itself (see `utils.motion`), each group is recorded once it has happened
+            for i, latency in self.backend.run([(at, self.edge_states(group)) for at, group in groups]):
+                self.edge_latencies.append(latency)
+                self.apply_edges(groups[i][1], write=False)
+            return
+
+        low_times = self.low_times(groups) if self.watchdog else None
+        start = time.monotonic()
+        for i, (at, group) in enumerate(groups):
+            remaining = start + at - time.monotonic()
+            if remaining > 0:
+                self.logger.info(f'sleeping for {round(remaining, 6)} seconds...')
+                time.sleep(remaining)
+            self.apply_edges(group)
+            if self.watchdog:
+                self.watchdog.watch(
+                    self.edge_states(group), {number: start + at for number, at in low_times[i].items()}
+                )
+            self.edge_latencies.append(time.monotonic() - start - at)
+
+    def low_times(self, groups: List[tuple]) -> List[Dict[int, float]]:
+        """For each group of edges, {pin number: seconds after the start of the move it is set LOW again} of its HIGH pins."""
+        low_times, high_since = [{} for _ in groups], {}
+        for i, (at, group) in enumerate(groups):
+            for number, state in self.edge_states(group).items():
+                if state:
+                    high_since[number] = i
+                elif number in high_since:
+                    low_times[high_since.pop(number)][number] = at
+        return low_times
 
     def move_surfaces(self, surface_names, direction, duration) -> None:
         assert direction in ('extend', 'retract')
-        for surface_name, surface in self.surfaces.items():
-            if surface_name in surface_names:
-                getattr(surface, f"{direction}_pin").high()
+        for surface_name in surface_names:
+            self.pin(surface_name, direction).high()
         time.sleep(duration)
-        for surface_name, surface in self.surfaces.items():
-            if surface_name in surface_names:
-                getattr(surface, f"{direction}_pin").low()
+        for surface_name in surface_names:
+            self.pin(surface_name, direction).low()
 
 
     def high(self, pin_numbers: List[str], travel: float = None, action_mode: str = 'deploy') -> None:
@@ -215,10 +557,9 @@ class Controller:
         :param action_mode: optionally, 'deploy' or 'withdraw'
         """
         self.logger.info(f"Setting pins {pin_numbers} high...")
-        for surface in self.surfaces.values():
-            for pin in [surface.extend_pin, surface.retract_pin]:
-                if pin.number in pin_numbers:
-                    pin.high()
+        for pin in self.pins:
+            if pin.number in pin_numbers:
+                pin.high()
 
         if travel:
             duration = self.duration(travel, action_mode)
@@ -229,55 +570,52 @@ class Controller:
     def low(self, pin_numbers: List[str]) -> None:
         """Given a list of pin-numbers, set each of those pins LOW."""
         self.logger.info(f"Setting pins {pin_numbers} low...")
-        for surface in self.surfaces.values():
-            for pin in [surface.extend_pin, surface.retract_pin]:
-                if pin.number in pin_numbers:
-                    pin.low()
+        for pin in self.pins:
+            if pin.number in pin_numbers:
+                pin.low()
 
     @property
     def positions(self) -> dict:
         """A dict of the name each of the controllers `Surface` instances and its current position."""
-        return {surface.name: surface.position for surface in self.surfaces.values()}
+        return dict(zip(self.model.names, self.position_vector))
 
     @property
     def values(self) -> dict:
         return {
             surface_name: round(surface_position * 100, 0)
-            for surface_name, surface_position in self.positions.items()
+            for surface_name, surface_position in zip(self.model.names, self.position_vector)
         }
 
     @property
     def hot_pin_count(self) -> int:
         """How many pins are hot right now?"""
-        return sum([pin.state for surface in self.surfaces.values() for pin in surface.pins])
+        return sum(pin.state for pin in self.pins)
+
+    def duration(self, travel_percentage: float, action_mode: str = 'deploy', pin_count: int = None) -> float:
+        """
+        How many seconds it takes to travel a percentage of full travel.
 
-    def duration(self, travel_percentage: float, action_mode: str = 'deploy') -> float:
-        return travel_percentage * self.travel_durations[self.hot_pin_count][action_mode]
+        :param travel_percentage: what fraction of full travel, between 0 and 1
+        :param action_mode: 'deploy' or 'withdraw'
+        :param pin_count: how many pins are hot during the travel, defaults to how many are hot right now
+        """
+        pin_count = self.hot_pin_count if pin_count is None else pin_count
+        return travel_percentage * self.model.durations[pin_count][ACTION[action_mode]]
 
     @property
     def goofy_map(self) -> dict:
         """A dictionary which maps the names of surfaces and the name of their configured goofy surface."""
-        return {
-            control_surface['name']: control_surface['goofy']
-            for control_surface in self.config
-            if control_surface['name'] != control_surface['goofy']
-        }
+        return dict(self.model.goofy_map)
 
     @property
     def retract_pins(self) -> List[int]:
         """A list of the retract-pin numbers for each of the controllers `Surface` instances."""
-        return [
-            surface.retract_pin.number
-            for surface in self.surfaces.values()
-        ]
+        return [retract_pin for extend_pin, retract_pin in self.model.pins]
 
     @property
     def extend_pins(self) -> List[int]:
-        """A list of the retract-pin numbers for each of the controllers `Surface` instances."""
-        return [
-            surface.extend_pin.number
-            for surface in self.surfaces.values()
-        ]
+        """A list of the extend-pin numbers for each of the controllers `Surface` instances."""
+        return [extend_pin for extend_pin, retract_pin in self.model.pins]
 
     def create_manifest(self, new_positions: List[float]) -> dict:
         """
@@ -294,7 +632,7 @@ class Controller:
         # step one is to convert the new_positions dict into a durations dictionary
         # each value in this dict is positive if `extend` and negative if `retract`
         surface_percentage_travel = {
-            surface_name: (new_position - self.surfaces[surface_name].position)
+            surface_name: (new_position - self.position_vector[self.model.index[surface_name]])
             for surface_name, new_position in new_positions.items()
         }
         # here the durations are made absolute, and the `extend` or `retract` information stored as strings
@@ -439,6 +777,7 @@ class Surface:
 
         # configure identify variables
         self.name = name
+        self.index = controller.model.index[name]
         self.logger = logging.getLogger(f'Surf.{self.name}')
 
         # configure pins
@@ -446,17 +785,30 @@ class Surface:
         self.retract_pin = Pin(self, 'retract', retract_pin_number)
         self.pins = [self.extend_pin, self.retract_pin]
 
-        # this is how increment/decrement can use custom timings rather than the full out/back durations
-        op_modes = yaml.safe_load(open(os.path.join(CONFIG_DIR, 'operating_modes.yml'), 'r'))[self.controller.mode]
-        self.increment_extend_duration = op_modes['incremental'][self.name]['extend']
-        self.increment_retract_duration = op_modes['incremental'][self.name]['retract']
-
         # configure control variables
         self.position = 0
 
     def __dict__(self):
         return {'extend': self.extend_pin, 'retract': self.retract_pin}
 
+    @property
+    def increment_extend_duration(self) -> float:
+        """How increment/decrement can use custom timings rather than the full out/back durations."""
+        return self.controller.model.surfaces[self.index].increment_extend
+
+    @property
+    def increment_retract_duration(self) -> float:
+        return self.controller.model.surfaces[self.index].increment_retract
+
+    @property
+    def position(self) -> float:
+        return self.controller.position_vector[self.index]
+
+    @position.setter
+    def position(self, new_position: float) -> None:
+        self.controller.position_vector[self.index] = new_position
+        self.controller.notify('position', self.name, new_position)
+
     @property
     def value(self) -> int:
         return self.position * 100
@@ -479,7 +831,7 @@ class Surface:
             f"The `new_position` value must be greater than or equal to 0 and less than or equal to 1."
         )
 
-        duration = self.controller.travel_durations[1][action_mode] * abs(new_position - self.position)
+        duration = self.controller.model.duration(abs(new_position - self.position), action_mode, 1)
         if new_position > self.position:
             self.logger.info(
                 f"extending {self.name} from {self.position} to {new_position}"
@@ -497,22 +849,36 @@ class Surface:
 
     def increment(self) -> None:
         """Extend this control surface by `increment_by`, supports + and - in the UI Active Screen."""
-        if round(self.position + self.increment_by, 2) <= 1:
-            self.logger.info(
-                f'extending from {self.position} to {round(self.position + self.increment_by, 2)}'
-            )
-            self.position = round(self.position + self.increment_by, 2)
-            self.extend_pin.high(self.increment_extend_duration)
+        if self.controller.feedback and self.controller.feedback.covers([self.name]):
+            if round(self.position + self.increment_by, 2) <= 1:
+                self.controller.move_to({self.name: round(self.position + self.increment_by, 2)})
+            return self.value
+
+        with self.controller.motion_lock:
+            if round(self.position + self.increment_by, 2) <= 1:
+                self.logger.info(
+                    f'extending from {self.position} to {round(self.position + self.increment_by, 2)}'
+                )
+                self.controller.throttle({self.name: self.increment_extend_duration})
+                self.position = round(self.position + self.increment_by, 2)
+                self.extend_pin.high(self.increment_extend_duration)
         return self.value
 
     def decrement(self) -> None:
         """Retract this control surface by `increment_by`, supports + and - in the UI Active Screen."""
-        if round(self.position - self.increment_by, 2) >= 0:
-            self.logger.info(
-                f'retracting from {self.position} to {round(self.position - self.increment_by, 2)}'
-            )
-            self.position = round(self.position - self.increment_by, 2)
-            self.retract_pin.high(self.increment_retract_duration)
+        if self.controller.feedback and self.controller.feedback.covers([self.name]):
+            if round(self.position - self.increment_by, 2) >= 0:
+                self.controller.move_to({self.name: round(self.position - self.increment_by, 2)})
+            return self.value
+
+        with self.controller.motion_lock:
+            if round(self.position - self.increment_by, 2) >= 0:
+                self.logger.info(
+                    f'retracting from {self.position} to {round(self.position - self.increment_by, 2)}'
+                )
+                self.controller.throttle({self.name: self.increment_retract_duration}, retracting=True)
+                self.position = round(self.position - self.increment_by, 2)
+                self.retract_pin.high(self.increment_retract_duration)
         return self.value
 
 
@@ -529,8 +895,7 @@ class Pin:
         self.number = number
         self.surface = surface
         self.logger = logging.getLogger(f"Surf.{self.surface.name}.{self.name}")
-        if self.surface.controller.use_pins:
-            GPIO.setup([self.number], GPIO.OUT)
+        self.surface.controller.backend.setup(self.number)
         self.logger.info(f"Pin {self.number} {self.name}s {self.surface.name}")
         self.state = 0
 
@@ -540,9 +905,11 @@ class Pin:
 
         :param duration: seconds the pin should be set high. if no duration is given the pin will remain high.
         """
-        self.state = 1
-        if self.surface.controller.use_pins:
-            GPIO.output(self.number, True)
+        self.mark(1)
+        self.surface.controller.backend.output(self.number, True)
+        watchdog = self.surface.controller.watchdog
+        if duration and watchdog:
+            watchdog.arm(self.number, time.monotonic() + duration)
         if duration:
             self.logger.info(f"Pin {self.number} HIGH ({round(duration, 6)} seconds)")
             time.sleep(duration)
@@ -556,13 +923,45 @@ class Pin:
 
         If a `high` is called with a duration, this method will be called after that duration is over.
         """
-        self.state = 0
+        self.mark(0)
         self.logger.info(f"Pin {self.number} LOW")
-        if self.surface.controller.use_pins:
-            GPIO.output(self.number, False)
+        self.surface.controller.backend.output(self.number, False)
+        if self.surface.controller.watchdog:
+            self.surface.controller.watchdog.disarm(self.number)
+
+    def mark(self, state: int) -> None:
+        """Record a new state of this pin without writing it, the caller writes it (see `Controller.apply_edges()`)."""
+        self.state = state
+        self.surface.controller.notify('pin', f"{self.surface.name}.{self.name}", state)
 
 
 def start():
     global controller
-    controller = Controller()
-
+    settings = u.read_settings()
+    backend = None
+    if settings['motion']['isolated']:
+        from utils import motion
+        backend = motion.EngineBackend.from_settings(settings, use_pins=os.environ.get('USE_PINS', 'true') == 'true')
+    controller = Controller(backend=backend)
+
+    if settings['feedback']['enabled']:
+        from utils import feedback
+        controller.feedback = feedback.FeedbackLoop.from_settings(controller, settings['feedback'])
+        controller.logger.info(f"Feedback sensors: {list(controller.feedback.sensors)}")
+        controller.feedback.sync()
+
+    if settings['status']['enabled']:
+        from utils import status
+        try:
+            controller.status = status.StatusPublisher(controller, settings['status']['name'])
+        except FileExistsError as e:
+            # like `surf.py serve` while the UI runs, whose status is already published
+            controller.logger.warning(f"not publishing the status, {e}")
+
+    if settings['duty']['enabled']:
+        from utils import duty
+        duty.DutyCycle.from_settings(settings['duty']).attach(controller)
+
+    if settings['watchdog']['enabled']:
+        from utils import watchdog
+        watchdog.PinWatchdog.from_settings(controller.backend, settings['watchdog']).attach(controller)
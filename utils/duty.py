@@ -0,0 +1,193 @@
+"""
+Duty-cycle accounting and thermal throttling of the actuators.
+
+Every time a pin goes LOW, the time it was HIGH is added to that pin's cumulative on-time and cycle
+count, and to a rolling window of `bucket` second buckets. The counters are saved to
+`~/.surf/duty.json` every `save_every` seconds if they changed (and on exit) by a thread of their
+own, so they carry across sessions without writing to the SD card on every edge, or from the
+thread timing the edges.
+
+Each actuator's motor is modelled as heating while either of its pins is HIGH and cooling with a
+time-constant `time_constant` otherwise. The resulting "heat" is a running average of the actuator's
+duty-cycle, which settles at the actuator's duty-cycle under any steady pattern of use. Before a move
+the `Controller` asks how long it must defer it, so that the heat at the end of the move stays at or
+under `max_duty`. A move which would have to wait is refused with `DutyCycleExceeded` rather than
+waited for holding the motion lock, except a move which only retracts (see `Controller.throttle()`).
+"""
+import os
+import json
+import math
+import time
+import atexit
+import logging
+import threading
+from typing import Dict, List
+
+import utils
+from utils import utilities as u
+
+
+class DutyCycleExceeded(RuntimeError):
+    """A move was refused, its actuators must cool for `delay` seconds first."""
+
+    def __init__(self, delay: float) -> None:
+        super().__init__(f"the actuators must cool for {round(delay)} more seconds to stay within their duty-cycle.")
+        self.delay = delay
+
+
+class DutyCycle:
+
+    def __init__(self, path: str = None, window: float = 600, max_duty: float = 0.25,
+                 time_constant: float = 300, bucket: float = 10, save_every: float = 60) -> None:
+        """
+        :param window: seconds of the rolling duty-cycle window
+        :param max_duty: the largest fraction of the time an actuator may be powered, from its datasheet
+        :param time_constant: seconds in which an actuator sheds ~63% of its heat
+        """
+        self.path = path or os.path.join(utils.HOME_DIR, 'duty.json')
+        self.window = window
+        self.max_duty = max_duty
+        self.time_constant = time_constant
+        self.bucket = bucket
+        self.save_every = save_every
+        self.logger = logging.getLogger('Surf.Duty')
+        self.lock = threading.Lock()
+        # pin name ("PORT.extend") -> {'on_time': seconds, 'cycles': n, 'buckets': [[bucket start, seconds], ...]}
+        self.pins = {}
+        # surface name -> [heat, time.time() of the heat]
+        self.heat = {}
+        # pin name -> time.time() it went HIGH
+        self.on_since = {}
+        # set whenever the counters change, cleared once they are saved
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.load()
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> 'DutyCycle':
+        """:param settings: the `duty` section of settings.yml"""
+        return cls(
+            window=settings['window'],
+            max_duty=settings['max_duty'],
+            time_constant=settings['time_constant'],
+        )
+
+    def attach(self, controller) -> 'DutyCycle':
+        """Account every pin of a `Controller`, and throttle its moves."""
+        controller.duty = self
+        controller.add_listener(self.update)
+        threading.Thread(target=self.run, name='SurfDuty', daemon=True).start()
+        atexit.register(self.stop)
+        return self
+
+    def run(self) -> None:
+        """Save the counters every `save_every` seconds in which they changed, until `stop()` is called."""
+        while not self.stopped.wait(self.save_every):
+            if self.changed.is_set():
+                self.save()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.save()
+
+    def load(self) -> None:
+        if not os.path.isfile(self.path):
+            return
+        try:
+            saved = json.load(open(self.path, 'r'))
+        except ValueError:
+            self.logger.warning(f"'{self.path}' is unreadable, starting the duty-cycle counters from 0.")
+            return
+        self.pins = saved['pins']
+        self.heat = saved['heat']
+
+    def save(self) -> None:
+        with self.lock:
+            self.changed.clear()
+            text = json.dumps({'pins': self.pins, 'heat': self.heat}, separators=(',', ':'))
+        u.atomic_write(self.path, text)
+
+    def update(self, kind: str, name: str, value) -> None:
+        """Listen to a `Controller`'s pin changes (see `Controller.add_listener()`)."""
+        if kind != 'pin':
+            return
+        now = time.time()
+        if value:
+            self.on_since.setdefault(name, now)
+        elif name in self.on_since:
+            self.record(name, self.on_since.pop(name), now)
+
+    def record(self, pin_name: str, started: float, ended: float) -> None:
+        """Account one period a pin was HIGH."""
+        seconds = ended - started
+        with self.lock:
+            pin = self.pins.setdefault(pin_name, {'on_time': 0, 'cycles': 0, 'buckets': []})
+            pin['on_time'] = round(pin['on_time'] + seconds, 3)
+            pin['cycles'] += 1
+            start = ended - ended % self.bucket
+            if pin['buckets'] and pin['buckets'][-1][0] == start:
+                pin['buckets'][-1][1] = round(pin['buckets'][-1][1] + seconds, 3)
+            else:
+                pin['buckets'].append([start, round(seconds, 3)])
+            pin['buckets'] = [bucket for bucket in pin['buckets'] if bucket[0] > ended - self.window - self.bucket]
+
+            surface_name = pin_name.split('.')[0]
+            heat = self.heat_at(surface_name, started)
+            decay = math.exp(-seconds / self.time_constant)
+            self.heat[surface_name] = [heat * decay + (1 - decay), ended]
+            self.changed.set()
+
+    def heat_at(self, surface_name: str, moment: float = None) -> float:
+        """The heat of an actuator, between 0 and 1, having cooled since it was last powered."""
+        heat, updated = self.heat.get(surface_name, [0, 0])
+        moment = time.time() if moment is None else moment
+        return heat * math.exp(-max(moment - updated, 0) / self.time_constant)
+
+    def delay(self, on_times: Dict[str, float]) -> float:
+        """
+        Seconds a move must be deferred so that no actuator ends it hotter than `max_duty`.
+
+        :param on_times: {surface name: seconds the surface's pins will be HIGH during the move}
+        """
+        delay = 0
+        for surface_name, seconds in on_times.items():
+            decay = math.exp(-seconds / self.time_constant)
+            # the heat the actuator may start the move with, and still end it at `max_duty`
+            allowed = (self.max_duty - (1 - decay)) / decay
+            if allowed <= 0:
+                self.logger.warning(
+                    f"{surface_name}: {round(seconds, 2)} seconds of travel exceeds the duty-cycle limit "
+                    f"even from cold, not deferring it."
+                )
+                continue
+            heat = self.heat_at(surface_name)
+            if heat > allowed:
+                delay = max(delay, self.time_constant * math.log(heat / allowed))
+        return delay
+
+    def duty(self, pin_name: str, moment: float = None) -> float:
+        """The fraction of the rolling window in which a pin was HIGH."""
+        moment = time.time() if moment is None else moment
+        buckets = self.pins.get(pin_name, {}).get('buckets', [])
+        return sum(seconds for start, seconds in buckets if start > moment - self.window) / self.window
+
+    def report(self) -> List[dict]:
+        """A row for each pin: {'pin', 'on_time', 'cycles', 'duty', 'heat'}, the heat being that of its actuator."""
+        return [
+            {
+                'pin': pin_name,
+                'on_time': pin['on_time'],
+                'cycles': pin['cycles'],
+                'duty': self.duty(pin_name),
+                'heat': self.heat_at(pin_name.split('.')[0]),
+            }
+            for pin_name, pin in sorted(self.pins.items())
+        ]
+
+    def describe(self) -> List[str]:
+        """The report as lines of text, for the CLI and the UI."""
+        return [
+            f"{row['pin']:<18} {round(row['on_time'] / 3600, 2):>7} h  {row['cycles']:>7} cycles  "
+            f"{round(row['duty'] * 100, 1):>5}% duty  {round(row['heat'] / self.max_duty * 100):>3}% of limit"
+            for row in self.report()
+        ]
@@ -0,0 +1,153 @@
+"""
+Predicted wall times of moves: from the current positions to each profile, and between every pair of profiles.
+
+A move as planned by `Controller.plan_move()` raises every pin at once and drops each one as its
+surface arrives, the speed of the travel in between set by how many pins are still hot. With a
+move's travels sorted, surface k of S travels its difference to surface k-1 at the speed of
+S - k hot pins, so the wall time of any number of moves is a sort, a diff and a dot product with
+the operating mode's durations, done for all of them at once as arrays.
+
+`CostModel` keeps every profile's target positions, and the matrix of the wall times between
+each pair of them. `refresh()` only re-reads the profiles whose files changed, and only
+recomputes their rows and columns of the matrix, unless the operating mode's durations changed.
+"""
+import os
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+import utils
+from utils import utilities as u
+
+
+class CostModel:
+
+    def __init__(self, controller, action_mode: str = 'deploy') -> None:
+        """:param action_mode: 'deploy' or 'withdraw', which durations the moves are planned with"""
+        self.controller = controller
+        self.action_mode = action_mode
+        self.logger = logging.getLogger('Surf.ETA')
+        self.surface_names = list(controller.surface_names)
+        self.usernames = []
+        # one row per profile in `usernames`, its target positions in the order of `surface_names`
+        self.targets = np.empty((0, len(self.surface_names)))
+        # seconds to move from the positions of profile i to those of profile j
+        self.matrix = np.empty((0, 0))
+        # profile username -> modification time of its file when it was read
+        self.stamps = {}
+        self.rates = None
+        self.refresh()
+
+    @property
+    def index(self) -> Dict[str, int]:
+        return {username: i for i, username in enumerate(self.usernames)}
+
+    def current_rates(self) -> np.ndarray:
+        """The seconds of full travel with 0, 1, ... S pins hot, in the current operating mode."""
+        return np.array([0.0] + [
+            self.controller.duration(1, self.action_mode, pin_count=pin_count)
+            for pin_count in range(1, len(self.surface_names) + 1)
+        ])
+
+    def wall_times(self, travels: np.ndarray) -> np.ndarray:
+        """
+        The wall time of each move, given the distance each surface travels in it.
+
+        :param travels: (..., surfaces) fractions of full travel
+        :return: (...) seconds
+        """
+        travels = np.sort(np.abs(travels), axis=-1)
+        steps = np.diff(travels, axis=-1, prepend=0)
+        hot = len(self.surface_names) - np.arange(len(self.surface_names))
+        return steps @ self.rates[hot]
+
+    def on_times(self, travels: np.ndarray) -> np.ndarray:
+        """The seconds each surface's pin is HIGH during a single move, in the order of `surface_names`."""
+        order = np.argsort(travels)
+        steps = np.diff(travels[order], prepend=0)
+        hot = len(self.surface_names) - np.arange(len(self.surface_names))
+        on_times = np.empty(len(travels))
+        on_times[order] = np.cumsum(steps * self.rates[hot])
+        return on_times
+
+    def profile_stamps(self) -> Dict[str, int]:
+        return {
+            file_name[:-len('.yml')]: os.stat(os.path.join(utils.PROFILES_DIR, file_name)).st_mtime_ns
+            for file_name in os.listdir(utils.PROFILES_DIR)
+            if file_name.endswith('.yml')
+        }
+
+    def read_targets(self, username: str) -> List[float]:
+        values = u.Profile.read_config(username=username)['control_surfaces']
+        return [values.get(surface_name, 0) / 100 for surface_name in self.surface_names]
+
+    def refresh(self) -> bool:
+        """Pick up added, changed and deleted profiles and any change of operating mode, True if anything changed."""
+        stamps = self.profile_stamps()
+        rates = self.current_rates()
+        removed = [username for username in self.usernames if username not in stamps]
+        changed = [username for username, stamp in stamps.items() if self.stamps.get(username) != stamp]
+        rates_changed = self.rates is None or not np.array_equal(rates, self.rates)
+        if not (removed or changed or rates_changed):
+            return False
+
+        if removed:
+            keep = [i for i, username in enumerate(self.usernames) if username not in removed]
+            self.usernames = [self.usernames[i] for i in keep]
+            self.targets = self.targets[keep]
+            self.matrix = self.matrix[np.ix_(keep, keep)]
+            for username in removed:
+                del self.stamps[username]
+
+        added = [username for username in changed if username not in self.stamps]
+        if added:
+            self.usernames += added
+            self.targets = np.vstack([self.targets, np.zeros((len(added), len(self.surface_names)))])
+            self.matrix = np.pad(self.matrix, (0, len(added)))
+        index = self.index
+        for username in changed:
+            self.targets[index[username]] = self.read_targets(username)
+            self.stamps[username] = stamps[username]
+
+        self.rates = rates
+        if rates_changed:
+            self.matrix = self.wall_times(self.targets[:, None] - self.targets[None])
+        elif changed:
+            rows = [index[username] for username in changed]
+            costs = self.wall_times(self.targets[rows][:, None] - self.targets[None])
+            self.matrix[rows] = costs
+            self.matrix[:, rows] = costs.T
+        self.logger.debug(
+            f"recomputed {'all' if rates_changed else len(changed)} of {len(self.usernames)} profiles' transition costs"
+        )
+        return True
+
+    def positions(self) -> np.ndarray:
+        return np.array([self.controller.surfaces[surface_name].position for surface_name in self.surface_names])
+
+    def transition(self, from_username: str, to_username: str) -> float:
+        """Seconds to move from one profile's positions to another's."""
+        index = self.index
+        return float(self.matrix[index[from_username], index[to_username]])
+
+    def etas(self) -> Dict[str, float]:
+        """Seconds to move from the current positions to each profile's, all in one batch."""
+        costs = self.wall_times(self.targets - self.positions())
+        return dict(zip(self.usernames, costs.tolist()))
+
+    def eta(self, username: str) -> float:
+        """
+        Seconds until a profile would be ready, if it were activated now.
+
+        This includes any time the actuators must cool before the move is allowed (see `DutyCycle.delay()`).
+        """
+        travels = np.abs(self.targets[self.index[username]] - self.positions())
+        seconds = float(self.wall_times(travels))
+        if self.controller.duty:
+            seconds += self.controller.duty.delay({
+                surface_name: on_time
+                for surface_name, on_time in zip(self.surface_names, self.on_times(travels).tolist())
+                if on_time
+            })
+        return seconds
@@ -0,0 +1,244 @@
+"""
+Closed-loop position control using actuator feedback sensors.
+
+Each actuator's potentiometer is read through an ADC, and a fixed-rate control loop sets each pin
+LOW once its surface has measurably reached its target, rather than after a computed sleep.
+
+- `ADC` is the driver interface, `MCP3008` reads a real converter over SPI.
+- `SimulatedADC` models the actuators from the pin-states, for development and tests.
+- `Sensor` converts the raw reading of one surface into a position between 0 and 1.
+- `FeedbackLoop` performs moves for the `Controller` (see `Controller.move_to()`).
+"""
+import time
+import random
+import logging
+from typing import Dict
+
+
+class ADC:
+    """The interface every ADC driver implements."""
+
+    # the largest raw value `read()` can return
+    resolution = 1023
+
+    def read(self, channel: int) -> int:
+        raise NotImplementedError
+
+
+class MCP3008(ADC):
+    """An MCP3008 10-bit, 8 channel ADC on the pi's SPI bus (requires the `spidev` package)."""
+
+    resolution = 1023
+
+    def __init__(self, bus: int = 0, device: int = 0, max_speed_hz: int = 1350000) -> None:
+        import spidev
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = max_speed_hz
+
+    def read(self, channel: int) -> int:
+        # start bit, single-ended mode and the channel, the 10 bit result spans the last two bytes
+        response = self.spi.xfer2([1, (8 + channel) << 4, 0])
+        return ((response[1] & 3) << 8) + response[2]
+
+
+class SimulatedADC(ADC):
+    """
+    Simulate a potentiometer on each actuator of a `Controller`.
+
+    Each surface moves while one of its pins is HIGH, at the speed given by the operating-mode
+    `deploy` durations for the number of pins that are hot, multiplied by that surface's `bias`.
+    A bias other than 1 reproduces an actuator which is faster or slower than the configured timings,
+    which is exactly the error that dead-reckoning cannot see.
+    """
+
+    resolution = 1023
+
+    def __init__(self, controller, channels: Dict[str, int], bias: Dict[str, float] = None, noise: int = 0) -> None:
+        self.controller = controller
+        self.channels = channels
+        self.bias = bias or {}
+        self.noise = noise
+        self.positions = {surface_name: controller.surfaces[surface_name].position for surface_name in channels}
+        self.updated = time.monotonic()
+
+    def advance(self) -> None:
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        hot_pin_count = self.controller.hot_pin_count
+        if not hot_pin_count:
+            return
+        speed = 1 / self.controller.duration(1, 'deploy', pin_count=hot_pin_count)
+        for surface_name in self.positions:
+            surface = self.controller.surfaces[surface_name]
+            direction = surface.extend_pin.state - surface.retract_pin.state
+            travel = direction * speed * self.bias.get(surface_name, 1) * elapsed
+            self.positions[surface_name] = min(max(self.positions[surface_name] + travel, 0), 1)
+
+    def read(self, channel: int) -> int:
+        self.advance()
+        surface_name = next(name for name, surface_channel in self.channels.items() if surface_channel == channel)
+        raw = round(self.positions[surface_name] * self.resolution) + random.randint(-self.noise, self.noise)
+        return min(max(raw, 0), self.resolution)
+
+
+class Sensor:
+    """The feedback sensor of one surface, and the raw readings at either end of its travel."""
+
+    def __init__(self, adc: ADC, channel: int, retracted: int = 0, extended: int = None) -> None:
+        self.adc = adc
+        self.channel = channel
+        self.retracted = retracted
+        self.extended = adc.resolution if extended is None else extended
+
+    @property
+    def position(self) -> float:
+        raw = self.adc.read(self.channel)
+        position = (raw - self.retracted) / (self.extended - self.retracted)
+        return min(max(position, 0), 1)
+
+
+class FeedbackLoop:
+    """
+    Move surfaces until their sensors report the targets have been reached.
+
+    :param rate: how many times per second the sensors are read while a pin is HIGH
+    :param tolerance: a surface is on target once it is within this distance of it
+    :param timeout_factor: a pin is forced LOW, with a warning, once it has been HIGH for this
+                           multiple of its dead-reckoned duration (plus one second)
+    """
+
+    def __init__(self, controller, sensors: Dict[str, Sensor], rate: float = 100,
+                 tolerance: float = 0.01, timeout_factor: float = 1.5) -> None:
+        self.controller = controller
+        self.sensors = sensors
+        self.period = 1 / rate
+        self.tolerance = tolerance
+        self.timeout_factor = timeout_factor
+        self.logger = logging.getLogger('Surf.Feedback')
+
+    @classmethod
+    def from_settings(cls, controller, settings: dict) -> 'FeedbackLoop':
+        """Build the loop from the `feedback` section of settings.yml and the `feedback` of each control surface."""
+        channels = {
+            configured_surface['name']: configured_surface['feedback']
+            for configured_surface in controller.config
+            if configured_surface.get('feedback')
+        }
+        if settings['adc'] == 'simulated':
+            adc = SimulatedADC(controller, {name: sensor['channel'] for name, sensor in channels.items()})
+        elif settings['adc'] == 'mcp3008':
+            adc = MCP3008(settings['spi_bus'], settings['spi_device'])
+        else:
+            raise ValueError(f"unknown feedback adc: '{settings['adc']}', use 'mcp3008' or 'simulated'")
+        sensors = {
+            name: Sensor(adc, sensor['channel'], sensor.get('retracted', 0), sensor.get('extended'))
+            for name, sensor in channels.items()
+        }
+        for name, sensor in sensors.items():
+            if sensor.retracted == sensor.extended:
+                raise ValueError(
+                    f"the feedback sensor of {name} reads {sensor.extended} both retracted and extended, "
+                    f"check its `retracted` and `extended` in control_surfaces.yml"
+                )
+        return cls(
+            controller,
+            sensors=sensors,
+            rate=settings['rate'],
+            tolerance=settings['tolerance'],
+        )
+
+    def covers(self, surface_names) -> bool:
+        """Whether every one of the given surfaces has a sensor."""
+        return all(surface_name in self.sensors for surface_name in surface_names)
+
+    def sync(self) -> dict:
+        """Replace the dead-reckoned position of each surface with its measured position."""
+        for surface_name, sensor in self.sensors.items():
+            self.controller.surfaces[surface_name].position = round(sensor.position, 4)
+        return self.controller.positions
+
+    def move_to(self, new_positions: dict, action_mode: str = 'deploy') -> None:
+        """Move the given surfaces to new positions, stopping each pin when its sensor reaches the target."""
+        assert all([0 <= new_position <= 1 for new_position in new_positions.values()])
+        assert self.covers(new_positions), "every surface in a feedback move must have a sensor"
+
+        # measured holding the lock, so that a move queued behind another starts from where that one stopped
+        with self.controller.motion_lock:
+            measured = {surface_name: self.sensors[surface_name].position for surface_name in new_positions}
+            moving = {}
+            for surface_name, new_position in new_positions.items():
+                if abs(new_position - measured[surface_name]) <= self.tolerance:
+                    self.logger.info(
+                        f"{surface_name} already at {new_position} (measured {round(measured[surface_name], 4)})"
+                    )
+                    self.controller.surfaces[surface_name].position = new_position
+                    continue
+                action = 'extend' if new_position > measured[surface_name] else 'retract'
+                timeout = (
+                    self.timeout_factor
+                    * self.controller.duration(abs(new_position - measured[surface_name]), action_mode, pin_count=1)
+                    + 1
+                )
+                moving[surface_name] = (action, timeout)
+                self.logger.info(
+                    f"{action}ing {surface_name} from {round(measured[surface_name], 4)} (measured) to {new_position}"
+                )
+
+            if not moving:
+                self.logger.info("no change required, all positions already satisfied.")
+                return
+
+            # refused before any pin goes HIGH, the on-times are dead-reckoned with every moving pin hot
+            self.controller.throttle(
+                {
+                    surface_name: self.controller.duration(
+                        abs(new_positions[surface_name] - measured[surface_name]), action_mode, pin_count=len(moving)
+                    )
+                    for surface_name in moving
+                },
+                retracting=all(action == 'retract' for action, timeout in moving.values()),
+            )
+            start = time.monotonic()
+            watchdog = self.controller.watchdog
+            try:
+                for surface_name, (action, timeout) in moving.items():
+                    pin = getattr(self.controller.surfaces[surface_name], f"{action}_pin")
+                    pin.high()
+                    if watchdog:
+                        # the loop stops the pin at its timeout, the watchdog does if the loop stalls
+                        watchdog.arm(pin.number, start + timeout)
+
+                tick = 0
+                while moving:
+                    tick += 1
+                    remaining = start + tick * self.period - time.monotonic()
+                    if remaining > 0:
+                        time.sleep(remaining)
+                    elapsed = time.monotonic() - start
+                    for surface_name, (action, timeout) in list(moving.items()):
+                        position = self.sensors[surface_name].position
+                        target = new_positions[surface_name]
+                        reached = (
+                            position >= target - self.tolerance
+                            if action == 'extend' else
+                            position <= target + self.tolerance
+                        )
+                        if reached or elapsed > timeout:
+                            getattr(self.controller.surfaces[surface_name], f"{action}_pin").low()
+                            if not reached:
+                                self.logger.warning(
+                                    f"{surface_name} did not reach {target} within {round(timeout, 3)} seconds, "
+                                    f"stopped at {round(position, 4)} (measured)"
+                                )
+                            self.controller.surfaces[surface_name].position = (
+                                round(position, 4) if not reached else target
+                            )
+                            self.logger.info(
+                                f"{surface_name} reached {round(position, 4)} after {round(elapsed, 3)} seconds"
+                            )
+                            del moving[surface_name]
+            finally:
+                # an exception from a sensor must not leave a pin HIGH
+                for surface_name, (action, timeout) in moving.items():
+                    getattr(self.controller.surfaces[surface_name], f"{action}_pin").low()
@@ -0,0 +1,120 @@
+"""
+Several independent `Controller`s, driven together.
+
+Each controller of a fleet has its own control_surfaces.yml, operating mode and pin backend, for
+example two boats on a test bench or one pi driving two banks of actuators. Moves are dispatched to
+every controller at once, each on its own worker thread, and the positions are aggregated by name.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from utils import backends
+from utils.controller import Controller
+
+
+class Fleet:
+
+    def __init__(self, controllers: List[Controller] = None, max_workers: int = None) -> None:
+        self.logger = logging.getLogger('Surf.Fleet')
+        self.controllers = {}
+        self.max_workers = max_workers
+        for controller in controllers or []:
+            self.add(controller)
+
+    @classmethod
+    def from_configs(cls, configs: List[dict], **kwargs) -> 'Fleet':
+        """
+        Build a fleet from a list of `Controller` arguments, for example:
+            [{'name': 'bench-a', 'path': 'a/control_surfaces.yml', 'modes': 'a/operating_modes.yml', 'mode': 'dry'}, ...]
+        """
+        return cls([Controller(**config) for config in configs], **kwargs)
+
+    @classmethod
+    def simulated(cls, count: int, mode: str = None, **kwargs) -> 'Fleet':
+        """A fleet of `count` controllers which drive no pins, each configured from CONFIG_DIR."""
+        return cls(
+            [Controller(mode=mode, backend=backends.NullBackend(), name=f"sim-{i}") for i in range(count)],
+            **kwargs
+        )
+
+    def add(self, controller: Controller) -> None:
+        if not controller.name or controller.name in self.controllers:
+            raise ValueError(f"every controller of a fleet needs a unique name, not '{controller.name}'.")
+        self.controllers[controller.name] = controller
+        self.logger.info(f"added controller '{controller.name}': {controller.surface_names}")
+
+    def remove(self, name: str) -> Controller:
+        return self.controllers.pop(name)
+
+    def __getitem__(self, name: str) -> Controller:
+        return self.controllers[name]
+
+    def __len__(self) -> int:
+        return len(self.controllers)
+
+    @property
+    def positions(self) -> Dict[str, dict]:
+        """{controller name: {surface name: position between 0 and 1}}"""
+        return {name: controller.positions for name, controller in self.controllers.items()}
+
+    @property
+    def values(self) -> Dict[str, dict]:
+        """{controller name: {surface name: position between 0 and 100}}"""
+        return {name: controller.values for name, controller in self.controllers.items()}
+
+    @property
+    def active_profiles(self) -> Dict[str, str]:
+        return {name: controller.active_profile for name, controller in self.controllers.items()}
+
+    def dispatch(self, calls: Dict[str, Callable[[Controller], None]]) -> Dict[str, dict]:
+        """
+        Run one call per controller, all at once, and wait for every one of them.
+
+        :param calls: {controller name: a function taking that controller}
+        :return: the values of the fleet once every call is done
+        """
+        if calls:
+            with ThreadPoolExecutor(max_workers=self.max_workers or len(calls), thread_name_prefix='SurfFleet') as pool:
+                futures = {name: pool.submit(call, self.controllers[name]) for name, call in calls.items()}
+            failed = {name: future.exception() for name, future in futures.items() if future.exception()}
+            if failed:
+                raise RuntimeError(f"moves failed on {list(failed)}: {failed}")
+        return self.values
+
+    def broadcast(self, method: str, *args, **kwargs) -> Dict[str, dict]:
+        """Call the same `Controller` method on every controller at once, for example `broadcast('retract')`."""
+        return self.dispatch({
+            name: (lambda controller: getattr(controller, method)(*args, **kwargs))
+            for name in self.controllers
+        })
+
+    def move_to(self, new_positions: Dict[str, dict], action_mode: str = 'deploy', optimize: str = None) -> Dict[str, dict]:
+        """
+        Move the surfaces of several controllers at once.
+
+        :param new_positions: {controller name: {surface name: new position between 0 and 1}}
+        """
+        return self.dispatch({
+            name: (
+                lambda controller, positions=positions:
+                controller.move_to(positions, action_mode=action_mode, optimize=optimize)
+            )
+            for name, positions in new_positions.items()
+        })
+
+    def activate_profile(self, profile_name: str, optimize: str = None) -> Dict[str, dict]:
+        return self.broadcast('activate_profile', profile_name, optimize=optimize)
+
+    def deactivate_profile(self) -> Dict[str, dict]:
+        return self.broadcast('deactivate_profile')
+
+    def retract(self, blindly: bool = False) -> Dict[str, dict]:
+        return self.broadcast('retract', blindly=blindly)
+
+    def add_listener(self, callback: Callable[[str, str, str, object], None]) -> None:
+        """Call `callback(controller name, kind, name, value)` on every change of any controller of the fleet."""
+        for fleet_name, controller in self.controllers.items():
+            controller.add_listener(
+                lambda kind, name, value, fleet_name=fleet_name: callback(fleet_name, kind, name, value)
+            )
@@ -0,0 +1,339 @@
+"""
+Streaming NMEA 0183 GPS ingestion, with speed-gated deployment of a wave-profile.
+
+- `NMEAParser` is fed raw bytes and yields a `Fix` for each valid RMC or VTG sentence.
+- `SpeedFilter` keeps an exponentially smoothed speed-over-ground.
+- `SpeedGate` decides when to deploy or retract, with hysteresis and a dwell time.
+- `FixClock` times the fixes for both, across midnight UTC and for sentences without a time.
+- `SerialSource` reads from a receiver, `ReplaySource` reads a recorded file in its place.
+- `GPSMonitor` ties them together and drives a `Controller`.
+"""
+import os
+import math
+import time
+import logging
+import threading
+from collections import namedtuple
+from typing import Iterator
+
+from utils.duty import DutyCycleExceeded
+
+# a single speed-over-ground reading
+#   - time:  seconds since midnight UTC as reported by the receiver, or None if the sentence has no time
+#   - speed: speed-over-ground in knots
+Fix = namedtuple('Fix', ['time', 'speed'])
+
+BAUDRATES = {4800: 'B4800', 9600: 'B9600', 19200: 'B19200', 38400: 'B38400', 57600: 'B57600', 115200: 'B115200'}
+
+
+class NMEAParser:
+    """
+    An incremental NMEA 0183 parser.
+
+    Bytes may be fed in chunks of any size, sentences which span chunks are kept in a single reusable
+    buffer. Only RMC and VTG sentences (from any talker, GP, GN, GL...) are decoded, every other sentence
+    is skipped after a byte comparison, so a busy receiver costs very little.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.last_time = None
+        self.checksum_errors = 0
+
+    def feed(self, data: bytes) -> Iterator[Fix]:
+        """Add bytes to the buffer and yield a `Fix` for each complete, valid speed sentence."""
+        self.buffer += data
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end < 0:
+                break
+            fix = self.parse(self.buffer, start, end)
+            if fix:
+                yield fix
+            start = end + 1
+        del self.buffer[:start]
+
+    def parse(self, buffer: bytearray, start: int, end: int) -> Fix:
+        """Parse the sentence in `buffer[start:end]`, return None unless it is a valid RMC or VTG sentence."""
+        start = buffer.find(b'$', start, end)
+        if start < 0 or end - start < 7:
+            return None
+        sentence_type = bytes(buffer[start + 3:start + 6])
+        if sentence_type not in (b'RMC', b'VTG'):
+            return None
+
+        star = buffer.rfind(b'*', start, end)
+        if star < 0:
+            return None
+        checksum = 0
+        for byte in buffer[start + 1:star]:
+            checksum ^= byte
+        try:
+            if checksum != int(buffer[star + 1:star + 3], 16):
+                self.checksum_errors += 1
+                return None
+        except ValueError:
+            self.checksum_errors += 1
+            return None
+
+        fields = buffer[start + 1:star].split(b',')
+        try:
+            if sentence_type == b'RMC':
+                # $GPRMC,hhmmss.ss,A,llll.ll,a,yyyyy.yy,a,speed,course,ddmmyy,x.x,a*hh
+                if fields[2] != b'A' or not fields[7]:
+                    return None
+                if fields[1]:
+                    self.last_time = (
+                        int(fields[1][0:2]) * 3600 + int(fields[1][2:4]) * 60 + float(fields[1][4:])
+                    )
+                return Fix(self.last_time, float(fields[7]))
+            else:
+                # $GPVTG,course,T,course,M,speed,N,speed,K,mode*hh
+                if not fields[5] or (len(fields) > 9 and fields[9] == b'N'):
+                    return None
+                return Fix(None, float(fields[5]))
+        except (IndexError, ValueError):
+            return None
+
+
+class SpeedFilter:
+    """An exponentially smoothed speed, where `time_constant` is in seconds."""
+
+    def __init__(self, time_constant: float) -> None:
+        self.time_constant = time_constant
+        self.speed = None
+        self.time = None
+
+    def update(self, speed: float, now: float) -> float:
+        if self.speed is None or self.time_constant <= 0:
+            self.speed = speed
+        else:
+            elapsed = now - self.time
+            if elapsed < 0:  # a replay file which restarted
+                elapsed = 0
+            alpha = 1 - math.exp(-elapsed / self.time_constant)
+            self.speed += alpha * (speed - self.speed)
+        self.time = now
+        return self.speed
+
+
+class SpeedGate:
+    """
+    Decide when to deploy and when to retract based on the smoothed speed.
+
+    - deploy once the speed has stayed above `deploy_above` for `dwell` seconds
+    - retract once the speed has stayed below `retract_below` for `dwell` seconds
+    - `retract_below` must be lower than `deploy_above`, the gap between them is the hysteresis
+    - `now` is in seconds which never go backwards (see `FixClock`), if they do the dwell starts again
+    """
+
+    def __init__(self, deploy_above: float, retract_below: float, dwell: float) -> None:
+        assert retract_below < deploy_above, "`retract_below` must be lower than `deploy_above`"
+        self.deploy_above = deploy_above
+        self.retract_below = retract_below
+        self.dwell = dwell
+        self.deployed = False
+        self.crossed_at = None
+
+    def update(self, speed: float, now: float) -> str:
+        """Return 'deploy' or 'retract' when a threshold has been crossed for long enough, otherwise None."""
+        crossing = speed < self.retract_below if self.deployed else speed > self.deploy_above
+        if not crossing:
+            self.crossed_at = None
+            return None
+        if self.crossed_at is None or now < self.crossed_at:
+            self.crossed_at = now
+        if now - self.crossed_at < self.dwell:
+            return None
+        self.crossed_at = None
+        self.deployed = not self.deployed
+        return 'deploy' if self.deployed else 'retract'
+
+
+class FixClock:
+    """
+    The time of each fix, in seconds which keep counting past midnight UTC.
+
+    RMC times are seconds since midnight UTC, so a time more than 12 hours before the last one is taken
+    to be on the next day. A fix without a time (VTG) is timed by when it was received, from the last
+    fix, so a receiver which only sends VTG is timed entirely by this clock.
+    """
+
+    def __init__(self) -> None:
+        self.days = 0
+        self.last_time = None
+        self.now = None
+        self.received = None
+
+    def update(self, fix: Fix) -> float:
+        received = time.monotonic()
+        if fix.time is not None:
+            if self.last_time is not None and fix.time < self.last_time - 43200:
+                self.days += 1
+            self.last_time = fix.time
+            now = fix.time + self.days * 86400
+        elif self.now is not None:
+            now = self.now + received - self.received
+        else:
+            now = 0.0
+        # an RMC time may be a little behind a VTG fix timed on receipt before it
+        self.now = now if self.now is None else max(now, self.now)
+        self.received = received
+        return self.now
+
+
+class SerialSource:
+    """Read raw bytes from a serial GPS receiver, like `/dev/serial0` or `/dev/ttyUSB0`."""
+
+    def __init__(self, device: str, baudrate: int = 9600) -> None:
+        self.device = device
+        self.baudrate = baudrate
+
+    def configure(self, fd: int) -> None:
+        """Put the serial device into raw mode at the configured baudrate."""
+        try:
+            import termios
+        except ImportError:
+            return
+        attributes = termios.tcgetattr(fd)
+        speed = getattr(termios, BAUDRATES[self.baudrate])
+        attributes[0] = termios.IGNPAR  # iflag
+        attributes[1] = 0  # oflag
+        attributes[2] = termios.CS8 | termios.CREAD | termios.CLOCAL  # cflag
+        attributes[3] = 0  # lflag, no canonical processing or echo
+        attributes[4] = attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+
+    def __iter__(self) -> Iterator[bytes]:
+        fd = os.open(self.device, os.O_RDONLY | getattr(os, 'O_NOCTTY', 0))
+        try:
+            self.configure(fd)
+            while True:
+                data = os.read(fd, 256)
+                if not data:
+                    time.sleep(0.05)
+                    continue
+                yield data
+        finally:
+            os.close(fd)
+
+
+class ReplaySource:
+    """
+    Read a recorded NMEA file in place of a receiver.
+
+    :param path: a file with one NMEA sentence per line
+    :param speed: 1 replays in real time using the times in the RMC sentences,
+                  2 replays twice as fast, 0 replays as fast as possible.
+
+    A replay is timed by its RMC sentences, a file of only VTG sentences (which have no time) is
+    refused with a ValueError, as its fixes would all be timed by when they were read.
+    """
+
+    def __init__(self, path: str, speed: float = 1) -> None:
+        self.path = path
+        self.speed = speed
+        self.check()
+
+    def check(self) -> None:
+        parser, untimed = NMEAParser(), False
+        with open(self.path, 'rb') as replay:
+            for line in replay:
+                for fix in parser.feed(line):
+                    if fix.time is not None:
+                        return
+                    untimed = True
+        if untimed:
+            raise ValueError(
+                f"'{self.path}' has VTG but no RMC sentences, a replay is timed by the times of its RMC sentences."
+            )
+
+    def __iter__(self) -> Iterator[bytes]:
+        timer = NMEAParser()
+        previous = None
+        with open(self.path, 'rb') as replay:
+            for line in replay:
+                if self.speed:
+                    for fix in timer.feed(line):
+                        if fix.time is not None:
+                            if previous is not None and fix.time > previous:
+                                time.sleep((fix.time - previous) / self.speed)
+                            previous = fix.time
+                yield line
+
+
+class GPSMonitor:
+    """Drive a `Controller` from a GPS source, see the `gps` section of settings.yml."""
+
+    def __init__(self, controller, source, profile: str, deploy_above: float, retract_below: float,
+                 dwell: float = 2.0, smoothing: float = 1.5) -> None:
+        self.controller = controller
+        self.source = source
+        self.profile = profile
+        self.parser = NMEAParser()
+        self.filter = SpeedFilter(smoothing)
+        self.gate = SpeedGate(deploy_above, retract_below, dwell)
+        self.clock = FixClock()
+        self.logger = logging.getLogger('Surf.GPS')
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_settings(cls, controller, settings: dict, source=None) -> 'GPSMonitor':
+        if source is None:
+            source = (
+                ReplaySource(settings['device'])
+                if os.path.isfile(settings['device']) else
+                SerialSource(settings['device'], settings['baudrate'])
+            )
+        return cls(
+            controller,
+            source,
+            profile=settings['profile'],
+            deploy_above=settings['deploy_above'],
+            retract_below=settings['retract_below'],
+            dwell=settings['dwell'],
+            smoothing=settings['smoothing'],
+        )
+
+    @property
+    def speed(self) -> float:
+        """The smoothed speed-over-ground in knots, None before the first fix."""
+        return self.filter.speed
+
+    def run(self) -> None:
+        """Read the source until it is exhausted or `stop()` is called (blocks)."""
+        self.logger.info(
+            f"GPS: deploying '{self.profile}' above {self.gate.deploy_above} knots, "
+            f"retracting below {self.gate.retract_below} knots"
+        )
+        for data in self.source:
+            for fix in self.parser.feed(data):
+                self.update(fix)
+            if self.stopped.is_set():
+                break
+        self.logger.info("GPS: source finished.")
+
+    def update(self, fix: Fix) -> None:
+        now = self.clock.update(fix)
+        speed = self.filter.update(fix.speed, now)
+        action = self.gate.update(speed, now)
+        if action == 'deploy' and not self.controller.active_profile:
+            self.logger.info(f"GPS: {round(speed, 2)} knots, deploying '{self.profile}'")
+            try:
+                self.controller.activate_profile(self.profile)
+            except DutyCycleExceeded as e:
+                # deploy again once the speed has stayed up for another dwell
+                self.logger.warning(f"GPS: not deploying, {e}")
+                self.gate.deployed = False
+        elif action == 'retract' and self.controller.active_profile:
+            self.logger.info(f"GPS: {round(speed, 2)} knots, retracting")
+            self.controller.deactivate_profile()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='SurfGPS', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopped.set()
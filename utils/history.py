@@ -0,0 +1,164 @@
+"""
+An append-only history of the changes to each wave-profile, and undo.
+
+Every change to a profile's values (a Save from the ActiveBar, the edit dialog, the CLI or an
+import) appends one JSON line to `HISTORY_DIR/<username>.log`. The line holds only the surfaces
+which changed, each as `[old value, new value]`, with the time and the source of the change:
+
+    {"at": "2021-06-01 18:30:02", "source": "dialog", "changes": {"PORT": [30, 35]}, "prev": 112}
+
+`prev` is the byte offset of the change before it, so the changes which can still be undone form
+a chain back from the end of the file. An undo reads the last line, follows one offset to the
+change to undo, writes that change's old values back to the profile and appends an `undo` line
+whose `prev` skips over the undone change. Undo therefore reads two lines however long the history
+grows.
+
+Once the log grows past `COMPACT_BYTES` it is rewritten as just the chain of changes which can
+still be undone, at most `KEEP` of them, so the history stays small on the SD card.
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import yaml
+
+import utils
+from utils import utilities as u
+
+COMPACT_BYTES = 16 * 1024
+KEEP = 50
+
+# one writer at a time, changes are recorded from the UI and the API threads
+lock = threading.Lock()
+logger = logging.getLogger('Surf.History')
+
+
+class ProfileHistory:
+
+    def __init__(self, username: str, directory: str = None) -> None:
+        self.username = username
+        self.directory = directory or utils.HISTORY_DIR
+        self.path = os.path.join(self.directory, f"{username}.log")
+
+    def last(self) -> Optional[tuple]:
+        """The (offset, entry) of the last line, read from the end of the file, or None."""
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as log:
+            end = log.seek(0, os.SEEK_END)
+            if not end:
+                return None
+            block = min(end, 4096)
+            while True:
+                log.seek(end - block)
+                tail = log.read(block)
+                start = tail.rfind(b'\n', 0, len(tail) - 1)
+                if start >= 0 or block == end:
+                    break
+                block = min(end, block * 2)
+            offset = end - block + start + 1
+            return offset, json.loads(tail[start + 1:])
+
+    def at(self, offset: int) -> dict:
+        with open(self.path, 'rb') as log:
+            log.seek(offset)
+            return json.loads(log.readline())
+
+    def top(self) -> Optional[int]:
+        """The offset of the change an undo would revert, or None if there is none."""
+        last = self.last()
+        if last is None:
+            return None
+        offset, entry = last
+        return entry['prev'] if entry['source'] == 'undo' else offset
+
+    def append(self, entry: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, 'a') as log:
+            log.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            size = log.tell()
+        if size > COMPACT_BYTES:
+            self.compact()
+
+    def record(self, old_values: Dict[str, int], new_values: Dict[str, int], source: str) -> bool:
+        """
+        Append a change, if the values changed.
+
+        :param source: what made the change, like 'save', 'dialog', 'cli' or 'import'
+        """
+        changes = {
+            surface_name: [old_values.get(surface_name), value]
+            for surface_name, value in new_values.items()
+            if old_values.get(surface_name) != value
+        }
+        if not changes:
+            return False
+        with lock:
+            self.append({
+                'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'source': source,
+                'changes': changes,
+                'prev': self.top(),
+            })
+        return True
+
+    def undo(self) -> Optional[Dict[str, int]]:
+        """Write the values from before the last change back to the profile, returning them, or None."""
+        with lock:
+            offset = self.top()
+            if offset is None:
+                return None
+            entry = self.at(offset)
+            profile = u.Profile.read_config(username=self.username)
+            restored = {surface_name: old for surface_name, (old, new) in entry['changes'].items() if old is not None}
+            profile['control_surfaces'].update(restored)
+            u.atomic_write(u.Profile.get_path(username=self.username), yaml.dump(
+                profile, default_flow_style=False, sort_keys=False
+            ))
+            self.append({
+                'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'source': 'undo',
+                'changes': {surface_name: [new, old] for surface_name, (old, new) in entry['changes'].items()},
+                'prev': entry['prev'],
+                'undoes': entry['at'],
+            })
+        logger.info(f"'{self.username}': undid the {entry['source']} change of {entry['at']}, restoring {restored}")
+        return restored
+
+    def entries(self, limit: int = None) -> List[dict]:
+        """The changes which can still be undone, newest first."""
+        entries, offset = [], self.top()
+        while offset is not None and (limit is None or len(entries) < limit):
+            entry = self.at(offset)
+            entries.append(entry)
+            offset = entry['prev']
+        return entries
+
+    def compact(self, keep: int = None) -> None:
+        """Rewrite the log as only the changes which can still be undone, at most `keep` (or `KEEP`) of them."""
+        lines, offset = [], 0
+        for entry in reversed(self.entries(limit=keep or KEEP)):
+            entry = dict(entry, prev=offset - len(lines[-1]) if lines else None)
+            lines.append((json.dumps(entry, separators=(',', ':')) + '\n').encode())
+            offset += len(lines[-1])
+        if lines:
+            u.atomic_write(self.path, b''.join(lines).decode())
+        else:
+            # every change has been undone, there is no history left to keep
+            self.delete()
+        logger.debug(f"compacted the history of '{self.username}' to {len(lines)} changes")
+
+    def delete(self) -> None:
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def record(username: str, old_values: Dict[str, int], new_values: Dict[str, int], source: str) -> None:
+    """Record a change to a profile's values, never failing the change itself."""
+    try:
+        ProfileHistory(username).record(old_values, new_values, source)
+    except Exception:
+        logger.exception(f"could not record the history of '{username}'")
@@ -0,0 +1,168 @@
+"""
+Opportunistic re-homing of dead-reckoned positions.
+
+Every dead-reckoned move leaves a surface's real position a little off from `Surface.position`, so
+an uncertainty bound is kept per surface: each move adds `pulse_error` plus `travel_error` of the
+distance travelled. A retract which is held long enough to reach the end of travel even at the
+slowest `withdraw` rate (like a full blind withdraw) homes the surface and clears its uncertainty.
+
+`HomingScheduler` clears the uncertainty before it grows past `threshold`, in the background:
+once nothing has moved for `idle` seconds, each uncertain surface that is at 0 is retracted for
+its uncertainty plus `margin`, which is a fraction of a second. While the boat is below
+`planing_speed` (with GPS enabled), deployed surfaces are also retracted past their uncertainty
+and moved back out to where they were.
+"""
+import time
+import logging
+import threading
+from typing import Callable, List
+
+
+class HomingScheduler:
+
+    def __init__(self, controller, threshold: float = 0.03, pulse_error: float = 0.003, travel_error: float = 0.02,
+                 margin: float = 0.02, idle: float = 5, planing_speed: float = None,
+                 speed: Callable[[], float] = None, interval: float = 1) -> None:
+        """
+        :param speed: returns the boat's speed in knots (see `GPSMonitor.speed`), or None without GPS
+        """
+        self.controller = controller
+        self.threshold = threshold
+        self.pulse_error = pulse_error
+        self.travel_error = travel_error
+        self.margin = margin
+        self.idle = idle
+        self.planing_speed = planing_speed
+        self.speed = speed
+        self.interval = interval
+        self.logger = logging.getLogger('Surf.Homing')
+        self.stopped = threading.Event()
+        # surface name -> fraction of full travel the real position may be from `Surface.position`
+        self.uncertainty = {surface_name: 0 for surface_name in controller.surfaces}
+        # surface name -> the last position it was moved to, the listener is only given the new position
+        self.previous = dict(controller.positions)
+        self.last_motion = time.monotonic()
+        # surface name -> (time.monotonic() its retract pin went HIGH, the travel which would home it)
+        self.retracting = {}
+        self.homed = set()
+        self.homing = False
+        controller.add_listener(self.update)
+
+    @classmethod
+    def from_settings(cls, controller, settings: dict, speed: Callable[[], float] = None) -> 'HomingScheduler':
+        """:param settings: the `homing` section of settings.yml"""
+        return cls(
+            controller,
+            threshold=settings['threshold'],
+            pulse_error=settings['pulse_error'],
+            travel_error=settings['travel_error'],
+            margin=settings['margin'],
+            idle=settings['idle'],
+            planing_speed=settings['planing_speed'],
+            speed=speed,
+        )
+
+    def update(self, kind: str, name: str, value) -> None:
+        """Grow, or clear, the uncertainty of each surface as it moves (see `Controller.add_listener()`)."""
+        if kind == 'pin':
+            self.last_motion = time.monotonic()
+            surface_name, action = name.split('.')
+            if action != 'retract' or self.homing:
+                return
+            surface = self.controller.surfaces[surface_name]
+            if value:
+                self.retracting[surface_name] = (time.monotonic(), surface.position + self.uncertainty[surface_name])
+            elif surface_name in self.retracting:
+                started, needed = self.retracting.pop(surface_name)
+                slowest = self.controller.duration(1, 'withdraw', pin_count=len(self.controller.surfaces))
+                if (time.monotonic() - started) / slowest >= needed:
+                    self.homed.add(surface_name)
+                    self.uncertainty[surface_name] = 0
+        elif kind == 'position':
+            previous, self.previous[name] = self.previous.get(name, value), value
+            if self.homing:
+                return
+            if name in self.homed:
+                self.homed.discard(name)
+                return
+            self.uncertainty[name] = min(
+                self.uncertainty[name] + self.pulse_error + self.travel_error * abs(value - previous), 1
+            )
+
+    @property
+    def slow(self) -> bool:
+        """Whether the boat is below planing speed, False without GPS."""
+        speed = self.speed() if self.speed else None
+        return speed is not None and self.planing_speed is not None and speed < self.planing_speed
+
+    def due(self) -> List[str]:
+        """The surfaces which should be re-homed now."""
+        if time.monotonic() - self.last_motion < self.idle:
+            return []
+        slow = self.slow
+        return [
+            surface_name
+            for surface_name, surface in self.controller.surfaces.items()
+            if self.uncertainty[surface_name] >= self.threshold and (surface.position == 0 or slow)
+        ]
+
+    def home(self, surface_names: List[str]) -> bool:
+        """
+        Retract surfaces past their uncertainty, then move any deployed ones back out.
+
+        Returns False, without moving anything, if another move is in progress.
+        """
+        if not self.controller.motion_lock.acquire(blocking=False):
+            return False
+        try:
+            restore = {
+                surface_name: self.controller.surfaces[surface_name].position
+                for surface_name in surface_names
+                if self.controller.surfaces[surface_name].position > 0
+            }
+            change_manifest = {
+                surface_name: {
+                    # not capped at full travel, a surface further out than it is reckoned must still reach its end stop
+                    'travel': (
+                        self.controller.surfaces[surface_name].position
+                        + self.uncertainty[surface_name] + self.margin
+                    ),
+                    'action': 'retract',
+                }
+                for surface_name in surface_names
+            }
+            self.logger.info(
+                f"re-homing {', '.join(f'{name} (+/-{round(self.uncertainty[name], 3)})' for name in surface_names)}"
+            )
+            self.homing = True
+            try:
+                self.controller.execute(self.controller.plan_manifest(
+                    change_manifest, {surface_name: 0 for surface_name in surface_names}, action_mode='withdraw'
+                ))
+            finally:
+                self.homing = False
+            for surface_name in surface_names:
+                self.uncertainty[surface_name] = 0
+            if restore:
+                self.controller.execute(self.controller.plan_move(restore))
+        finally:
+            self.controller.motion_lock.release()
+        return True
+
+    def run(self) -> None:
+        self.logger.info(f"re-homing surfaces once they may be off by {self.threshold} of full travel")
+        while not self.stopped.wait(self.interval):
+            due = self.due()
+            if due:
+                try:
+                    self.home(due)
+                except Exception:
+                    self.logger.exception(f"re-homing {due} failed")
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='SurfHoming', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopped.set()
@@ -0,0 +1,228 @@
+"""
+Timing of the UI: how long each callback takes, and how long each frame takes.
+
+With `instrumentation.enabled` in settings.yml, `install()` wraps every method of the classes in
+interface/baseclass (like `SurfListItem.event_handler`, `ActiveBar.refresh` and
+`NavigationBar._update`) and every callback given to the kivy `Clock`, so that each call is timed.
+A callback scheduled every frame measures the frame times, a frame which takes more than 1.5 of the
+`maxfps` interval is counted as dropped.
+
+Durations are kept in `Histogram`s with power-of-two millisecond buckets, so recording a call costs
+the same however long the application runs. An optional overlay shows the frame rate, dropped
+frames and the slowest callbacks on screen, and a summary is logged when the application exits.
+
+Wrapped bound methods are held strongly by the `Clock` rather than weakly, which only matters for
+widgets that are discarded while a callback of theirs is still scheduled.
+"""
+import os
+import math
+import time
+import atexit
+import inspect
+import logging
+import functools
+import importlib
+import threading
+from typing import Callable, Dict, List
+
+import utils
+
+# bucket i counts durations up to 2**(i - 3) milliseconds, from 0.125 ms to about 4 seconds, the last bucket is unbounded
+BUCKETS = 16
+
+
+class Histogram:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        bucket = math.ceil(math.log2(milliseconds)) + 3 if milliseconds > 0.125 else 0
+        self.buckets[min(bucket, BUCKETS - 1)] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """The upper bound in milliseconds of the bucket holding the given fraction of the durations."""
+        wanted, seen = fraction * self.count, 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min(2.0 ** (i - 3), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Recorder:
+
+    def __init__(self, maxfps: float = 60) -> None:
+        self.callbacks: Dict[str, Histogram] = {}
+        self.frames = Histogram()
+        self.frame_interval = 1 / maxfps if maxfps else 1 / 60
+        self.dropped = 0
+        self.started = time.monotonic()
+        self.logger = logging.getLogger('Surf.UI.Timing')
+        # callbacks are wrapped on the kivy thread, but the `Clock` may be scheduled from any thread
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        histogram = self.callbacks.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.callbacks.setdefault(name, Histogram())
+        histogram.add(seconds)
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        """A function which calls `function` and records how long it took under `name`."""
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        timed.__timed__ = function
+        return timed
+
+    def frame(self, dt: float) -> None:
+        self.frames.add(dt)
+        if dt > 1.5 * self.frame_interval:
+            self.dropped += 1
+
+    def slowest(self, count: int = None) -> List[tuple]:
+        """(name, histogram) of the callbacks, the most total time first."""
+        with self.lock:
+            ranked = sorted(self.callbacks.items(), key=lambda item: item[1].total, reverse=True)
+        return ranked[:count] if count else ranked
+
+    def summary(self) -> List[str]:
+        elapsed = time.monotonic() - self.started
+        lines = [
+            f"{self.frames.count} frames in {round(elapsed, 1)} s ({round(self.frames.count / elapsed, 1) if elapsed else 0} fps), "
+            f"{self.dropped} dropped, frame time p50 {self.frames.percentile(0.5):.1f} ms, "
+            f"p95 {self.frames.percentile(0.95):.1f} ms, max {self.frames.max:.1f} ms",
+            f"{'callback':<50} {'calls':>7} {'total ms':>10} {'mean':>8} {'p95':>8} {'max':>8}",
+        ]
+        for name, histogram in self.slowest():
+            lines.append(
+                f"{name[:50]:<50} {histogram.count:>7} {histogram.total:>10.1f} {histogram.mean:>8.2f} "
+                f"{histogram.percentile(0.95):>8.2f} {histogram.max:>8.2f}"
+            )
+        return lines
+
+    def log_summary(self) -> None:
+        self.logger.info("UI timing summary:")
+        for line in self.summary():
+            self.logger.info(f"  {line}")
+
+
+def callback_name(callback: Callable) -> str:
+    function = getattr(callback, '__func__', callback)
+    return f"{getattr(function, '__module__', '?').rsplit('.', 1)[-1]}.{getattr(function, '__qualname__', repr(function))}"
+
+
+def wrap_classes(recorder: Recorder) -> int:
+    """Time every method defined by the classes in interface/baseclass, returning how many were wrapped."""
+    wrapped = 0
+    for file_name in sorted(os.listdir(utils.UI_PY_DIR)):
+        if not file_name.endswith('.py') or file_name.startswith('__'):
+            continue
+        module = importlib.import_module(f"interface.baseclass.{file_name[:-3]}")
+        for cls in vars(module).values():
+            if not inspect.isclass(cls) or cls.__module__ != module.__name__:
+                continue
+            for name, value in list(vars(cls).items()):
+                if inspect.isfunction(value) and not name.startswith('__') and not hasattr(value, '__timed__'):
+                    setattr(cls, name, recorder.wrap(f"{cls.__name__}.{name}", value))
+                    wrapped += 1
+    return wrapped
+
+
+def wrap_clock(recorder: Recorder) -> None:
+    """Time every callback scheduled on the kivy `Clock`."""
+    from kivy.clock import Clock
+
+    # interval callbacks -> their wrapper, so that `Clock.unschedule(callback)` still finds them
+    intervals = {}
+
+    def timed(callback):
+        if hasattr(callback, '__timed__'):
+            return callback
+        return recorder.wrap(f"Clock: {callback_name(callback)}", callback)
+
+    def schedule_interval(callback, timeout):
+        wrapper = intervals[callback] = timed(callback)
+        return clock_schedule_interval(wrapper, timeout)
+
+    def unschedule(callback, all=True):
+        return clock_unschedule(intervals.pop(callback, callback), all)
+
+    clock_schedule_once, clock_schedule_interval, clock_unschedule = (
+        Clock.schedule_once, Clock.schedule_interval, Clock.unschedule
+    )
+    Clock.schedule_once = lambda callback, timeout=0: clock_schedule_once(timed(callback), timeout)
+    Clock.schedule_interval = schedule_interval
+    Clock.unschedule = unschedule
+
+
+def show_overlay(recorder: Recorder, interval: float = 0.5) -> None:
+    """Draw the frame rate, dropped frames and the three slowest callbacks in the corner of the window."""
+    from kivy.clock import Clock
+    from kivy.core.window import Window
+    from kivy.uix.label import Label
+
+    label = Label(
+        size_hint=(None, None), halign='left', valign='top', font_size='12sp', color=(1, 1, 0, 1),
+    )
+    label.bind(texture_size=lambda widget, size: setattr(widget, 'size', size))
+    Window.add_widget(label)
+    last = {'frames': 0, 'at': time.monotonic()}
+
+    def update(dt):
+        now = time.monotonic()
+        fps = (recorder.frames.count - last['frames']) / (now - last['at'])
+        last.update(frames=recorder.frames.count, at=now)
+        lines = [f"{fps:.0f} fps  {recorder.dropped} dropped  p95 {recorder.frames.percentile(0.95):.1f} ms"]
+        lines += [
+            f"{name[:40]}  {histogram.max:.1f} ms max"
+            for name, histogram in recorder.slowest(3)
+            if not name.startswith('Clock: instrumentation')
+        ]
+        label.text = '\n'.join(lines)
+        label.pos = (4, Window.height - label.height - 4)
+        # on top of any widget added since
+        if Window.children[0] is not label:
+            Window.remove_widget(label)
+            Window.add_widget(label)
+
+    Clock.schedule_interval(update, interval)
+
+
+def install(settings: dict) -> Recorder:
+    """
+    Start timing the UI, before the app is built.
+
+    :param settings: the `instrumentation` section of settings.yml
+    """
+    from kivy.clock import Clock
+    from kivy.config import Config
+
+    recorder = Recorder(maxfps=Config.getint('graphics', 'maxfps'))
+    # every frame, scheduled before `wrap_clock()` so that it is not timed as a callback itself
+    Clock.schedule_interval(recorder.frame, 0)
+    wrapped = wrap_classes(recorder)
+    wrap_clock(recorder)
+    if settings['overlay']:
+        Clock.schedule_once(lambda dt: show_overlay(recorder))
+    atexit.register(recorder.log_summary)
+    recorder.logger.info(f"timing {wrapped} UI methods, every Clock callback and every frame")
+    return recorder
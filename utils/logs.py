@@ -0,0 +1,212 @@
+"""
+An incremental index of the session logs in LOGS_DIR, and time-bounded queries over them.
+
+Each session logs to `<start time>.log`, which the `RotatingFileHandler` renames to `.log.1`,
+`.log.2`, ... as it fills. Files are indexed by inode, so a rotated file keeps its index under its
+new name, and only the bytes appended since the last update are ever parsed. For each file the
+index keeps:
+
+- the time range of its lines,
+- the number of lines at each level,
+- the byte offset and time of every profile activation, every move and withdraw (with its
+  duration), and every WARNING, ERROR and CRITICAL line,
+- a checkpoint `(time, offset)` every `CHECKPOINT_BYTES`, so a time-bounded search seeks straight
+  to the byte range it needs rather than reading the file from the start.
+"""
+import os
+import re
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+import utils
+from utils import utilities as u
+
+# the lines of `utils.create_logger()`'s format, messages which span several lines (like tracebacks)
+# belong to the line before them
+LINE = re.compile(
+    rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) +(\S+) +\S+ +\S+ +\d+ +(DEBUG|INFO|WARNING|ERROR|CRITICAL): (.*)$'
+)
+ACTIVATION = re.compile(rb"^Activating profile: '(.+)'")
+MOVE = re.compile(rb'^(Move|Withdraw) finished in ([\d.]+) seconds')
+FLAGGED_LEVELS = (b'WARNING', b'ERROR', b'CRITICAL')
+
+CHECKPOINT_BYTES = 64 * 1024
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S,%f'
+
+
+def parse_time(text: str) -> str:
+    """
+    Convert a query time into the format of the log timestamps, which sort as strings.
+
+    :param text: 'YYYY-mm-dd', 'YYYY-mm-dd HH:MM' or 'YYYY-mm-dd HH:MM:SS', or an age like '30m', '6h' or '7d'
+    """
+    match = re.fullmatch(r'(\d+)([mhd])', text.strip())
+    if match:
+        unit = {'m': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        moment = datetime.now() - timedelta(**{unit: int(match.group(1))})
+    else:
+        for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+            try:
+                moment = datetime.strptime(text.strip(), time_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"'{text}' is not a time like '2021-06-01 18:30' or an age like '7d'.")
+    return moment.strftime(TIME_FORMAT)[:23]
+
+
+class LogIndex:
+
+    def __init__(self, logs_dir: str = None, path: str = None) -> None:
+        self.logs_dir = logs_dir or utils.LOGS_DIR
+        self.path = path or os.path.join(utils.HOME_DIR, 'log_index.json')
+        self.logger = logging.getLogger('Surf.Logs')
+        self.files = {}
+        if os.path.isfile(self.path):
+            try:
+                self.files = json.load(open(self.path, 'r'))['files']
+            except (ValueError, KeyError):
+                self.logger.warning(f"'{self.path}' is unreadable, rebuilding the log index.")
+
+    def update(self) -> 'LogIndex':
+        """Index every byte appended to the logs since the last update, and forget deleted logs."""
+        files = {}
+        for file_name in sorted(os.listdir(self.logs_dir)):
+            if '.log' not in file_name:
+                continue
+            path = os.path.join(self.logs_dir, file_name)
+            stat = os.stat(path)
+            key = f"{stat.st_dev}:{stat.st_ino}"
+            entry = self.files.get(key)
+            if entry is None or entry['indexed'] > stat.st_size or not self.same_file(entry, path):
+                entry = {
+                    'indexed': 0, 'head': '', 'first': None, 'last': None,
+                    'levels': {}, 'events': [], 'checkpoints': [],
+                }
+            entry['path'] = path
+            if stat.st_size > entry['indexed']:
+                self.scan(entry)
+            files[key] = entry
+        self.files = files
+        u.atomic_write(self.path, json.dumps({'files': self.files}, separators=(',', ':')))
+        return self
+
+    @staticmethod
+    def same_file(entry: dict, path: str) -> bool:
+        """Whether an inode still holds the indexed file, rather than a new file which reused it."""
+        with open(path, 'rb') as log:
+            return log.read(len(entry['head'])).decode(errors='replace') == entry['head']
+
+    def scan(self, entry: dict) -> None:
+        """Index the complete lines appended to one file since it was last indexed."""
+        with open(entry['path'], 'rb') as log:
+            if not entry['head']:
+                entry['head'] = log.read(64).decode(errors='replace')
+            log.seek(entry['indexed'])
+            offset = entry['indexed']
+            last_checkpoint = entry['checkpoints'][-1][1] if entry['checkpoints'] else -CHECKPOINT_BYTES
+            for line in log:
+                if not line.endswith(b'\n'):
+                    # a line which is still being written is indexed by the next update
+                    break
+                match = LINE.match(line.rstrip(b'\r\n'))
+                if match:
+                    moment, name, level, message = match.groups()
+                    moment = moment.decode()
+                    entry['first'] = entry['first'] or moment
+                    entry['last'] = moment
+                    entry['levels'][level.decode()] = entry['levels'].get(level.decode(), 0) + 1
+                    if offset - last_checkpoint >= CHECKPOINT_BYTES:
+                        entry['checkpoints'].append([moment, offset])
+                        last_checkpoint = offset
+                    event = self.classify(level, message)
+                    if event:
+                        entry['events'].append([moment, offset] + event)
+                offset += len(line)
+            entry['indexed'] = offset
+
+    @staticmethod
+    def classify(level: bytes, message: bytes) -> Optional[list]:
+        """The `[kind, detail]` of a line worth indexing, or None."""
+        activation = ACTIVATION.match(message)
+        if activation:
+            return ['activation', activation.group(1).decode(errors='replace')]
+        move = MOVE.match(message)
+        if move:
+            return [move.group(1).decode().lower(), float(move.group(2))]
+        if level in FLAGGED_LEVELS:
+            return [level.decode().lower(), message[:200].decode(errors='replace')]
+        return None
+
+    def entries(self, since: str = None, until: str = None) -> List[dict]:
+        """The indexed files with lines between `since` and `until`, oldest first."""
+        return sorted(
+            (
+                entry for entry in self.files.values()
+                if entry['first']
+                and (since is None or entry['last'] >= since)
+                and (until is None or entry['first'] <= until)
+            ),
+            key=lambda entry: entry['first']
+        )
+
+    def events(self, kinds: List[str] = None, since: str = None, until: str = None,
+               detail: str = None) -> Iterator[dict]:
+        """
+        Yield the indexed events, oldest first, answered from the index alone.
+
+        :param kinds: any of 'activation', 'move', 'withdraw', 'warning', 'error' and 'critical', by default all
+        :param detail: only events whose detail (the profile, or the message) contains this text
+        """
+        for entry in self.entries(since, until):
+            for moment, offset, kind, value in entry['events']:
+                if (
+                    (kinds is None or kind in kinds)
+                    and (since is None or moment >= since)
+                    and (until is None or moment <= until)
+                    and (detail is None or detail in str(value))
+                ):
+                    yield {'time': moment, 'kind': kind, 'detail': value, 'path': entry['path'], 'offset': offset}
+
+    def line_at(self, path: str, offset: int) -> str:
+        """Read the single log line at an offset."""
+        with open(path, 'rb') as log:
+            log.seek(offset)
+            return log.readline().decode(errors='replace').rstrip('\n')
+
+    def search(self, text: str = None, level: str = None, since: str = None, until: str = None) -> Iterator[str]:
+        """
+        Yield the log lines between `since` and `until` containing `text` and at or above `level`.
+
+        Each file is read from the last checkpoint before `since` and only until a line after `until`.
+        """
+        levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+        wanted = set(levels[levels.index(level):]) if level else set(levels)
+        needle = text.encode() if text else None
+        for entry in self.entries(since, until):
+            start = 0
+            for moment, offset in entry['checkpoints']:
+                if since is not None and moment <= since:
+                    start = offset
+            with open(entry['path'], 'rb') as log:
+                log.seek(start)
+                position = start
+                for line in log:
+                    if position >= entry['indexed']:
+                        break
+                    position += len(line)
+                    match = LINE.match(line.rstrip(b'\r\n'))
+                    if not match:
+                        continue
+                    moment = match.group(1).decode()
+                    if until is not None and moment > until:
+                        break
+                    if (
+                        (since is None or moment >= since)
+                        and match.group(3).decode() in wanted
+                        and (needle is None or needle in line)
+                    ):
+                        yield line.decode(errors='replace').rstrip('\n')
@@ -0,0 +1,134 @@
+"""
+The controller's configuration, validated and compiled into the compact model its hot paths use.
+
+operating_modes.yml and control_surfaces.yml are nested dicts keyed by strings, which the motion
+path would otherwise look up on every edge. `RuntimeModel.compile()` checks them once, when the
+controller is created or a config is reloaded (see `utils.reload`), and turns them into:
+
+- a `SurfaceSpec` per surface, indexed by its position in control_surfaces.yml,
+- a dense `durations[pin count][action]` table of the current mode's full-travel seconds, with
+  `ACTION['deploy']` and `ACTION['withdraw']` as the action index,
+- the pin numbers and goofy surfaces as tuples of those indices.
+
+The model is immutable, a reload compiles a new one and the controller swaps it in between moves.
+The surfaces' positions are not part of it, they are an `array` on the controller (see
+`Controller.position_vector`) indexed in the same order.
+"""
+from typing import List, Tuple
+
+ACTIONS = ('deploy', 'withdraw')
+ACTION = {action: i for i, action in enumerate(ACTIONS)}
+PIN_ACTIONS = ('extend', 'retract')
+PIN_ACTION = {action: i for i, action in enumerate(PIN_ACTIONS)}
+
+
+def positive(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def validate_durations(travel_durations, mode: str, surface_names: List[str]) -> dict:
+    """Check one operating mode's section of operating_modes.yml, raising ValueError with what is wrong."""
+    if not isinstance(travel_durations, dict):
+        raise ValueError(f"there is no '{mode}' operating mode.")
+    for pin_count in range(1, len(surface_names) + 1):
+        for action in ACTIONS:
+            value = (travel_durations.get(pin_count) or {}).get(action)
+            if not positive(value):
+                raise ValueError(f"{mode}.{pin_count}.{action} must be a number of seconds, not {value!r}.")
+    for surface_name in surface_names:
+        for action in PIN_ACTIONS:
+            value = ((travel_durations.get('incremental') or {}).get(surface_name) or {}).get(action)
+            if not positive(value):
+                raise ValueError(
+                    f"{mode}.incremental.{surface_name}.{action} must be a number of seconds, not {value!r}."
+                )
+    return travel_durations
+
+
+def validate_surfaces(config) -> list:
+    """Check the contents of control_surfaces.yml, raising ValueError with what is wrong."""
+    if not isinstance(config, list) or not config or not all(isinstance(surface, dict) for surface in config):
+        raise ValueError("control_surfaces.yml must be a list of surfaces.")
+    names = [surface.get('name') for surface in config]
+    if len(set(names)) != len(names) or not all(isinstance(name, str) and name for name in names):
+        raise ValueError(f"each surface needs a name of its own, not {names}.")
+    pins = []
+    for surface in config:
+        if surface.get('goofy') not in names:
+            raise ValueError(f"{surface['name']}.goofy must be the name of a surface, not {surface.get('goofy')!r}.")
+        for action in PIN_ACTIONS:
+            number = (surface.get('pins') or {}).get(action)
+            if not isinstance(number, int) or isinstance(number, bool) or number < 0:
+                raise ValueError(f"{surface['name']}.pins.{action} must be a pin number, not {number!r}.")
+            pins.append(number)
+    if len(set(pins)) != len(pins):
+        raise ValueError(f"each pin may only be used once, not {pins}.")
+    return config
+
+
+class SurfaceSpec:
+    __slots__ = ('index', 'name', 'goofy', 'extend_pin', 'retract_pin', 'increment_extend', 'increment_retract')
+
+    def __init__(self, index: int, name: str, goofy: int, extend_pin: int, retract_pin: int,
+                 increment_extend: float, increment_retract: float) -> None:
+        """:param goofy: the index of the surface this one swaps with when inverted"""
+        self.index = index
+        self.name = name
+        self.goofy = goofy
+        self.extend_pin = extend_pin
+        self.retract_pin = retract_pin
+        self.increment_extend = increment_extend
+        self.increment_retract = increment_retract
+
+    def __repr__(self) -> str:
+        return f"SurfaceSpec({self.index}, '{self.name}', pins=({self.extend_pin}, {self.retract_pin}))"
+
+
+class RuntimeModel:
+    __slots__ = ('mode', 'surfaces', 'names', 'index', 'pins', 'durations', 'goofy_map')
+
+    def __init__(self, mode: str, surfaces: Tuple[SurfaceSpec, ...], durations: Tuple[Tuple[float, ...], ...]) -> None:
+        self.mode = mode
+        self.surfaces = surfaces
+        self.names = tuple(surface.name for surface in surfaces)
+        self.index = {surface.name: surface.index for surface in surfaces}
+        # (extend pin number, retract pin number) of each surface
+        self.pins = tuple((surface.extend_pin, surface.retract_pin) for surface in surfaces)
+        # durations[pin count][ACTION[action mode]], row 0 (no pins hot) is all 0
+        self.durations = durations
+        self.goofy_map = {
+            surface.name: self.names[surface.goofy] for surface in surfaces if surface.goofy != surface.index
+        }
+
+    @classmethod
+    def compile(cls, travel_durations: dict, config: list, mode: str) -> 'RuntimeModel':
+        """
+        Validate and compile the configuration, raising ValueError with what is wrong.
+
+        :param travel_durations: the mode's section of operating_modes.yml
+        :param config: the contents of control_surfaces.yml
+        """
+        validate_surfaces(config)
+        names = [surface['name'] for surface in config]
+        validate_durations(travel_durations, mode, names)
+        surfaces = tuple(
+            SurfaceSpec(
+                index=i,
+                name=surface['name'],
+                goofy=names.index(surface['goofy']),
+                extend_pin=surface['pins']['extend'],
+                retract_pin=surface['pins']['retract'],
+                increment_extend=float(travel_durations['incremental'][surface['name']]['extend']),
+                increment_retract=float(travel_durations['incremental'][surface['name']]['retract']),
+            )
+            for i, surface in enumerate(config)
+        )
+        durations = ((0.0,) * len(ACTIONS),) + tuple(
+            tuple(float(travel_durations[pin_count][action]) for action in ACTIONS)
+            for pin_count in range(1, len(names) + 1)
+        )
+        return cls(mode, surfaces, durations)
+
+    def duration(self, travel: float, action_mode: str, pin_count: int) -> float:
+        """Seconds to travel a fraction of full travel with `pin_count` pins hot."""
+        return travel * self.durations[pin_count][ACTION[action_mode]]
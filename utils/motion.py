@@ -0,0 +1,342 @@
+"""
+An isolated motion process, which performs the timing of every move away from the UI.
+
+Within the application's process a pin-LOW edge can be delayed by Kivy's rendering, by other threads
+holding the GIL and by garbage-collection pauses, and every millisecond of delay is extra travel.
+With `motion: isolated: true` in settings.yml the pins are owned by a separate process which:
+
+- is pinned to its own cpu core and, where permitted, scheduled SCHED_FIFO,
+- disables garbage collection while a move is being timed, collecting between moves,
+- receives whole moves over a lock-free shared-memory ring, and reports each group of edges back
+  over a second ring, with how late it happened.
+
+`EngineBackend` is the pin backend the `Controller` uses in its place, see `Controller.execute()`.
+"""
+import gc
+import os
+import atexit
+import time
+import struct
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, Optional
+
+from utils import backends
+
+
+class Ring:
+    """
+    A single-producer, single-consumer ring of fixed-size records in shared memory.
+
+    The producer only ever writes `head` and the consumer only ever writes `tail`, so neither side
+    takes a lock: a record is written into its slot before `head` is advanced past it, and a slot is
+    only reused once `tail` has been advanced past it.
+    """
+
+    # head and tail on their own cache lines, the ring's geometry after the head so attaching processes can read it
+    HEAD = struct.Struct('<Q')
+    GEOMETRY = struct.Struct('<II')
+    GEOMETRY_OFFSET = 8
+    TAIL_OFFSET = 64
+    HEADER_SIZE = 128
+    LENGTH = struct.Struct('<I')
+
+    def __init__(self, name: str = None, slot_size: int = 1024, slots: int = 64) -> None:
+        """
+        :param name: the name of an existing ring to attach to, by default a new ring is created
+        :param slot_size: bytes per record, including its 4 byte length, of a new ring
+        :param slots: how many records a new ring holds
+        """
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + slot_size * slots)
+            self.memory.buf[:self.HEADER_SIZE] = bytes(self.HEADER_SIZE)
+            self.GEOMETRY.pack_into(self.memory.buf, self.GEOMETRY_OFFSET, slot_size, slots)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.slot_size, self.slots = self.GEOMETRY.unpack_from(self.memory.buf, self.GEOMETRY_OFFSET)
+        self.name = self.memory.name
+
+    @property
+    def head(self) -> int:
+        return self.HEAD.unpack_from(self.memory.buf, 0)[0]
+
+    @property
+    def tail(self) -> int:
+        return self.HEAD.unpack_from(self.memory.buf, self.TAIL_OFFSET)[0]
+
+    def put(self, payload: bytes) -> bool:
+        """Append a record, returning False if the ring is full."""
+        if len(payload) > self.slot_size - self.LENGTH.size:
+            raise ValueError(f"a record of {len(payload)} bytes does not fit a {self.slot_size} byte slot.")
+        head = self.head
+        if head - self.tail >= self.slots:
+            return False
+        offset = self.HEADER_SIZE + (head % self.slots) * self.slot_size
+        self.LENGTH.pack_into(self.memory.buf, offset, len(payload))
+        self.memory.buf[offset + self.LENGTH.size:offset + self.LENGTH.size + len(payload)] = payload
+        self.HEAD.pack_into(self.memory.buf, 0, head + 1)
+        return True
+
+    def get(self) -> Optional[bytes]:
+        """Remove and return the oldest record, or None if the ring is empty."""
+        tail = self.tail
+        if tail == self.head:
+            return None
+        offset = self.HEADER_SIZE + (tail % self.slots) * self.slot_size
+        length = self.LENGTH.unpack_from(self.memory.buf, offset)[0]
+        payload = bytes(self.memory.buf[offset + self.LENGTH.size:offset + self.LENGTH.size + length])
+        self.HEAD.pack_into(self.memory.buf, self.TAIL_OFFSET, tail + 1)
+        return payload
+
+    def close(self) -> None:
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# a command is a header of (kind, sequence number, edge count) followed by that many (at, pin number, state)
+COMMAND = struct.Struct('<III')
+COMMAND_EDGE = struct.Struct('<dHB')
+MOVE, STOP = 1, 2
+# a reply is (sequence number, group index, latency), the group index is DONE once the move is complete
+REPLY = struct.Struct('<IId')
+DONE = 0xFFFFFFFF
+
+
+def encode_move(sequence: int, groups: List[tuple]) -> bytes:
+    edges = [(at, number, int(state)) for at, states in groups for number, state in states.items()]
+    return COMMAND.pack(MOVE, sequence, len(edges)) + b''.join(COMMAND_EDGE.pack(*edge) for edge in edges)
+
+
+def decode_move(payload: bytes) -> List[tuple]:
+    """The groups of a move command, [(at, {pin number: state}), ...] in time order."""
+    kind, sequence, count = COMMAND.unpack_from(payload, 0)
+    groups = []
+    for i in range(count):
+        at, number, state = COMMAND_EDGE.unpack_from(payload, COMMAND.size + i * COMMAND_EDGE.size)
+        if not groups or groups[-1][0] != at:
+            groups.append((at, {}))
+        groups[-1][1][number] = bool(state)
+    return groups
+
+
+def isolate(cpu: Optional[int], priority: Optional[int], logger: logging.Logger) -> None:
+    """Pin the calling process to a cpu core and give it SCHED_FIFO priority, as far as permitted."""
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+            logger.info(f"motion process pinned to cpu {cpu}")
+        except (AttributeError, OSError) as e:
+            logger.warning(f"motion process could not be pinned to cpu {cpu}: {e}")
+    if priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            logger.info(f"motion process scheduled SCHED_FIFO at priority {priority}")
+        except (AttributeError, OSError) as e:
+            logger.warning(f"motion process keeps normal scheduling, SCHED_FIFO was not permitted: {e}")
+
+
+def engine_main(commands_name: str, replies_name: str, pins: List[int], pin_settings: Optional[dict],
+                cpu: Optional[int], priority: Optional[int], spin: float, ready) -> None:
+    """The motion process, which owns the pins and performs each move it receives."""
+    logger = logging.getLogger('Surf.Motion')
+    isolate(cpu, priority, logger)
+    backend = backends.from_settings(pin_settings) if pin_settings else backends.NullBackend()
+    for number in pins:
+        backend.setup(number)
+    backend.start()
+    commands, replies = Ring(name=commands_name), Ring(name=replies_name)
+    ready.set()
+
+    while True:
+        payload = commands.get()
+        if payload is None:
+            time.sleep(0.0005)
+            continue
+        kind, sequence, count = COMMAND.unpack_from(payload, 0)
+        if kind == STOP:
+            break
+
+        groups = decode_move(payload)
+        gc.disable()
+        try:
+            start = time.monotonic()
+            for i, (at, states) in enumerate(groups):
+                deadline = start + at
+                remaining = deadline - time.monotonic()
+                # sleep until just before the edge, then spin so the wake-up jitter of the sleep is not added
+                if remaining > spin:
+                    time.sleep(remaining - spin)
+                while time.monotonic() < deadline:
+                    pass
+                backend.output_many(states)
+                latency = time.monotonic() - deadline
+                while not replies.put(REPLY.pack(sequence, i, latency)):
+                    time.sleep(0.0001)
+        finally:
+            gc.enable()
+        while not replies.put(REPLY.pack(sequence, DONE, 0)):
+            time.sleep(0.0001)
+        gc.collect()
+
+    commands.close()
+    replies.close()
+
+
+class MotionEngine:
+    """
+    The application's side of the motion process.
+
+    :param pins: every pin number the motion process sets up and drives
+    :param pin_settings: the `pins` section of settings.yml, the backend the motion process drives, or None for none
+    :param cpu: the cpu core the motion process is pinned to, or None
+    :param priority: the SCHED_FIFO priority of the motion process, or None for normal scheduling
+    :param spin: seconds before each edge at which the motion process stops sleeping and busy-waits
+    """
+
+    def __init__(self, pins: List[int], pin_settings: Optional[dict], cpu: int = None, priority: int = None,
+                 spin: float = 0.002) -> None:
+        self.pins = pins
+        self.pin_settings = pin_settings
+        self.cpu = cpu
+        self.priority = priority
+        self.spin = spin
+        self.logger = logging.getLogger('Surf.Motion')
+        # the rings each have a single producer and consumer, so moves from this side are sent one at a time
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.latencies = deque(maxlen=10000)
+        self.process = None
+
+    def start(self, timeout: float = 10) -> None:
+        self.commands = Ring()
+        self.replies = Ring(slot_size=64, slots=256)
+        # spawned rather than forked, the motion process should not inherit the UI's threads or state
+        context = multiprocessing.get_context('spawn')
+        ready = context.Event()
+        self.process = context.Process(
+            target=engine_main,
+            args=(self.commands.name, self.replies.name, self.pins, self.pin_settings,
+                  self.cpu, self.priority, self.spin, ready),
+            name='SurfMotion',
+            daemon=True,
+        )
+        self.process.start()
+        atexit.register(self.stop)
+        if not ready.wait(timeout):
+            self.stop()
+            raise RuntimeError(f"the motion process did not start within {timeout} seconds.")
+        self.logger.info(f"motion process started, pid {self.process.pid}")
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            while not self.commands.put(COMMAND.pack(STOP, 0, 0)):
+                time.sleep(0.001)
+            self.process.join(timeout=5)
+        if self.latencies:
+            self.logger.info(f"edge latency: {self.summary()}")
+        self.commands.close()
+        self.replies.close()
+        self.process = None
+        atexit.unregister(self.stop)
+
+    def run(self, groups: List[tuple]) -> Iterator[tuple]:
+        """Send a move to the motion process, and yield `(group index, latency)` as each group happens."""
+        with self.lock:
+            self.sequence += 1
+            while not self.commands.put(encode_move(self.sequence, groups)):
+                time.sleep(0.001)
+            while True:
+                reply = self.replies.get()
+                if reply is None:
+                    if not self.process.is_alive():
+                        raise RuntimeError("the motion process has stopped.")
+                    time.sleep(0.0005)
+                    continue
+                sequence, index, latency = REPLY.unpack(reply)
+                if sequence != self.sequence:
+                    continue
+                if index == DONE:
+                    return
+                self.latencies.append(latency)
+                yield index, latency
+
+    def summary(self) -> Dict[str, float]:
+        """The worst, 99th percentile and mean latency of the recorded edges, in milliseconds."""
+        return summarize(self.latencies)
+
+
+def summarize(latencies) -> Dict[str, float]:
+    """The count, worst, 99th percentile and mean of a collection of latencies, in milliseconds."""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'edges': 0, 'worst': 0, 'p99': 0, 'mean': 0}
+    return {
+        'edges': len(ordered),
+        'worst': round(ordered[-1] * 1000, 3),
+        'p99': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def stress(stop: threading.Event) -> None:
+    """
+    Load the calling process the way the UI does, until `stop` is set: pure python work which holds
+    the GIL, and reference cycles which only the garbage collector can free.
+    """
+    while not stop.is_set():
+        nodes = [{'value': i} for i in range(5000)]
+        for node, next_node in zip(nodes, nodes[1:] + nodes[:1]):
+            node['next'] = next_node
+        sum(node['value'] ** 2 for node in nodes)
+
+
+class EngineBackend(backends.PinBackend):
+    """The pin backend of a `Controller` whose pins are driven by a `MotionEngine`."""
+
+    timed = True
+
+    def __init__(self, pin_settings: Optional[dict], cpu: int = None, priority: int = None) -> None:
+        self.pin_settings = pin_settings
+        self.cpu = cpu
+        self.priority = priority
+        self.pins = []
+        self.engine = None
+
+    @classmethod
+    def from_settings(cls, settings: dict, use_pins: bool = True) -> 'EngineBackend':
+        """
+        :param settings: the whole of settings.yml, the `motion` and `pins` sections are used
+        :param use_pins: whether the motion process drives the `pins` backend, or nothing
+        """
+        return cls(
+            settings['pins'] if use_pins else None,
+            cpu=settings['motion']['cpu'],
+            priority=settings['motion']['priority'],
+        )
+
+    def setup(self, number: int) -> None:
+        self.pins.append(number)
+
+    def start(self) -> None:
+        self.engine = MotionEngine(self.pins, self.pin_settings, cpu=self.cpu, priority=self.priority)
+        self.engine.start()
+
+    def output(self, number: int, state: bool) -> None:
+        self.output_many({number: state})
+
+    def output_many(self, states: Dict[int, bool]) -> None:
+        for _ in self.engine.run([(0, states)]):
+            pass
+
+    def run(self, groups: List[tuple]) -> Iterator[tuple]:
+        return self.engine.run(groups)
+
+    def stop(self) -> None:
+        self.engine.stop()
@@ -0,0 +1,224 @@
+"""
+Bulk import and export of wave-profiles, as CSV, JSON or multi-document YAML.
+
+Records are read one at a time from the input, so a file of thousands of profiles never has to
+fit in memory, and a bad record is reported with its number without stopping the import. The
+surfaces are read from control_surfaces.yml once for the whole import.
+
+A record is a profile's name and its surfaces' values, either in a `control_surfaces` mapping
+(like the profile files themselves) or flat, one column or key per surface:
+
+    name,PORT,CENTER,STARBOARD
+    Steep,35,15,0
+
+JSON input may be an array of records or one record per line. Every valid record is written in a
+single transaction: each profile is written to a temporary file, the files are flushed to disk
+with one sync, and only then are they renamed into PROFILES_DIR. An interrupted import leaves each
+profile either as it was or fully written.
+"""
+import os
+import csv
+import json
+import tempfile
+from typing import Dict, Iterator, List, Tuple
+
+import yaml
+
+import utils
+from utils import history
+from utils import utilities as u
+
+FORMATS = ('csv', 'json', 'yaml')
+
+
+def guess_format(path: str) -> str:
+    """The format of a file from its extension, raising ValueError if it is not one of `FORMATS`."""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    extension = {'yml': 'yaml', 'jsonl': 'json'}.get(extension, extension)
+    if extension not in FORMATS:
+        raise ValueError(f"the format of '{path}' is not known from its extension, give one of {FORMATS}.")
+    return extension
+
+
+def surface_names() -> List[str]:
+    return [surface['name'] for surface in yaml.safe_load(open(os.path.join(utils.CONFIG_DIR, 'control_surfaces.yml')))]
+
+
+def read_csv(stream) -> Iterator[Tuple[int, object]]:
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_json(stream, chunk_size: int = 64 * 1024) -> Iterator[Tuple[int, object]]:
+    """Decode the records of a JSON array, or of JSON lines, as they are read."""
+    decoder = json.JSONDecoder()
+    buffer, number = '', 0
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        while True:
+            # the brackets and commas of an array, and the newlines of JSON lines, separate the records
+            buffer = buffer.lstrip(' \t\r\n,[]')
+            if not buffer:
+                break
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if chunk:
+                    # the record continues in the next chunk
+                    break
+                raise
+            number += 1
+            yield number, record
+            buffer = buffer[end:]
+        if not chunk:
+            return
+
+
+def read_yaml(stream) -> Iterator[Tuple[int, object]]:
+    for number, record in enumerate(yaml.safe_load_all(stream), start=1):
+        if record is not None:
+            yield number, record
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'yaml': read_yaml}
+
+
+def validate(record, names: List[str]) -> dict:
+    """
+    The profile config of a record, raising ValueError with what is wrong with it.
+
+    :param names: the surface names of control_surfaces.yml
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"a record must be a mapping, not {type(record).__name__}.")
+    name = str(record.get('name') or '').strip()
+    if not name:
+        raise ValueError("the profile has no name.")
+    username = u.Profile.get_username(name)
+    if username.startswith('.') or os.sep in username:
+        raise ValueError(f"'{name}' cannot be used as a profile name.")
+    values = record['control_surfaces'] if isinstance(record.get('control_surfaces'), dict) else record
+    missing = [surface_name for surface_name in names if values.get(surface_name) in (None, '')]
+    if missing:
+        raise ValueError(f"'{name}' has no value for {', '.join(missing)}.")
+
+    control_surfaces = {}
+    for surface_name in names:
+        value = values[surface_name]
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = None
+        if number is None or not number.is_integer() or not 0 <= number <= 100 or number % 5:
+            raise ValueError(f"'{name}' {surface_name} must be a multiple of 5 from 0 to 100, not {value!r}.")
+        control_surfaces[surface_name] = int(number)
+
+    config = u.Profile.initial_config(name)
+    config['control_surfaces'] = control_surfaces
+    config['goofy'] = False
+    return config
+
+
+def import_profiles(stream, file_format: str, replace: bool = False,
+                    dry_run: bool = False) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """
+    Validate every record of a stream, and write the valid ones as profiles in one transaction.
+
+    :param replace: overwrite existing profiles of the same username, rather than reporting them
+    :param dry_run: only validate, write nothing
+    :return: the usernames written (or which would be), and the (record number, error) of each invalid record
+    """
+    names = surface_names()
+    existing = {file_name[:-len('.yml')] for file_name in os.listdir(utils.PROFILES_DIR) if file_name.endswith('.yml')}
+    profiles: Dict[str, dict] = {}
+    errors = []
+    records = READERS[file_format](stream)
+    number = 0
+    while True:
+        try:
+            number, record = next(records)
+        except StopIteration:
+            break
+        except (ValueError, yaml.YAMLError, csv.Error) as e:
+            # a malformed document cannot be read past, the records before it are still imported
+            errors.append((number + 1, f"the input could not be read any further: {e}"))
+            break
+        try:
+            config = validate(record, names)
+            if config['username'] in profiles:
+                raise ValueError(f"'{config['name']}' appears more than once.")
+            if config['username'] in existing and not replace:
+                raise ValueError(f"'{config['name']}' already exists, import with --replace to overwrite it.")
+        except ValueError as e:
+            errors.append((number, str(e)))
+            continue
+        profiles[config['username']] = config
+
+    if profiles and not dry_run:
+        write_profiles(profiles)
+    return list(profiles), errors
+
+
+def write_profiles(profiles: Dict[str, dict]) -> None:
+    """Write many profiles at once, flushing them all with one sync before any replaces a file."""
+    staged = []
+    try:
+        for username, config in profiles.items():
+            fd, temp_path = tempfile.mkstemp(dir=utils.PROFILES_DIR, prefix=f".{username}.yml.")
+            staged.append(temp_path)
+            with os.fdopen(fd, 'w') as outfile:
+                yaml.dump(config, outfile, default_flow_style=False, sort_keys=False)
+        os.sync()
+        for temp_path, username in zip(staged, profiles):
+            path = os.path.join(utils.PROFILES_DIR, f"{username}.yml")
+            if os.path.isfile(path):
+                history.record(
+                    username,
+                    yaml.safe_load(open(path, 'r'))['control_surfaces'],
+                    profiles[username]['control_surfaces'],
+                    'import',
+                )
+            os.replace(temp_path, path)
+    except BaseException:
+        for temp_path in staged:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    utils.logger.info(f"[UTILITIES] imported {len(profiles)} profiles into {utils.PROFILES_DIR}")
+
+
+def read_profiles() -> Iterator[dict]:
+    """Every profile, one at a time, in order of username."""
+    for file_name in sorted(os.listdir(utils.PROFILES_DIR)):
+        if file_name.endswith('.yml'):
+            yield yaml.safe_load(open(os.path.join(utils.PROFILES_DIR, file_name), 'r'))
+
+
+def export_profiles(stream, file_format: str) -> int:
+    """Write every profile to a stream, returning how many were written."""
+    names = surface_names()
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(['name'] + names)
+        for profile in read_profiles():
+            writer.writerow([profile['name']] + [profile['control_surfaces'].get(name, '') for name in names])
+            count += 1
+    elif file_format == 'json':
+        stream.write('[')
+        for profile in read_profiles():
+            stream.write(('\n' if not count else ',\n') + json.dumps(
+                {'name': profile['name'], 'control_surfaces': profile['control_surfaces']}
+            ))
+            count += 1
+        stream.write('\n]\n')
+    else:
+        for profile in read_profiles():
+            stream.write('---\n' + yaml.dump(
+                {'name': profile['name'], 'control_surfaces': profile['control_surfaces']},
+                default_flow_style=False, sort_keys=False
+            ))
+            count += 1
+    return count
@@ -0,0 +1,264 @@
+"""
+Timed wave-programs, like "steep for 20 seconds, then mellow, invert at 40 seconds".
+
+A wave-program is a yml file in PROGRAMS_DIR (see utils/program_templates), with a list of steps
+each run `at` a number of seconds after the program starts. `ProgramRunner` precomputes every
+transition up front, runs the steps at their monotonic times, reports how far each step drifted
+from its schedule, and can be paused, resumed and aborted from another thread (like the UI).
+"""
+import os
+import time
+import yaml
+import logging
+import threading
+from collections import namedtuple
+from typing import Callable, List
+
+import utils
+from utils import utilities as u
+from utils import optimizer
+from utils.duty import DutyCycleExceeded
+
+# a precomputed step of a wave-program
+#   - at:        seconds after the program starts
+#   - action:    'profile', 'invert' or 'retract'
+#   - profile:   for 'profile' steps, the username of the wave-profile
+#   - targets:   the positions every surface is expected to be at once the step is done
+#   - predicted: the predicted duration of the step's move, in seconds
+Step = namedtuple('Step', ['at', 'action', 'profile', 'targets', 'predicted'])
+
+ACTIONS = ('profile', 'invert', 'retract')
+
+
+class Program:
+
+    @classmethod
+    def get_path(cls, username: str) -> str:
+        return os.path.join(utils.PROGRAMS_DIR, f"{username}.yml")
+
+    @classmethod
+    def read_config(cls, username: str) -> dict:
+        utils.logger.info(f'[PROGRAMS] reading program: {cls.get_path(username)}')
+        return yaml.safe_load(open(cls.get_path(username), 'r'))
+
+    @classmethod
+    def read_configs(cls):
+        for config_file in sorted(os.listdir(utils.PROGRAMS_DIR)):
+            if config_file.endswith('.yml'):
+                yield yaml.safe_load(open(os.path.join(utils.PROGRAMS_DIR, config_file), 'r'))
+
+    @classmethod
+    def validate(cls, program: dict) -> List[str]:
+        """Return a list of everything wrong with a program, an empty list if it can be run."""
+        errors = []
+        previous_at = 0
+        for i, step in enumerate(program.get('steps') or []):
+            at = step.get('at')
+            if not isinstance(at, (int, float)) or at < previous_at:
+                errors.append(f"step {i + 1}: `at` must be a number of seconds, no earlier than the step before it.")
+            else:
+                previous_at = at
+            if 'profile' in step:
+                if not u.Profile.config_exists(username=step['profile']):
+                    errors.append(f"step {i + 1}: the wave-profile '{step['profile']}' does not exist.")
+            elif step.get('action') not in ACTIONS[1:]:
+                errors.append(f"step {i + 1}: needs a `profile`, or an `action` which is one of {ACTIONS[1:]}.")
+        if not program.get('steps'):
+            errors.append("a program needs at least one step.")
+        return errors
+
+
+class ProgramRunner:
+
+    def __init__(self, controller, program: dict, on_step: Callable = None, on_finish: Callable = None) -> None:
+        errors = Program.validate(program)
+        if errors:
+            raise ValueError(f"'{program.get('name')}' cannot be run: {errors}")
+        self.controller = controller
+        self.name = program['name']
+        self.logger = logging.getLogger('Surf.Program')
+        self.on_step = on_step
+        self.on_finish = on_finish
+        self.aborted = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.started = None
+        self.paused_at = None
+        self.paused_for = 0
+        # a dict for each step which has been run: {'step', 'scheduled', 'started', 'drift', 'duration'}
+        self.report = []
+        self.steps = self.precompute(program['steps'])
+
+    def precompute(self, steps: List[dict]) -> List[Step]:
+        """Resolve every step into its target positions and predicted duration, warning of overlapping steps."""
+        durations = {
+            pin_count: self.controller.duration(1, 'deploy', pin_count=pin_count)
+            for pin_count in range(1, len(self.controller.surfaces) + 1)
+        }
+        withdraw_durations = {
+            pin_count: self.controller.duration(1, 'withdraw', pin_count=pin_count)
+            for pin_count in range(1, len(self.controller.surfaces) + 1)
+        }
+        positions = dict(self.controller.positions)
+        # a retract step deactivates the profile, so it follows the `retract` policy (see `Controller.plan_withdraw()`)
+        retracts_since_homing = self.controller.retracts_since_homing
+        compiled = []
+        for step in steps:
+            if 'profile' in step:
+                action = 'profile'
+                targets = {
+                    surface_name: value / 100
+                    for surface_name, value in u.Profile.read_config(username=step['profile'])['control_surfaces'].items()
+                }
+            elif step['action'] == 'invert':
+                action = 'invert'
+                targets = {
+                    regular: positions[goofy]
+                    for regular, goofy in self.controller.goofy_map.items()
+                }
+            else:
+                action = 'retract'
+                targets = {surface_name: 0 for surface_name in positions}
+                full_withdraw_due = (
+                    self.controller.retract_mode == 'blind'
+                    or retracts_since_homing is None
+                    or retracts_since_homing + 1 >= self.controller.full_withdraw_every
+                )
+                if full_withdraw_due:
+                    predicted, retracts_since_homing = withdraw_durations[len(positions)], 0
+                else:
+                    travels = {
+                        surface_name: position + self.controller.retract_margin
+                        for surface_name, position in positions.items()
+                        if position > 0
+                    }
+                    predicted = (
+                        max(finish for start, finish in optimizer.simulate(
+                            travels, {surface_name: None for surface_name in travels}, withdraw_durations
+                        ).values())
+                        if travels else 0
+                    )
+                    retracts_since_homing += 1 if travels else 0
+                positions.update(targets)
+                compiled.append(Step(step['at'], action, step.get('profile'), dict(positions), predicted))
+                continue
+            travels = {
+                surface_name: abs(target - positions[surface_name])
+                for surface_name, target in targets.items()
+                if target != positions[surface_name]
+            }
+            predicted = (
+                max(finish for start, finish in optimizer.simulate(
+                    travels, {surface_name: None for surface_name in travels}, durations
+                ).values())
+                if travels else 0
+            )
+            positions.update(targets)
+            compiled.append(Step(step['at'], action, step.get('profile'), dict(positions), predicted))
+
+        for step, next_step in zip(compiled, compiled[1:]):
+            if step.at + step.predicted > next_step.at:
+                self.logger.warning(
+                    f"'{self.name}': the {step.action} at {step.at}s is predicted to take {round(step.predicted, 2)}s, "
+                    f"overrunning the step at {next_step.at}s"
+                )
+        return compiled
+
+    @property
+    def clock(self) -> float:
+        """Seconds of program time, which stops while the program is paused."""
+        now = self.paused_at if self.paused_at is not None else time.monotonic()
+        return now - self.started - self.paused_for
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None and not self.aborted.is_set() and len(self.report) < len(self.steps)
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    def pause(self) -> None:
+        """Freeze the program clock, a step which is already moving finishes its move."""
+        if not self.paused:
+            self.logger.info(f"'{self.name}': paused")
+            self.paused_at = time.monotonic()
+            self.resumed.clear()
+
+    def resume(self) -> None:
+        if self.paused:
+            self.paused_for += time.monotonic() - self.paused_at
+            self.paused_at = None
+            self.logger.info(f"'{self.name}': resumed")
+            self.resumed.set()
+
+    def abort(self) -> None:
+        """Stop before the next step, a step which is already moving finishes its move."""
+        self.logger.info(f"'{self.name}': aborted")
+        self.aborted.set()
+        self.resumed.set()
+
+    def wait_until(self, at: float) -> bool:
+        """Wait until `at` seconds of program time, return False if the program is aborted first."""
+        while not self.aborted.is_set():
+            if self.paused:
+                self.resumed.wait()
+                continue
+            remaining = at - self.clock
+            if remaining <= 0:
+                return True
+            self.aborted.wait(min(remaining, 0.1))
+        return False
+
+    def run(self) -> List[dict]:
+        """Run every step at its scheduled time (blocks), and return the report."""
+        self.logger.info(f"'{self.name}': starting, {len(self.steps)} step(s)")
+        self.started = time.monotonic()
+        for step in self.steps:
+            if not self.wait_until(step.at):
+                break
+            started = self.clock
+            self.logger.info(
+                f"'{self.name}': {step.action} {step.profile or ''} at {round(started, 4)}s "
+                f"(scheduled {step.at}s, drift {round((started - step.at) * 1000, 2)}ms)"
+            )
+            try:
+                self.run_step(step)
+            except DutyCycleExceeded as e:
+                # a later step keeps to its own time rather than waiting for this one
+                self.logger.warning(f"'{self.name}': skipping the {step.action} step, {e}")
+            self.report.append({
+                'step': step,
+                'scheduled': step.at,
+                'started': started,
+                'drift': started - step.at,
+                'duration': self.clock - started,
+            })
+            if self.on_step:
+                self.on_step(step)
+
+        if self.report:
+            drifts = [abs(record['drift']) for record in self.report]
+            self.logger.info(
+                f"'{self.name}': finished {len(self.report)} of {len(self.steps)} step(s), drift "
+                f"max {round(max(drifts) * 1000, 2)}ms, mean {round(sum(drifts) / len(drifts) * 1000, 2)}ms"
+            )
+        if self.on_finish:
+            self.on_finish(self)
+        return self.report
+
+    def run_step(self, step: Step) -> None:
+        if step.action == 'profile':
+            if self.controller.active_profile:
+                self.controller.transition_profile(self.controller.active_profile, step.profile)
+            else:
+                self.controller.activate_profile(step.profile)
+        elif step.action == 'invert':
+            self.controller.invert()
+        else:
+            self.controller.deactivate_profile()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='SurfProgram', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,209 @@
+"""
+Live reload of operating_modes.yml and control_surfaces.yml, without restarting the application.
+
+`ConfigWatcher` watches the directories of the controller's config files with inotify (every
+write to them, whether by `surf.py update-operating-mode`, `reset-config`, `calibrate` or an
+editor, ends with a close or a rename into place). A changed file is parsed and validated, and
+only then swapped into the running controller, under its motion lock so that a move never uses
+two different timing tables (see `Controller.swap_config()`). Each changed value is logged.
+
+A change to the names or pins of the surfaces cannot be applied to pins which are already set up,
+so it is refused with a warning until the application is restarted. Without inotify (on a
+development machine which is not linux) the files' modification times are polled instead.
+"""
+import os
+import time
+import ctypes
+import select
+import struct
+import logging
+import threading
+from typing import Dict, List
+
+import yaml
+
+from utils import model
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+# struct inotify_event: wd, mask, cookie, len, followed by `len` bytes of null padded name
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """The linux inotify API, through libc."""
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def watch(self, directory: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), directory)
+        return wd
+
+    def read(self, timeout: float) -> List[str]:
+        """The names of the files written in the watched directories, waiting at most `timeout` seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names, offset = [], 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def flatten(config, prefix: str = '') -> Dict[str, object]:
+    """{'wet.1.deploy': 3.6, ...} of a config, the surfaces of control_surfaces.yml being keyed by their name."""
+    if isinstance(config, list) and all(isinstance(item, dict) and 'name' in item for item in config):
+        config = {item['name']: {key: value for key, value in item.items() if key != 'name'} for item in config}
+    if not isinstance(config, dict):
+        return {prefix: config}
+    flat = {}
+    for key, value in config.items():
+        flat.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+
+def diff(old, new) -> List[str]:
+    """A line for each value which was changed, added or removed."""
+    old, new = flatten(old), flatten(new)
+    return [
+        f"{key}: {old.get(key, '(none)')} -> {new.get(key, '(none)')}"
+        for key in list(old) + [key for key in new if key not in old]
+        if old.get(key, '(none)') != new.get(key, '(none)')
+    ]
+
+
+def validate_modes(operating_modes, mode: str, surface_names: List[str]) -> dict:
+    """
+    Check an operating_modes.yml, raising ValueError with what is wrong.
+
+    :return: the section of the mode in use
+    """
+    if not isinstance(operating_modes, dict):
+        raise ValueError("operating_modes.yml must be a mapping of operating modes.")
+    return model.validate_durations(operating_modes.get(mode), mode, surface_names)
+
+
+def validate_surfaces(config, current: list) -> list:
+    """Check a control_surfaces.yml against the one the controller was created with, raising ValueError."""
+    model.validate_surfaces(config)
+    layout = [(surface['name'], surface['pins']) for surface in config]
+    if layout != [(surface['name'], surface['pins']) for surface in current]:
+        raise ValueError("the names or pins of the surfaces changed, which only takes effect after a restart.")
+    return config
+
+
+class ConfigWatcher:
+
+    def __init__(self, controller, interval: float = 1, settle: float = 0.1) -> None:
+        """
+        :param interval: seconds between checks for the stop signal, or between polls without inotify
+        :param settle: seconds to wait after a write, so that a burst of writes is reloaded once
+        """
+        self.controller = controller
+        self.interval = interval
+        self.settle = settle
+        self.logger = logging.getLogger('Surf.Reload')
+        self.stopped = threading.Event()
+        self.reloaders = {
+            os.path.abspath(controller.modes): self.reload_modes,
+            os.path.abspath(controller.path): self.reload_surfaces,
+        }
+        self.mtimes = {path: self.mtime(path) for path in self.reloaders}
+        try:
+            self.inotify = Inotify()
+            for directory in {os.path.dirname(path) for path in self.reloaders}:
+                self.inotify.watch(directory)
+        except (OSError, AttributeError) as e:
+            self.logger.info(f"inotify is unavailable ({e}), polling the config files instead.")
+            self.inotify = None
+
+    @staticmethod
+    def mtime(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def changed(self) -> List[str]:
+        """The paths of the watched config files written since the last call."""
+        if self.inotify:
+            names = set(self.inotify.read(self.interval))
+            if not names:
+                return []
+            changed = [path for path in self.reloaders if os.path.basename(path) in names]
+        else:
+            self.stopped.wait(self.interval)
+            changed = []
+        # the modification times also catch writes which were made while the last change was reloading
+        for path in self.reloaders:
+            mtime = self.mtime(path)
+            if mtime != self.mtimes[path]:
+                self.mtimes[path] = mtime
+                if path not in changed:
+                    changed.append(path)
+        return changed
+
+    def read(self, path: str):
+        try:
+            return yaml.safe_load(open(path, 'r'))
+        except (OSError, yaml.YAMLError) as e:
+            raise ValueError(f"it could not be read: {e}")
+
+    def reload_modes(self, path: str) -> None:
+        travel_durations = validate_modes(self.read(path), self.controller.mode, self.controller.surface_names)
+        changes = diff(self.controller.travel_durations, travel_durations)
+        if changes:
+            self.controller.swap_config(travel_durations=travel_durations)
+        self.log(path, [f"{self.controller.mode}.{change}" for change in changes])
+
+    def reload_surfaces(self, path: str) -> None:
+        config = validate_surfaces(self.read(path), self.controller.config)
+        changes = diff(self.controller.config, config)
+        if changes:
+            self.controller.swap_config(config=config)
+        self.log(path, changes)
+
+    def log(self, path: str, changes: List[str]) -> None:
+        if not changes:
+            self.logger.debug(f"'{path}' was written without any change.")
+            return
+        self.logger.info(f"reloaded '{path}':")
+        for change in changes:
+            self.logger.info(f"  > {change}")
+
+    def run(self) -> None:
+        self.logger.info(f"watching {', '.join(self.reloaders)} for changes")
+        while not self.stopped.is_set():
+            changed = self.changed()
+            if not changed:
+                continue
+            time.sleep(self.settle)
+            for path in changed:
+                self.mtimes[path] = self.mtime(path)
+                try:
+                    self.reloaders[path](path)
+                except ValueError as e:
+                    self.logger.warning(f"not reloading '{path}', {e}")
+        if self.inotify:
+            self.inotify.close()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='SurfReload', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopped.set()
@@ -0,0 +1,147 @@
+"""
+The control inputs which run beside the controller, and the headless mode which runs them without the UI.
+
+`start()` starts each input enabled in settings.yml: the control API, the GPS speed-gate, the
+homing scheduler and the config reload. `main.run()` starts them before opening the UI, and
+`run_headless()` (`surf.py run --headless`) starts them with no UI at all, for a controller driven
+by GPS, physical buttons or the API. Nothing here imports kivy, so a headless controller never
+loads it, opens a window or renders frames.
+
+`ResourceMonitor` logs the process's resident memory and CPU use every `resources.interval`
+seconds in either mode. The last report of each mode is kept in LOGS_DIR/resources.json, so each
+report also shows the other mode's figures to compare with.
+"""
+import os
+import json
+import time
+import signal
+import logging
+import resource
+import threading
+from datetime import datetime
+from typing import Optional
+
+import utils
+from utils import utilities as u
+
+logger = logging.getLogger('Surf.Services')
+
+
+def start(controller, settings: dict) -> None:
+    """
+    Start each control input which is enabled, each in a daemon thread of its own.
+
+    :param settings: the whole of settings.yml
+    """
+    if settings['api']['enabled']:
+        from utils import api
+        api.start_in_thread(controller, settings['api']['host'], settings['api']['port'])
+    monitor = None
+    if settings['gps']['enabled']:
+        from utils import gps
+        monitor = gps.GPSMonitor.from_settings(controller, settings['gps'])
+        monitor.start()
+    if settings['homing']['enabled']:
+        from utils import homing
+        homing.HomingScheduler.from_settings(
+            controller, settings['homing'], speed=(lambda: monitor.speed) if monitor else None
+        ).start()
+    if settings['reload']['enabled']:
+        from utils import reload
+        reload.ConfigWatcher(controller).start()
+
+
+def resident_memory() -> float:
+    """Megabytes of the process resident in memory now, or at its peak where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        # kilobytes on linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** (2 if peak > 1024 ** 3 else 1)
+
+
+class ResourceMonitor:
+    path = os.path.join(utils.LOGS_DIR, 'resources.json')
+
+    def __init__(self, mode: str, interval: float = 300) -> None:
+        """
+        :param mode: 'ui' or 'headless'
+        :param interval: seconds between reports
+        """
+        self.mode = mode
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger('Surf.Resources')
+
+    def others(self) -> dict:
+        try:
+            reports = json.load(open(self.path, 'r'))
+        except (OSError, ValueError):
+            return {}
+        return reports if isinstance(reports, dict) else {}
+
+    def report(self, cpu: float) -> dict:
+        """Log the resident memory and the CPU used over the last interval, with the other mode's last report."""
+        current = {
+            'rss_mb': round(resident_memory(), 1),
+            'cpu_percent': round(cpu, 2),
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        reports = self.others()
+        compared = [
+            f"{mode}: {other['rss_mb']} MB, {other['cpu_percent']}% CPU on {other['at']}"
+            for mode, other in reports.items() if mode != self.mode and isinstance(other, dict)
+        ]
+        self.logger.info(
+            f"{self.mode}: {current['rss_mb']} MB resident, {current['cpu_percent']}% CPU over the last "
+            f"{round(self.interval)}s" + (f" (last {', '.join(compared)})" if compared else "")
+        )
+        reports[self.mode] = current
+        try:
+            u.atomic_write(self.path, json.dumps(reports, indent=2))
+        except OSError as e:
+            self.logger.debug(f"could not write '{self.path}', {e}")
+        return current
+
+    def run(self) -> None:
+        wall, cpu = time.monotonic(), time.process_time()
+        while not self.stopped.wait(self.interval):
+            now_wall, now_cpu = time.monotonic(), time.process_time()
+            self.report(100 * (now_cpu - cpu) / (now_wall - wall))
+            wall, cpu = now_wall, now_cpu
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='SurfResources', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def run_headless(stopped: Optional[threading.Event] = None) -> None:
+    """
+    Start the controller and every enabled control input without the UI, until interrupted or terminated (blocks).
+
+    :param stopped: set to stop, by default only SIGINT or SIGTERM stop it
+    """
+    from utils import controller
+
+    stopped = stopped or threading.Event()
+    controller.start()
+    settings = u.read_settings()
+    start(controller.controller, settings)
+    inputs = [name for name in ('api', 'gps', 'homing', 'reload') if settings[name]['enabled']]
+    if not inputs:
+        logger.warning("no control input is enabled in settings.yml, nothing can move the surfaces.")
+    if settings['resources']['interval']:
+        ResourceMonitor('headless', settings['resources']['interval']).start()
+    # a normal exit on SIGTERM too, so that the atexit handlers release the pins and save the duty-cycles
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopped.set())
+    logger.info(f"running headless with {', '.join(inputs) or 'no inputs'}, {round(resident_memory(), 1)} MB resident.")
+    while not stopped.wait(1):
+        pass
+    logger.info("stopping.")
@@ -0,0 +1,212 @@
+"""
+The live state of the `Controller`, published in a small fixed-layout block of shared memory.
+
+Other processes (like `surf.py status --watch`) attach to the block by name and read consistent
+snapshots at any rate, without a round-trip to the application. The block is guarded by a
+seqlock: the writer makes the sequence odd, writes, then makes it even again, and a reader retries
+any copy during which the sequence was odd or changed, for a bounded number of tries.
+
+There is only ever one writer: the block records the pid of the process which publishes it, and
+another process (like `surf.py serve` while the UI runs) is refused the block while that process
+is alive. A block left behind by a process which has exited is taken over.
+
+Layout, little-endian:
+    0    u64          sequence, odd while a write is in progress
+    8    4s           b'SURF'
+    12   u16          layout version
+    14   u16          surface count
+    16   u64          pin-state bits, bit 2n is surface n's extend pin and bit 2n+1 its retract pin
+    24   f64          time.monotonic() at which the current move started, 0 while not moving
+    32   f64          the planned duration of the current move in seconds
+    40   f64          time.time() of the last update
+    48   64s          the active profile, utf-8, null padded
+    112  8 x 16s      the surface names, utf-8, null padded
+    240  8 x f64      the surface positions, between 0 and 1
+    304  u32          the pid of the process publishing the block, outside the seqlock
+"""
+import os
+import time
+import atexit
+import struct
+import logging
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+MAGIC = b'SURF'
+VERSION = 2
+MAX_SURFACES = 8
+SIZE = 512
+
+SEQUENCE = struct.Struct('<Q')
+BODY = struct.Struct(f'<4sHHQddd64s{MAX_SURFACES * 16}s{MAX_SURFACES}d')
+OWNER = struct.Struct('<I')
+OWNER_OFFSET = SEQUENCE.size + BODY.size
+# reads retried while a write is in progress, far more than any write takes
+READ_TRIES = 100000
+
+
+def encode(text: str, size: int) -> bytes:
+    """Encode text as utf-8 in at most `size` bytes, cut on a character boundary so that it always decodes."""
+    return text.encode()[:size].decode('utf-8', 'ignore').encode()
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StatusBlock:
+
+    def __init__(self, memory: shared_memory.SharedMemory) -> None:
+        self.memory = memory
+        self.name = memory.name
+
+    @classmethod
+    def create(cls, name: str) -> 'StatusBlock':
+        """
+        Create the block, or reuse one left behind by an application which did not exit cleanly.
+
+        Raises FileExistsError if the block is published by another process which is still running.
+        """
+        try:
+            memory = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        except FileExistsError:
+            memory = shared_memory.SharedMemory(name=name)
+            owner = OWNER.unpack_from(memory.buf, OWNER_OFFSET)[0] if memory.size >= SIZE else 0
+            if owner and owner != os.getpid() and alive(owner):
+                # neither written nor removed by this process, the owner removes it when it exits
+                resource_tracker.unregister(memory._name, 'shared_memory')
+                memory.close()
+                raise FileExistsError(f"the status block '{name}' is published by process {owner}.")
+        memory.buf[:SIZE] = bytes(SIZE)
+        OWNER.pack_into(memory.buf, OWNER_OFFSET, os.getpid())
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name: str) -> 'StatusBlock':
+        """Attach to the block published by the application, raising FileNotFoundError if it is not running."""
+        memory = shared_memory.SharedMemory(name=name)
+        # only the application removes the block, not the readers when they exit
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return cls(memory)
+
+    @property
+    def sequence(self) -> int:
+        return SEQUENCE.unpack_from(self.memory.buf, 0)[0]
+
+    @property
+    def owner(self) -> int:
+        return OWNER.unpack_from(self.memory.buf, OWNER_OFFSET)[0]
+
+    def write(self, names: list, positions: list, pins: int, profile: Optional[str],
+              move_started: float, move_duration: float) -> None:
+        """Write a whole new state, there must only ever be one writer at a time."""
+        sequence = self.sequence
+        SEQUENCE.pack_into(self.memory.buf, 0, sequence + 1)
+        BODY.pack_into(
+            self.memory.buf, SEQUENCE.size,
+            MAGIC, VERSION, len(names), pins, move_started, move_duration, time.time(),
+            encode(profile or '', 64),
+            b''.join(encode(name, 16).ljust(16, b'\0') for name in names),
+            *(list(positions) + [0.0] * (MAX_SURFACES - len(positions))),
+        )
+        SEQUENCE.pack_into(self.memory.buf, 0, sequence + 2)
+
+    def read(self) -> Optional[dict]:
+        """
+        A consistent snapshot of the state, or None if nothing has been published yet.
+
+        Raises TimeoutError if no consistent copy could be made in `READ_TRIES` tries, as happens when
+        the writer died part way through a write.
+
+        :return: {'sequence', 'positions', 'pins', 'active_profile', 'moving', 'move_progress', 'updated'}
+        """
+        for _ in range(READ_TRIES):
+            before = self.sequence
+            if before % 2:
+                continue
+            body = bytes(self.memory.buf[SEQUENCE.size:SEQUENCE.size + BODY.size])
+            if self.sequence == before:
+                break
+        else:
+            raise TimeoutError(
+                f"'{self.name}' stayed mid-update, its writer (process {self.owner}) may have stopped while writing."
+            )
+        if not before:
+            return None
+
+        magic, version, count, pins, move_started, move_duration, updated, profile, names, *positions = BODY.unpack(body)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{self.name}' is not a version {VERSION} status block.")
+        names = [names[i * 16:(i + 1) * 16].rstrip(b'\0').decode() for i in range(count)]
+        progress = None
+        if move_started:
+            progress = min((time.monotonic() - move_started) / move_duration, 1) if move_duration else 1
+        return {
+            'sequence': before // 2,
+            'positions': dict(zip(names, positions)),
+            'pins': {
+                f"{name}.{action}": (pins >> (2 * i + bit)) & 1
+                for i, name in enumerate(names)
+                for bit, action in enumerate(('extend', 'retract'))
+            },
+            'active_profile': profile.rstrip(b'\0').decode() or None,
+            'moving': bool(move_started),
+            'move_progress': progress,
+            'updated': updated,
+        }
+
+    def close(self, unlink: bool = False) -> None:
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class StatusPublisher:
+    """Keep a `StatusBlock` up to date with every change of a `Controller` (see `Controller.add_listener()`)."""
+
+    def __init__(self, controller, name: str = 'surf_status') -> None:
+        if len(controller.surfaces) > MAX_SURFACES:
+            raise ValueError(f"the status block holds at most {MAX_SURFACES} surfaces.")
+        self.controller = controller
+        self.block = StatusBlock.create(name)
+        self.logger = logging.getLogger('Surf.Status')
+        # changes are made from several threads (the UI, the API, the motion engine), the block has one writer at a time
+        self.lock = threading.Lock()
+        self.move_started = 0.0
+        self.move_duration = 0.0
+        self.publish()
+        controller.add_listener(self.update)
+        atexit.register(self.close)
+        self.logger.info(f"publishing status to shared memory '{self.block.name}'")
+
+    def update(self, kind: str, name: str, value) -> None:
+        if kind == 'move':
+            self.move_started, self.move_duration = (time.monotonic(), value) if name == 'started' else (0.0, 0.0)
+        self.publish()
+
+    def publish(self) -> None:
+        surfaces = list(self.controller.surfaces.values())
+        pins = 0
+        for i, surface in enumerate(surfaces):
+            pins |= (surface.extend_pin.state << (2 * i)) | (surface.retract_pin.state << (2 * i + 1))
+        with self.lock:
+            self.block.write(
+                [surface.name for surface in surfaces],
+                [surface.position for surface in surfaces],
+                pins,
+                self.controller.active_profile,
+                self.move_started,
+                self.move_duration,
+            )
+
+    def close(self) -> None:
+        self.controller.remove_listener(self.update)
+        self.block.close(unlink=True)
+        atexit.unregister(self.close)
@@ -1,6 +1,7 @@
 import os
 import yaml
 import click
+import tempfile
 
 from datetime import datetime
 from shutil import copyfile
@@ -100,14 +101,22 @@ class Profile:
 
     def delete(self) -> None:
         if self.config_exists(username=self.username):
+            from utils import history
             os.remove(self.path)
+            history.ProfileHistory(self.username).delete()
             utils.logger.info(f"[UTILITIES] deleted profile: {self.path}")
         else:
             utils.logger.info(f'[UTILITIES] cannot delete profile which does not exist: {self.username}')
 
-    def update(self, new_config) -> None:
+    def update(self, new_config, source: str = 'dialog') -> None:
+        """:param source: what made the change, recorded in the profile's history (see `utils.history`)"""
         if self.config_exists(username=self.username):
+            from utils import history
             utils.logger.info(f'[UTILITIES] updating: {self.path}')
+            if 'control_surfaces' in new_config:
+                history.record(
+                    self.username, self._config['control_surfaces'], new_config['control_surfaces'], source
+                )
             self._config.update(new_config)
             with open(self.path, 'w') as outfile:
                 yaml.dump(self._config, outfile, default_flow_style=False, sort_keys=False)
@@ -127,13 +136,13 @@ def first_time_setup_check():
         utils.logger = utils.create_logger()
         utils.logger.info("[logger now available]")
 
-    for required_directory in [utils.PROFILES_DIR, utils.CONFIG_DIR]:
+    for required_directory in [utils.PROFILES_DIR, utils.CONFIG_DIR, utils.PROGRAMS_DIR, utils.HISTORY_DIR]:
         if not os.path.isdir(required_directory):
             utils.logger.info(f"`{required_directory}` does not exist, creating it now.")
             os.mkdir(required_directory)
 
     # ensure necessary configuration files are present
-    for required_config_file in ['control_surfaces.yml', 'operating_modes.yml']:
+    for required_config_file in ['control_surfaces.yml', 'operating_modes.yml', 'settings.yml']:
         if not os.path.isfile(os.path.join(utils.CONFIG_DIR, required_config_file)):
             update_config_from_template(required_config_file)
 
@@ -141,6 +150,10 @@ def first_time_setup_check():
     if not os.listdir(utils.PROFILES_DIR):
         copy_template_profiles()  # if none exist, the templates will be used
 
+    # ensure wave-programs exist
+    if not os.listdir(utils.PROGRAMS_DIR):
+        copy_template_programs()  # if none exist, the templates will be used
+
 
 def update_config_from_template(file_name: str) -> None:
     """Copy a configuration file template into the CONFIG_DIR"""
@@ -156,6 +169,24 @@ def update_config_from_template(file_name: str) -> None:
         replace_file(source_file, target_file)
 
 
+def read_settings() -> dict:
+    """
+    Read CONFIG_DIR/settings.yml.
+
+    Each section of the template which is missing from the configured file, or each key missing
+    from one of its sections, is filled in from the template so older configs keep working.
+    """
+    settings = yaml.safe_load(open(os.path.join(utils.ROOT_DIR, 'utils', 'config_templates', 'settings.yml'), 'r'))
+    config_path = os.path.join(utils.CONFIG_DIR, 'settings.yml')
+    if os.path.isfile(config_path):
+        for section, values in (yaml.safe_load(open(config_path, 'r')) or {}).items():
+            if isinstance(values, dict) and isinstance(settings.get(section), dict):
+                settings[section].update(values)
+            else:
+                settings[section] = values
+    return settings
+
+
 def update_operating_mode_value(mode: str, concurrency: int, context: str, new_value: str) -> None:
     """Update a value in CONFIG_DIR/operating_mode.yml"""
     config_path = os.path.join(utils.CONFIG_DIR, 'operating_modes.yml')
@@ -217,6 +248,8 @@ def update_wave_profile(profile_name: str, values: list) -> None:
 
         click.echo("")
         if click.confirm('Do you want to update this wave-profile?', abort=True):
+            from utils import history
+            history.record(username, wave_profile['control_surfaces'], new_profile_surface_values, 'cli')
             open(path, 'w').write(
                 yaml.dump(
                     {
@@ -276,8 +309,10 @@ def delete_wave_profile(profile_name: str) -> None:
     if not os.path.isfile(path):
         return f"{path} does not exist, so no need to delete it :)"
     else:
+        from utils import history
         utils.logger.info(f"Deleting file: {path}")
         os.remove(path)
+        history.ProfileHistory(username).delete()
 
 
 def copy_template_profiles() -> None:
@@ -290,6 +325,31 @@ def copy_template_profiles() -> None:
         )
 
 
+def atomic_write(path: str, text: str) -> None:
+    """Write a file so that readers see either the old or the new contents, never a partial write."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            outfile.write(text)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def copy_template_programs() -> None:
+    """Copy all of the file in utils/program_templates to PROGRAMS_DIR"""
+    template_dir = os.path.join('utils', 'program_templates')
+    for template_program_filename in os.listdir(template_dir):
+        replace_file(
+            source_file=os.path.join(template_dir, template_program_filename),
+            target_file=os.path.join(utils.PROGRAMS_DIR, template_program_filename)
+        )
+
+
 def replace_file(source_file: str, target_file: str) -> None:
     """Copy a file from one directory to another (with helpful logging messages)"""
     if os.path.isfile(target_file):
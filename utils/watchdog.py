@@ -0,0 +1,138 @@
+"""
+A watchdog which sets a pin LOW once it has stayed HIGH past its deadline.
+
+Every pin set HIGH for a known time is armed with the absolute `time.monotonic()` at which it is
+due LOW: a `Pin.high()` with a duration, a HIGH edge of a `Controller` or `AsyncController` move
+whose LOW edge is planned, and a pin of a `utils.feedback` move, whose deadline is its timeout. If
+the thread moving the surfaces stalls (a blocked log write, a long pause in the UI thread, an
+exception between the edges) and the pin is still armed `grace` seconds after its deadline, the
+watchdog's own thread writes it LOW through the backend and records the miss. The pin is written
+while the watchdog holds its lock, so a move cannot arm it again in between and have its new HIGH
+forced LOW, and before anything is logged, so a stall in logging itself cannot hold the pin HIGH.
+
+The watchdog only writes the hardware; the `Pin`'s state and the surface's position are still
+recorded by the stalled thread once it resumes and writes its own, by then redundant, LOW.
+
+Not covered: a pin set HIGH indefinitely (`Pin.high()` without a duration, from calibration or a
+manual hold), and the edges of a timed backend, which with `motion: isolated: true` are timed by
+the motion process (see `utils/motion.py`) whatever this process is doing. The watchdog runs in
+this process, so a pause which holds the interpreter's lock, rather than waiting on I/O, delays it
+too.
+"""
+import time
+import heapq
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict
+
+
+class PinWatchdog:
+
+    def __init__(self, backend, grace: float = 0.02, history: int = 1000) -> None:
+        """
+        :param backend: the `utils.backends.PinBackend` of the pins to watch
+        :param grace: seconds past its deadline a pin may still be HIGH before it is forced LOW
+        :param history: how many misses to keep
+        """
+        self.backend = backend
+        self.grace = grace
+        self.logger = logging.getLogger('Surf.Watchdog')
+        self.condition = threading.Condition()
+        # pin number -> the time.monotonic() it is due LOW
+        self.deadlines: Dict[int, float] = {}
+        # (deadline, pin number), including deadlines since disarmed, which are skipped
+        self.queue = []
+        # {'pin', 'deadline', 'late', 'at'} of each pin forced LOW, most recent last
+        self.misses = deque(maxlen=history)
+        self.stopped = False
+
+    @classmethod
+    def from_settings(cls, backend, settings: dict) -> 'PinWatchdog':
+        """:param settings: the `watchdog` section of settings.yml"""
+        return cls(backend, grace=settings['grace'])
+
+    def attach(self, controller) -> 'PinWatchdog':
+        """Watch the pins of a `Controller`, which arms and disarms them as it writes them."""
+        controller.watchdog = self
+        self.start()
+        atexit.register(self.log_summary)
+        return self
+
+    def arm(self, number: int, deadline: float) -> None:
+        """Expect a pin LOW by `deadline`, a `time.monotonic()`."""
+        with self.condition:
+            self.deadlines[number] = deadline
+            heapq.heappush(self.queue, (deadline, number))
+            if self.queue[0] == (deadline, number):
+                self.condition.notify()
+
+    def disarm(self, number: int) -> None:
+        """A pin was set LOW in time, or is HIGH without a deadline."""
+        with self.condition:
+            self.deadlines.pop(number, None)
+
+    def watch(self, states: Dict[int, bool], deadlines: Dict[int, float]) -> None:
+        """
+        Arm or disarm the pins a group of edges has just written.
+
+        :param states: {pin number: state} of the group
+        :param deadlines: the `time.monotonic()` each pin set HIGH by the group is due LOW
+        """
+        for number, state in states.items():
+            if state and number in deadlines:
+                self.arm(number, deadlines[number])
+            else:
+                self.disarm(number)
+
+    def expire(self) -> tuple:
+        """Wait for an armed pin to pass its deadline and the grace, write it LOW, and return (pin number, deadline)."""
+        with self.condition:
+            while not self.stopped:
+                while self.queue and self.deadlines.get(self.queue[0][1]) != self.queue[0][0]:
+                    heapq.heappop(self.queue)
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                deadline, number = self.queue[0]
+                remaining = deadline + self.grace - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                heapq.heappop(self.queue)
+                del self.deadlines[number]
+                self.backend.output(number, False)
+                return number, deadline
+        return None, None
+
+    def run(self) -> None:
+        while True:
+            number, deadline = self.expire()
+            if number is None:
+                return
+            late = time.monotonic() - deadline
+            self.misses.append({
+                'pin': number, 'deadline': deadline, 'late': late, 'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
+            self.logger.warning(
+                f"Pin {number} was still HIGH {round(late, 4)} seconds past its deadline, forced it LOW"
+            )
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name='SurfWatchdog', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def log_summary(self) -> None:
+        if self.misses:
+            self.logger.warning(
+                f"{len(self.misses)} pins were forced LOW past their deadline this session, "
+                f"at most {round(max(miss['late'] for miss in self.misses), 4)} seconds late"
+            )